@@ -12,6 +12,7 @@ from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from app.models.user import User
 from app.config import settings
+from app.services.device_cache import find_device_by_api_key
 
 # Logger
 logger = logging.getLogger(__name__)
@@ -107,10 +108,11 @@ async def get_device_by_api_key(api_key: str = Security(api_key_header)) -> Opti
             headers={"WWW-Authenticate": "ApiKey"},
         )
     
-    # Search for the device with this API key
-    devices = await list_documents("devices", {"api_key": api_key})
+    # Search for the device with this API key (cached, so devices keep sending data to
+    # the write-ahead log while the database is unreachable)
+    device = await find_device_by_api_key(api_key)
     
-    if not devices or len(devices) == 0:
+    if not device:
         logger.warning(f"Attempt to access with invalid API key: {api_key[:8]}...")
         raise HTTPException(
             status_code=401,
@@ -118,7 +120,7 @@ async def get_device_by_api_key(api_key: str = Security(api_key_header)) -> Opti
             headers={"WWW-Authenticate": "ApiKey"},
         )
     
-    return devices[0]
+    return device
 
 async def verify_device_ownership(device_id: str, owner_id: str) -> None:
     """
@@ -106,4 +106,9 @@ async def get_current_active_user(current_user = Depends(get_current_user)):
     if current_user.get("disabled", False):
         raise HTTPException(status_code=400, detail="Inactive user")
     
-    return current_user 
\ No newline at end of file
+    return current_user 
+
+def is_admin_user(user) -> bool:
+    """Check if a user is listed in ADMIN_USER_IDS"""
+    admin_ids = {user_id.strip() for user_id in settings.ADMIN_USER_IDS.split(",") if user_id.strip()}
+    return user.get("id") in admin_ids
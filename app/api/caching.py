@@ -0,0 +1,84 @@
+# app/api/caching.py
+"""
+GET condizionali (ETag e Last-Modified) per le letture dei digital twin.
+
+Ogni scrittura dei campioni incrementa digital_replica.version e aggiorna
+digital_replica.modified_at nello stesso update che salva i campioni (in modalità bucketed
+subito dopo aver scritto i bucket), quindi una lettura del solo sotto-documento basta per
+sapere se la risposta è cambiata: con If-None-Match
+(o If-Modified-Since) ancora validi l'endpoint risponde 304 senza leggere né serializzare
+lo storico.
+"""
+from typing import Dict, Any, Optional, Tuple
+from email.utils import format_datetime, parsedate_to_datetime
+import datetime
+
+from fastapi import Request, Response
+
+# Campi del twin necessari per controllare i permessi e calcolare i validatori
+VALIDATOR_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "owner_id": 1,
+    "digital_replica.version": 1,
+    "digital_replica.modified_at": 1,
+    "digital_replica.last_updated": 1
+}
+
+# Il client può riusare la risposta solo dopo averla rivalidata con il server
+CACHE_CONTROL = "private, no-cache"
+
+def get_validators(digital_twin: Dict[str, Any]) -> Tuple[str, Optional[datetime.datetime]]:
+    """ETag (dalla versione del twin) e istante dell'ultima modifica di un twin"""
+    digital_replica = digital_twin.get("digital_replica") or {}
+    etag = f'"{digital_twin["id"]}-{digital_replica.get("version", 0)}"'
+    last_modified = digital_replica.get("modified_at") or digital_replica.get("last_updated")
+    if not isinstance(last_modified, datetime.datetime):
+        last_modified = None
+    return etag, last_modified
+
+def _matches_etag(header: str, etag: str) -> bool:
+    """Confronto debole di If-None-Match: il prefisso W/ viene ignorato"""
+    if header.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+    """
+    True se il client ha già la versione corrente della risposta
+
+    If-None-Match ha la precedenza; If-Modified-Since viene usato solo senza ETag. Le date
+    HTTP hanno la precisione del secondo e il client rimanda il Last-Modified ricevuto,
+    quindi l'istante dell'ultima modifica viene troncato al secondo come in
+    set_validator_headers. Una scrittura nello stesso secondo della risposta precedente
+    non è distinguibile dalla data: solo l'ETag la rileva.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _matches_etag(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is not None:
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return last_modified.replace(microsecond=0) <= since
+
+def set_validator_headers(response: Response, etag: str, last_modified: Optional[datetime.datetime]) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if last_modified is not None:
+        response.headers["Last-Modified"] = format_datetime(
+            last_modified.replace(tzinfo=datetime.timezone.utc), usegmt=True
+        )
+
+def not_modified_response(etag: str, last_modified: Optional[datetime.datetime]) -> Response:
+    """Risposta 304 con gli stessi validatori della risposta completa"""
+    response = Response(status_code=304)
+    set_validator_headers(response, etag, last_modified)
+    return response
@@ -1,11 +1,25 @@
 # app/api/endpoints/devices.py
-from fastapi import APIRouter, HTTPException, Body, Depends, Header, Query, Path
-from typing import List, Optional, Dict, Any, Union
+from fastapi import APIRouter, HTTPException, Body, Depends, Header, Query, Path, Response, WebSocket, WebSocketDisconnect, status
+from typing import List, Optional, Dict, Any, Union, Literal
 from app.models.device import Device, SensorAttribute
-from app.db.crud import create_document, get_document, update_document, delete_document, list_documents
+from app.db.crud import create_document, get_document, update_document, delete_document, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.db.timeseries import delete_sensor_samples
+from app.db.rollups import delete_sensor_rollups
 from app.services.digital_twin_service import create_digital_twin_for_device
+from app.services.ingestion_queue import ingestion_pipeline, IngestionQueueFull
+from app.services.device_stream import DeviceStreamSession
+from app.services.gateway_ingestion import ingest_gateway_data
+from app.services.deduplication import claim_request, release_request
+from app.services.device_cache import get_device_template, invalidate_device
+from app.models.digital_twin import SensorData
+from app.models.sensor import GatewayPayload
 from app.api.auth import get_device_by_api_key, verify_device_ownership
+from app.api.payloads import ingestion_body
 from app.api.auth_service import get_current_active_user
+from app.api.pagination import list_page
+from app.api.serialization import trusted_dump, trusted_response
+from app.config import settings
+import asyncio
 import secrets
 router = APIRouter()
 @router.post("/debug", status_code=200)
@@ -97,7 +111,9 @@ async def create_device(
             template_id=template_id,
             attributes=processed_attributes,
             owner_id=device_data["owner_id"],
-            metadata=device_data.get("metadata", {})
+            metadata=device_data.get("metadata", {}),
+            is_gateway=device_data.get("is_gateway", False),
+            gateway_device_ids=device_data.get("gateway_device_ids", [])
         )
         
         # Se è richiesto di rigenerare API key o non è presente
@@ -154,10 +170,15 @@ async def create_device(
 
 @router.get("/", response_model=List[Device])
 async def list_devices(
+    response: Response,
     owner_id: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Dispositivi per pagina"),
+    cursor: Optional[str] = Query(None, description="Cursore della pagina successiva (header X-Next-Cursor)"),
+    sort: Optional[Literal["name"]] = Query(None, description="Campo di ordinamento (predefinito: ordine di creazione)"),
+    order: Literal["asc", "desc"] = Query("asc", description="Verso dell'ordinamento"),
     current_user: Dict[str, Any] = Depends(get_current_active_user)
 ):
-    """Ottieni tutti i dispositivi, opzionalmente filtrando per proprietario"""
+    """Ottieni i dispositivi, opzionalmente filtrando per proprietario, una pagina alla volta"""
     query = {}
     
     # Se viene specificato un owner_id, verifica che l'utente possa vedere questi dispositivi
@@ -172,8 +193,8 @@ async def list_devices(
         # Altrimenti, applica il filtro specificato
         query["owner_id"] = owner_id
         
-    devices = await list_documents("devices", query)
-    return devices
+    devices = await list_page("devices", query, response, limit, cursor, sort, order)
+    return trusted_response([trusted_dump(Device, device) for device in devices], response)
 
 @router.get("/{device_id}", response_model=Device)
 async def get_device(
@@ -193,7 +214,7 @@ async def get_device(
             detail="Non hai i permessi per accedere a questo dispositivo"
         )
     
-    return device
+    return trusted_response(trusted_dump(Device, device))
 
 @router.put("/{device_id}", response_model=Device)
 async def update_device(
@@ -256,6 +277,7 @@ async def update_device(
     
     # Aggiorna il dispositivo
     await update_document("devices", device_id, update_data)
+    invalidate_device(device_id)
     updated_device = await get_document("devices", device_id)
     
     # Se il proprietario è cambiato, aggiorna entrambi gli utenti
@@ -342,9 +364,12 @@ async def delete_device(
     # Se esiste un digital twin associato, eliminalo
     if device.get("digital_twin_id"):
         await delete_document("digital_twins", device["digital_twin_id"])
+        await delete_sensor_samples(device["digital_twin_id"])
+        await delete_sensor_rollups(device["digital_twin_id"])
         
     # Elimina il dispositivo
     await delete_document("devices", device_id)
+    invalidate_device(device_id)
     return None
 
 @router.post("/auth/verify", response_model=Device)
@@ -383,6 +408,7 @@ async def regenerate_api_key(
     
     # Aggiorna il dispositivo
     await update_document("devices", device_id, {"api_key": new_api_key})
+    invalidate_device(device_id)
     
     return {"api_key": new_api_key}
 
@@ -390,27 +416,49 @@ async def regenerate_api_key(
 
 @router.post("/data", status_code=200)
 async def send_device_data(
-    data: Dict[str, Any] = Body(...),
-    device: Device = Depends(get_device_by_api_key)
+    data: Dict[str, Any] = Depends(ingestion_body(Dict[str, Any])),
+    device: Device = Depends(get_device_by_api_key),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Invia dati da un dispositivo e aggiorna il suo digital twin
     
-    Supporta sia dispositivi basati su ontologia che template
+    Supporta sia dispositivi basati su ontologia che template.
+    Il corpo può essere in JSON, MessagePack (application/msgpack) o CBOR (application/cbor).
+    Il timestamp è assegnato dal server: per rendere sicuri i tentativi ripetuti il
+    dispositivo può indicare un header Idempotency-Key, e una richiesta già completata
+    (o ancora in corso) con la stessa chiave non viene rielaborata.
     """
+    # La chiave viene prenotata prima di qualsiasi await: il timestamp è assegnato dal
+    # server, quindi un tentativo concorrente non verrebbe riconosciuto come duplicato
+    if not claim_request(device["id"], idempotency_key):
+        return {"status": "success", "duplicate": True}
+    
+    try:
+        result = await _store_device_data(data, device)
+    except Exception:
+        release_request(device["id"], idempotency_key)
+        raise
+    
+    if result["status"] != "success":
+        release_request(device["id"], idempotency_key)
+    return result
+
+async def _store_device_data(data: Dict[str, Any], device: Dict[str, Any]) -> Dict[str, Any]:
+    """Valida gli attributi inviati da un dispositivo e li scrive sul dispositivo e sul suo digital twin"""
     from app.services.digital_twin_service import add_sensor_data_to_digital_twin
     import datetime
     from app.models.device_template import DeviceTemplate
     
     # Timestamp corrente
-    now = datetime.datetime.utcnow().isoformat()
+    now = datetime.datetime.utcnow()
     
     # Validazione dei dati ricevuti
     valid_data = {}
     
     # Se il dispositivo è basato su template
     if device.get("template_id"):
-        template = await get_document("device_templates", device["template_id"])
+        template = await get_device_template(device["template_id"])
         if template:
             template_model = DeviceTemplate(**template)
             
@@ -446,9 +494,44 @@ async def send_device_data(
     
     # Aggiorna gli attributi nel dispositivo
     if valid_data:
-        await update_document("devices", device["id"], {"attributes": valid_data})
+        if not ingestion_pipeline.running:
+            await update_document("devices", device["id"], {"attributes": valid_data, "attributes_updated_at": now})
+        elif not ingestion_pipeline.degraded:
+            # Con la pipeline attiva l'aggiornamento degli attributi non deve bloccare l'ingestione;
+            # se il database non è raggiungibile verranno aggiornati al prossimo invio
+            try:
+                await update_document("devices", device["id"], {"attributes": valid_data, "attributes_updated_at": now})
+            except Exception as e:
+                print(f"Warning: Could not update device attributes: {e}")
         
         #CORREZIONE: Usa il servizio dedicato per aggiornare il digital twin
+        if device.get("digital_twin_id") and ingestion_pipeline.running:
+            # I dati sono già validati: vengono accodati e scritti in background
+            samples = [
+                (
+                    device["digital_twin_id"],
+                    attr_name,
+                    SensorData(timestamp=now, value=attr_data["value"], unit_measure=attr_data["unit_measure"]).dict()
+                )
+                for attr_name, attr_data in valid_data.items()
+            ]
+            try:
+                await ingestion_pipeline.enqueue(samples)
+            except IngestionQueueFull as e:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Troppe misurazioni in coda, riprova più tardi",
+                    headers={"Retry-After": str(e.retry_after)}
+                )
+            
+            return {
+                "status": "success", 
+                "updated_attributes": list(valid_data.keys()),
+                "digital_twin_updated": True,
+                "updated_sensors": list(valid_data.keys()),
+                "queued": True
+            }
+        
         if device.get("digital_twin_id"):
             updated_sensors = []
             
@@ -475,3 +558,113 @@ async def send_device_data(
     else:
         return {"status": "warning", "message": "Nessun attributo valido fornito"}
 
+@router.post("/gateway/data", status_code=200)
+async def send_gateway_data(
+    payload: GatewayPayload = Depends(ingestion_body(GatewayPayload)),
+    gateway: Dict[str, Any] = Depends(get_device_by_api_key)
+):
+    """
+    Invia in una sola richiesta i dati di più dispositivi tramite un gateway
+    
+    Il gateway è un dispositivo con is_gateway, si autentica con la propria API key e può
+    inviare dati solo per i dispositivi in gateway_device_ids (e i loro digital twin) dello
+    stesso proprietario. Restituisce il risultato per ogni dispositivo.
+    Il corpo può essere in JSON, MessagePack (application/msgpack) o CBOR (application/cbor)
+    """
+    if not gateway.get("is_gateway"):
+        raise HTTPException(
+            status_code=403,
+            detail="Il dispositivo non è abilitato come gateway"
+        )
+    if not gateway.get("owner_id"):
+        raise HTTPException(
+            status_code=403,
+            detail="Il gateway deve avere un proprietario per inviare dati di altri dispositivi"
+        )
+    
+    try:
+        return await ingest_gateway_data(gateway, payload.devices)
+    except IngestionQueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Troppe misurazioni in coda, riprova più tardi",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def _flush_device_stream(websocket: WebSocket, device: Dict[str, Any], session: DeviceStreamSession) -> None:
+    """Scrive la finestra corrente di una connessione WebSocket e la conferma al dispositivo"""
+    while True:
+        try:
+            ack = await session.flush()
+            break
+        except IngestionQueueFull as e:
+            # Backpressure: la connessione smette di leggere finché la coda non si svuota
+            await websocket.send_json({"retry_after": e.retry_after})
+            await asyncio.sleep(e.retry_after)
+    
+    # Gli attributi del dispositivo vengono aggiornati una volta per finestra, con gli ultimi valori
+    latest_values = session.pop_latest_values()
+    if latest_values and not ingestion_pipeline.degraded:
+        try:
+            await update_document("devices", device["id"], {"attributes": latest_values})
+        except Exception as e:
+            print(f"Warning: Could not update device attributes: {e}")
+    
+    await websocket.send_json(ack)
+
+@router.websocket("/stream")
+async def device_data_stream(websocket: WebSocket):
+    """
+    Canale WebSocket per l'invio continuo di dati da un dispositivo
+    
+    Il dispositivo si autentica una sola volta con l'header X-API-Key (o il parametro
+    api_key), poi invia frame {"s": sequenza, "t": timestamp, "d": {sensore: valore}}.
+    I frame vengono scritti a finestre e confermati con {"ack": ultima sequenza scritta, ...};
+    i frame non confermati alla chiusura della connessione non sono stati scritti.
+    """
+    api_key = websocket.headers.get("x-api-key") or websocket.query_params.get("api_key")
+    try:
+        device = await get_device_by_api_key(api_key)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    digital_twin = None
+    if device.get("digital_twin_id"):
+        digital_twin = await get_document("digital_twins", device["digital_twin_id"])
+    if not digital_twin:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Digital Twin non trovato")
+        return
+    
+    await websocket.accept()
+    session = DeviceStreamSession(digital_twin)
+    loop = asyncio.get_running_loop()
+    ack_interval = settings.WEBSOCKET_ACK_INTERVAL_MS / 1000
+    deadline = None
+    
+    try:
+        while True:
+            # Attende il prossimo messaggio al massimo fino alla scadenza della finestra
+            timeout = None if deadline is None else max(0, deadline - loop.time())
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout)
+            except asyncio.TimeoutError:
+                message = None
+            
+            if message is not None:
+                if message["type"] == "websocket.disconnect":
+                    break
+                session.add_message(message.get("text") or message.get("bytes") or "")
+                if deadline is None:
+                    deadline = loop.time() + ack_interval
+            
+            if deadline is not None and (
+                session.pending_frames() >= settings.WEBSOCKET_ACK_WINDOW or loop.time() >= deadline
+            ):
+                await _flush_device_stream(websocket, device, session)
+                deadline = None
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Warning: WebSocket stream for device {device['id']} failed: {e}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
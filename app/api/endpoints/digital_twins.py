@@ -1,22 +1,74 @@
 # app/api/endpoints/digital_twins.py
-from fastapi import APIRouter, HTTPException, Body, Query, Depends
-from typing import List, Dict, Any, Optional
-from app.models.digital_twin import DigitalTwin
-from app.models.sensor import SensorMeasurement, BatchSensorMeasurements
-from app.db.crud import get_document, update_document, delete_document, list_documents
-from app.services.digital_twin_service import add_sensor_data_to_digital_twin, generate_random_sensor_data
+from fastapi import APIRouter, HTTPException, Body, Query, Depends, Request, Response, Header
+from fastapi.responses import StreamingResponse, JSONResponse
+from typing import List, Dict, Any, Optional, Literal
+import datetime
+from app.models.digital_twin import DigitalTwin, DigitalTwinSummary
+from app.models.fleet_query import FleetQuery
+from app.models.sensor import SensorMeasurement, BatchSensorMeasurements, ColumnarSensorMeasurements, UTCTimestamp
+from app.db.crud import get_document, update_document, delete_document, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.digital_twin_service import (
+    add_sensor_data_batch_to_digital_twin,
+    add_sensor_columns_to_digital_twin,
+    build_sensor_sample,
+    generate_random_sensor_data,
+    get_sensor_history,
+    build_latest_projection,
+    get_latest_sensor_values,
+    find_latest_sensor_values,
+    find_owner_digital_twin_ids,
+    build_summary_projection,
+    build_digital_twin_summary,
+    SUMMARY_EXTRA_FIELDS,
+    MAX_LATEST_TWINS
+)
+from app.services.ingestion_queue import ingestion_pipeline, IngestionQueueFull
+from app.services.bulk_upload import ingest_ndjson_stream, StreamUploadError
+from app.services.deduplication import claim_request, release_request
+from app.services.sensor_aggregation import aggregate_sensor_data, AGGREGATION_FUNCTIONS, TIME_RANGE_PRESETS
+from app.services.sensor_export import iter_sensor_samples, iter_export_chunks, iter_arrow_chunks, EXPORT_FORMATS
+from app.services.live_updates import iter_sse_events
+from app.services.fleet_query import build_fleet_filter
+from app.services.downsampling import downsample_sensor_data, DEFAULT_DOWNSAMPLE_POINTS, MAX_DOWNSAMPLE_POINTS
 from app.ontology.manager import OntologyManager
 from app.api.auth import get_device_by_api_key, verify_device_ownership
-from app.api.auth_service import get_current_active_user
+from app.api.payloads import ingestion_body, read_ingestion_payload, validate_payload
+from app.api.auth_service import get_current_active_user, is_admin_user
+from app.api.pagination import list_page, explain_page
+from app.api.serialization import trusted_dump, trusted_response
+from app.api.caching import (
+    VALIDATOR_PROJECTION,
+    get_validators,
+    is_not_modified,
+    not_modified_response,
+    set_validator_headers
+)
 
 router = APIRouter()
 
-@router.get("/", response_model=List[DigitalTwin])
+# Le risposte SSE non devono essere messe in cache né bufferizzate dai proxy
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@router.get("/", response_model=List[DigitalTwinSummary], response_model_exclude_unset=True)
 async def list_digital_twins(
+    response: Response,
     owner_id: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Digital twin per pagina"),
+    cursor: Optional[str] = Query(None, description="Cursore della pagina successiva (header X-Next-Cursor)"),
+    sort: Optional[Literal["name"]] = Query(None, description="Campo di ordinamento (predefinito: ordine di creazione)"),
+    order: Literal["asc", "desc"] = Query("asc", description="Verso dell'ordinamento"),
+    fields: Optional[List[Literal[tuple(SUMMARY_EXTRA_FIELDS)]]] = Query(
+        None, description="Campi da aggiungere alla rappresentazione ridotta (ripetibile)"
+    ),
     current_user: Dict[str, Any] = Depends(get_current_active_user)
 ):
-    """Ottieni tutti i digital twins, opzionalmente filtrando per proprietario"""
+    """
+    Ottieni i digital twins, opzionalmente filtrando per proprietario, una pagina alla volta
+    
+    Ogni twin è in forma ridotta (id, name, device_type, last_updated e ultimo valore di
+    ogni sensore), letta dal database con una proiezione e senza lo storico dei sensori;
+    fields aggiunge altri campi. Lo storico si legge con /{id}/data
+    """
     query = {}
     
     # Se viene specificato un owner_id, verifica che l'utente possa vedere questi digital twins
@@ -31,38 +83,132 @@ async def list_digital_twins(
         # Altrimenti, applica il filtro specificato
         query["owner_id"] = owner_id
         
-    digital_twins = await list_documents("digital_twins", query)
-    return digital_twins
+    digital_twins = await list_page(
+        "digital_twins", query, response, limit, cursor, sort, order, build_summary_projection(fields)
+    )
+    return trusted_response([build_digital_twin_summary(digital_twin) for digital_twin in digital_twins], response)
+
+@router.post("/query", response_model=List[DigitalTwinSummary], response_model_exclude_unset=True)
+async def query_digital_twins(
+    response: Response,
+    fleet_query: FleetQuery = Body(...),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Digital twin per pagina"),
+    cursor: Optional[str] = Query(None, description="Cursore della pagina successiva (header X-Next-Cursor)"),
+    sort: Optional[Literal["name"]] = Query(None, description="Campo di ordinamento (predefinito: ordine di creazione)"),
+    order: Literal["asc", "desc"] = Query("asc", description="Verso dell'ordinamento"),
+    fields: Optional[List[Literal[tuple(SUMMARY_EXTRA_FIELDS)]]] = Query(
+        None, description="Campi da aggiungere alla rappresentazione ridotta (ripetibile)"
+    ),
+    explain: bool = Query(False, description="Restituisce il piano di esecuzione invece dei twin (solo amministratori)"),
+    current_user: Dict[str, Any] = Depends(get_current_active_user)
+):
+    """
+    Cerca i digital twin che soddisfano tutte le condizioni di un filtro, una pagina alla volta
+    
+    Il filtro seleziona tipo (con include_subtypes anche le sottoclassi dell'ontologia),
+    proprietario, sensori compatibili, confronti sull'ultimo valore dei sensori (latest)
+    e finestra sull'ultimo aggiornamento; i twin sono restituiti in forma ridotta come
+    dalla lista. Con explain gli amministratori ottengono filtro Mongo e piano di esecuzione
+    """
+    is_admin = is_admin_user(current_user)
+    if explain and not is_admin:
+        raise HTTPException(status_code=403, detail="Solo gli amministratori possono vedere il piano di esecuzione")
+    
+    # Solo gli amministratori possono cercare tra i twin di altri proprietari (o di tutti)
+    owner_id = fleet_query.owner_id if is_admin else current_user["id"]
+    try:
+        query = build_fleet_filter(fleet_query, owner_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    projection = build_summary_projection(fields)
+    if explain:
+        return JSONResponse(await explain_page("digital_twins", query, limit, cursor, sort, order, projection))
+    
+    digital_twins = await list_page("digital_twins", query, response, limit, cursor, sort, order, projection)
+    return trusted_response([build_digital_twin_summary(digital_twin) for digital_twin in digital_twins], response)
+
+@router.get("/latest", response_model=Dict[str, Dict[str, Dict[str, Any]]])
+async def get_latest_sensor_data_of_digital_twins(
+    ids: List[str] = Query(..., description="ID dei digital twin (ripetibile)"),
+    sensors: Optional[List[str]] = Query(None, description="Sensori da restituire (ripetibile)"),
+    current_user: Dict[str, Any] = Depends(get_current_active_user)
+):
+    """
+    Ottieni l'ultimo valore di ogni sensore di più digital twin
+    
+    Restituisce per ogni twin dell'utente corrente lo stato più recente dei sensori;
+    i twin inesistenti o di altri utenti vengono omessi
+    """
+    if len(ids) > MAX_LATEST_TWINS:
+        raise HTTPException(status_code=400, detail=f"Al massimo {MAX_LATEST_TWINS} digital twin per richiesta")
+    
+    return await find_latest_sensor_values(list(dict.fromkeys(ids)), current_user["id"], sensors)
+
+@router.get("/events")
+async def stream_digital_twins_updates(
+    current_user: Dict[str, Any] = Depends(get_current_active_user)
+):
+    """
+    Ricevi in tempo reale i nuovi campioni di tutti i digital twin dell'utente (Server-Sent Events)
+    
+    Gli eventi "samples" contengono i campioni scritti dopo l'apertura della connessione,
+    raggruppati per twin e sensore; i twin creati dopo l'apertura non sono inclusi
+    """
+    digital_twin_ids = await find_owner_digital_twin_ids(current_user["id"])
+    return StreamingResponse(iter_sse_events(digital_twin_ids), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.get("/{digital_twin_id}", response_model=DigitalTwin)
 async def get_digital_twin(
     digital_twin_id: str,
+    request: Request,
+    response: Response,
     current_user: Dict[str, Any] = Depends(get_current_active_user)
 ):
-    """Ottieni un digital twin specifico tramite ID"""
-    digital_twin = await get_document("digital_twins", digital_twin_id)
-    if not digital_twin:
+    """
+    Ottieni un digital twin specifico tramite ID
+    
+    Supporta i GET condizionali: se il client invia l'ETag (If-None-Match) o la data
+    (If-Modified-Since) della versione corrente la risposta è un 304, senza leggere il documento
+    """
+    validators = await get_document("digital_twins", digital_twin_id, VALIDATOR_PROJECTION)
+    if not validators:
         raise HTTPException(status_code=404, detail="Digital Twin non trovato")
     
     # Verifica che l'utente corrente possa accedere a questo digital twin
-    if digital_twin.get("owner_id") != current_user["id"]:
+    if validators.get("owner_id") != current_user["id"]:
         # Qui potresti implementare controlli di ruolo più avanzati (es. admin)
         raise HTTPException(
             status_code=403, 
             detail="Non hai i permessi per accedere a questo Digital Twin"
         )
     
-    return digital_twin
+    # I validatori vengono letti prima del documento: una scrittura nel mezzo produce
+    # al più una risposta più recente del suo ETag, che il client rivaliderà
+    etag, last_modified = get_validators(validators)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    
+    digital_twin = await get_document("digital_twins", digital_twin_id)
+    if not digital_twin:
+        raise HTTPException(status_code=404, detail="Digital Twin non trovato")
+    
+    set_validator_headers(response, etag, last_modified)
+    return trusted_response(trusted_dump(DigitalTwin, digital_twin), response)
 
 @router.post("/{digital_twin_id}/data", status_code=201)
 async def add_sensor_measurement(
     digital_twin_id: str, 
-    measurement: SensorMeasurement,
-    authenticated_device = Depends(get_device_by_api_key)
+    measurement: SensorMeasurement = Depends(ingestion_body(SensorMeasurement)),
+    authenticated_device = Depends(get_device_by_api_key),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Aggiungi una nuova misurazione al digital twin
     
+    Il corpo può essere in JSON, MessagePack (application/msgpack) o CBOR (application/cbor).
+    Una misurazione già ricevuta (stesso sensore e timestamp, o stesso header
+    Idempotency-Key) non viene riscritta e la risposta riporta "duplicate": true.
     Richiede autenticazione tramite API key del dispositivo
     """
     dt = await get_document("digital_twins", digital_twin_id)
@@ -82,28 +228,52 @@ async def add_sensor_measurement(
             status_code=400, 
             detail=f"Il sensore '{measurement.attribute_name}' non è compatibile con questo Digital Twin"
         )
-        
-    success = await add_sensor_data_to_digital_twin(
-        digital_twin_id,
-        measurement.attribute_name,
-        measurement.value,
-        measurement.timestamp
-    )
     
-    if not success:
-        raise HTTPException(status_code=400, detail="Impossibile aggiungere i dati del sensore")
+    # La chiave viene prenotata prima di qualsiasi await: un tentativo concorrente risulta duplicato
+    if not claim_request(digital_twin_id, idempotency_key):
+        return {"message": "Dati del sensore già ricevuti", "duplicate": True}
+    
+    try:
+        # Con la pipeline write-behind attiva il campione viene accodato e scritto in background
+        if ingestion_pipeline.running:
+            sample = build_sensor_sample(dt, measurement.attribute_name, measurement.value, measurement.timestamp)
+            try:
+                duplicates = await ingestion_pipeline.enqueue([(digital_twin_id, measurement.attribute_name, sample)])
+            except IngestionQueueFull as e:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Troppe misurazioni in coda, riprova più tardi",
+                    headers={"Retry-After": str(e.retry_after)}
+                )
+            return {"message": "Dati del sensore accodati", "queued": True, "duplicate": duplicates > 0}
         
-    return {"message": "Dati del sensore aggiunti con successo"}
+        # Il twin è già caricato: stesso percorso del batch, che riporta anche i duplicati
+        batch_result = await add_sensor_data_batch_to_digital_twin(dt, [measurement])
+        
+        if batch_result["errors"]:
+            raise HTTPException(status_code=400, detail="Impossibile aggiungere i dati del sensore")
+    except Exception:
+        release_request(digital_twin_id, idempotency_key)
+        raise
+    
+    return {"message": "Dati del sensore aggiunti con successo", "duplicate": batch_result["duplicates"] > 0}
 
 @router.post("/{digital_twin_id}/data/batch", status_code=201)
 async def add_batch_sensor_measurements(
     digital_twin_id: str, 
-    batch: BatchSensorMeasurements,
-    authenticated_device = Depends(get_device_by_api_key)
+    payload: Any = Depends(read_ingestion_payload),
+    authenticated_device = Depends(get_device_by_api_key),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Aggiungi multiple misurazioni al digital twin in una singola richiesta
     
+    Il corpo può essere in JSON, MessagePack (application/msgpack) o CBOR (application/cbor),
+    con le misurazioni per riga ({"measurements": [...]}) o in forma colonnare
+    ({sensore: {"ts": [...], "values": [...]}}).
+    Le misurazioni già ricevute (stesso sensore e timestamp) vengono scartate e contate in
+    "duplicates"; se la richiesta ripete un header Idempotency-Key già completato nessuna
+    misurazione viene riscritta.
     Richiede autenticazione tramite API key del dispositivo
     """
     dt = await get_document("digital_twins", digital_twin_id)
@@ -117,47 +287,99 @@ async def add_batch_sensor_measurements(
             detail="Non sei autorizzato a inviare dati a questo Digital Twin"
         )
     
-    # Verifica che tutti i sensori siano compatibili con il digital twin
-    compatible_sensors = dt.get("compatible_sensors", [])
-    failed_measurements = []
-    successful_count = 0
-    
-    for i, measurement in enumerate(batch.measurements):
-        if measurement.attribute_name not in compatible_sensors:
-            failed_measurements.append({
-                "index": i,
-                "attribute_name": measurement.attribute_name,
-                "error": f"Il sensore '{measurement.attribute_name}' non è compatibile con questo Digital Twin"
-            })
-            continue
-            
-        success = await add_sensor_data_to_digital_twin(
-            digital_twin_id,
-            measurement.attribute_name,
-            measurement.value,
-            measurement.timestamp
-        )
+    # La forma colonnare viene trasformata direttamente nei campioni, senza un modello per misurazione
+    if isinstance(payload, dict) and "measurements" not in payload:
+        columns = validate_payload(ColumnarSensorMeasurements, payload).root
+        total = sum(len(column.ts) for column in columns.values())
+        if not claim_request(digital_twin_id, idempotency_key):
+            return {"message": f"Processate {total} misurazioni", "successful": 0, "duplicates": total, "failed": 0}
         
-        if success:
-            successful_count += 1
-        else:
-            failed_measurements.append({
-                "index": i,
-                "attribute_name": measurement.attribute_name,
-                "error": "Impossibile aggiungere i dati del sensore"
-            })
+        try:
+            batch_result = await add_sensor_columns_to_digital_twin(dt, columns)
+        except Exception:
+            release_request(digital_twin_id, idempotency_key)
+            raise
+        failed_measurements = batch_result["errors"]
+        successful_count = batch_result["successful"]
+        duplicates = batch_result["duplicates"]
+        
+        result = {
+            "message": f"Processate {total} misurazioni",
+            "successful": successful_count,
+            "duplicates": duplicates,
+            "failed": total - successful_count - duplicates
+        }
+        if failed_measurements:
+            result["errors"] = failed_measurements
+            release_request(digital_twin_id, idempotency_key)
+        
+        return result
+    
+    batch = validate_payload(BatchSensorMeasurements, payload)
+    total = len(batch.measurements)
+    if not claim_request(digital_twin_id, idempotency_key):
+        return {"message": f"Processate {total} misurazioni", "successful": 0, "duplicates": total, "failed": 0}
+    
+    # Verifica la compatibilità in memoria e scrive tutte le misurazioni con un solo update
+    try:
+        batch_result = await add_sensor_data_batch_to_digital_twin(dt, batch.measurements)
+    except Exception:
+        release_request(digital_twin_id, idempotency_key)
+        raise
+    failed_measurements = batch_result["errors"]
+    successful_count = batch_result["successful"]
     
     result = {
-        "message": f"Processate {len(batch.measurements)} misurazioni",
+        "message": f"Processate {total} misurazioni",
         "successful": successful_count,
+        "duplicates": batch_result["duplicates"],
         "failed": len(failed_measurements)
     }
     
     if failed_measurements:
         result["errors"] = failed_measurements
+        release_request(digital_twin_id, idempotency_key)
     
     return result
 
+@router.post("/{digital_twin_id}/data/stream", status_code=201)
+async def stream_sensor_measurements(
+    digital_twin_id: str,
+    request: Request,
+    authenticated_device = Depends(get_device_by_api_key)
+):
+    """
+    Carica in streaming un numero illimitato di misurazioni in formato NDJSON
+    
+    Una misurazione JSON per riga (timestamp, attribute_name, value, unit_measure opzionale),
+    con corpo eventualmente compresso (Content-Encoding: gzip). Le righe vengono validate
+    e scritte a blocchi; la risposta riporta le righe accettate e scartate.
+    
+    Richiede autenticazione tramite API key del dispositivo
+    """
+    dt = await get_document("digital_twins", digital_twin_id)
+    if not dt:
+        raise HTTPException(status_code=404, detail="Digital Twin non trovato")
+    
+    # Verifica che il digital twin appartenga al dispositivo autenticato
+    if dt.get("device_id") != authenticated_device.get("id"):
+        raise HTTPException(
+            status_code=403,
+            detail="Non sei autorizzato a inviare dati a questo Digital Twin"
+        )
+    
+    content_encoding = request.headers.get("content-encoding", "identity").lower()
+    if content_encoding not in ("identity", "gzip"):
+        raise HTTPException(
+            status_code=415,
+            detail=f"Content-Encoding '{content_encoding}' non supportato"
+        )
+    
+    try:
+        return await ingest_ndjson_stream(dt, request.stream(), content_encoding == "gzip")
+    except StreamUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/{digital_twin_id}/generate-data", status_code=201)
 async def generate_data(
     digital_twin_id: str,
@@ -186,11 +408,37 @@ async def generate_data(
 @router.get("/{digital_twin_id}/data", response_model=Dict[str, List[Dict[str, Any]]])
 async def get_sensor_data(
     digital_twin_id: str, 
+    request: Request,
+    response: Response,
     sensor_type: Optional[str] = None,
+    sensors: Optional[List[str]] = Query(None, description="Sensori da restituire (ripetibile)"),
+    start: Optional[UTCTimestamp] = Query(None, description="Inizio dell'intervallo (ISO-8601, incluso)"),
+    end: Optional[UTCTimestamp] = Query(None, description="Fine dell'intervallo (ISO-8601, inclusa)"),
+    limit: Optional[int] = Query(None, ge=1, description="Numero massimo di campioni per sensore"),
+    order: Literal["asc", "desc"] = Query("asc", description="Ordine dei campioni; con desc e limit i più recenti"),
+    fields: Optional[List[Literal["timestamp", "value", "unit_measure"]]] = Query(
+        None, description="Campi dei campioni da restituire (ripetibile)"
+    ),
+    downsample: Optional[Literal["lttb", "minmax"]] = Query(
+        None, description="Decimazione visuale dei campioni per i grafici"
+    ),
+    points: int = Query(
+        DEFAULT_DOWNSAMPLE_POINTS, ge=3, le=MAX_DOWNSAMPLE_POINTS,
+        description="Numero massimo di campioni per sensore con downsample"
+    ),
     current_user: Dict[str, Any] = Depends(get_current_active_user)
 ):
-    """Ottieni i dati dei sensori da un digital twin"""
-    dt = await get_document("digital_twins", digital_twin_id)
+    """
+    Ottieni i dati dei sensori da un digital twin
+    
+    Sensori, intervallo temporale, limite, ordine e campi vengono applicati dal database,
+    quindi la risposta dipende dalla finestra richiesta e non dalla lunghezza dello storico.
+    Con downsample i campioni di ogni sensore vengono ridotti a non più di points,
+    mantenendo la forma della curva. Se lo storico non è cambiato dalla versione indicata
+    dal client (If-None-Match o If-Modified-Since) la risposta è un 304, senza leggerlo
+    """
+    # Lo storico viene letto dal database già filtrato, non con il documento del twin
+    dt = await get_document("digital_twins", digital_twin_id, VALIDATOR_PROJECTION)
     if not dt:
         raise HTTPException(status_code=404, detail="Digital Twin non trovato")
     
@@ -202,18 +450,156 @@ async def get_sensor_data(
             detail="Non hai i permessi per accedere a questo Digital Twin"
         )
         
-    if not dt.get("digital_replica") or not dt["digital_replica"].get("sensor_data"):
-        return {}
-        
-    sensor_data = dt["digital_replica"]["sensor_data"]
+    etag, last_modified = get_validators(dt)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    set_validator_headers(response, etag, last_modified)
+    
+    # Restituisci solo i dati dei sensori richiesti, se indicati
+    sensor_types = None
+    if sensor_type or sensors:
+        sensor_types = list(dict.fromkeys((sensors or []) + ([sensor_type] if sensor_type else [])))
+    
+    if not downsample:
+        sensor_data = await get_sensor_history(dt, sensor_types, start, end, limit, order == "desc", fields)
+        return trusted_response(sensor_data, response)
+    
+    # La decimazione ha bisogno di timestamp e valore anche se non sono tra i campi richiesti
+    read_fields = list(dict.fromkeys(fields + ["timestamp", "value"])) if fields else None
+    sensor_data = await get_sensor_history(dt, sensor_types, start, end, limit, order == "desc", read_fields)
+    return trusted_response(downsample_sensor_data(sensor_data, points, downsample, order == "desc", fields), response)
+
+@router.get("/{digital_twin_id}/data/aggregate", response_model=Dict[str, Any])
+async def get_aggregated_sensor_data(
+    digital_twin_id: str,
+    sensors: Optional[List[str]] = Query(None, description="Sensori da aggregare (ripetibile)"),
+    interval: str = Query("1h", description="Ampiezza degli intervalli, ad esempio 1m, 15m, 1h, 1d"),
+    fn: Literal[AGGREGATION_FUNCTIONS] = Query("avg", description="Funzione di aggregazione"),
+    start: Optional[UTCTimestamp] = Query(None, description="Inizio dell'intervallo (ISO-8601, incluso)"),
+    end: Optional[UTCTimestamp] = Query(None, description="Fine dell'intervallo (ISO-8601, inclusa)"),
+    time_range: Optional[Literal[tuple(TIME_RANGE_PRESETS)]] = Query(
+        None, alias="range", description="Intervallo predefinito fino ad ora, in alternativa a start/end"
+    ),
+    current_user: Dict[str, Any] = Depends(get_current_active_user)
+):
+    """
+    Ottieni i dati dei sensori aggregati a intervalli fissi
     
-    if sensor_type:
-        # Restituisci solo i dati per un tipo specifico di sensore
-        if sensor_type in sensor_data:
-            return {sensor_type: sensor_data[sensor_type]}
-        return {}
-        
-    return sensor_data
+    Restituisce l'asse dei tempi (inizio di ogni intervallo) e per ogni sensore una serie
+    parallela di valori (null, o 0 per count, negli intervalli senza campioni). L'aggregazione viene
+    eseguita dal database, sugli aggregati precalcolati dei bucket quando possibile.
+    """
+    dt = await get_document("digital_twins", digital_twin_id, {"digital_replica.sensor_data": 0})
+    if not dt:
+        raise HTTPException(status_code=404, detail="Digital Twin non trovato")
+    
+    # Verifica che l'utente corrente possa accedere a questo digital twin
+    if dt.get("owner_id") != current_user["id"]:
+        raise HTTPException(
+            status_code=403, 
+            detail="Non hai i permessi per accedere a questo Digital Twin"
+        )
+    
+    if time_range:
+        end = datetime.datetime.utcnow()
+        start = end - TIME_RANGE_PRESETS[time_range]
+    
+    try:
+        return await aggregate_sensor_data(dt, sensors, interval, fn, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/{digital_twin_id}/data/export")
+async def export_sensor_data(
+    digital_twin_id: str,
+    export_format: Literal["csv", "ndjson", "arrow"] = Query("ndjson", alias="format", description="Formato dell'esportazione"),
+    sensors: Optional[List[str]] = Query(None, description="Sensori da esportare (ripetibile)"),
+    start: Optional[UTCTimestamp] = Query(None, description="Inizio dell'intervallo (ISO-8601, incluso)"),
+    end: Optional[UTCTimestamp] = Query(None, description="Fine dell'intervallo (ISO-8601, inclusa)"),
+    accept_encoding: Optional[str] = Header(None),
+    current_user: Dict[str, Any] = Depends(get_current_active_user)
+):
+    """
+    Esporta in streaming lo storico dei sensori in formato CSV, NDJSON o Arrow IPC
+    
+    I campioni vengono letti dal database a batch e inviati a blocchi, compressi in gzip
+    se il client lo accetta (Accept-Encoding), quindi la memoria usata non dipende dalla
+    dimensione dell'esportazione. Lo stream Arrow (record batch colonnari) non viene
+    compresso, così il client può leggerne i buffer direttamente.
+    """
+    dt = await get_document("digital_twins", digital_twin_id, {"_id": 0, "id": 1, "owner_id": 1})
+    if not dt:
+        raise HTTPException(status_code=404, detail="Digital Twin non trovato")
+    
+    # Verifica che l'utente corrente possa accedere a questo digital twin
+    if dt.get("owner_id") != current_user["id"]:
+        raise HTTPException(
+            status_code=403, 
+            detail="Non hai i permessi per accedere a questo Digital Twin"
+        )
+    
+    samples = iter_sensor_samples(dt["id"], sensors, start, end)
+    headers = {"Content-Disposition": f'attachment; filename="{digital_twin_id}.{export_format}"'}
+    if export_format == "arrow":
+        chunks = iter_arrow_chunks(samples)
+    else:
+        gzip_encoded = "gzip" in (accept_encoding or "").lower()
+        if gzip_encoded:
+            headers["Content-Encoding"] = "gzip"
+        chunks = iter_export_chunks(samples, export_format, gzip_encoded)
+    
+    return StreamingResponse(chunks, media_type=EXPORT_FORMATS[export_format], headers=headers)
+
+@router.get("/{digital_twin_id}/events")
+async def stream_digital_twin_updates(
+    digital_twin_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_active_user)
+):
+    """
+    Ricevi in tempo reale i nuovi campioni di un digital twin (Server-Sent Events)
+    
+    Ogni evento "samples" contiene solo i campioni scritti dopo il precedente, raggruppati
+    per sensore; se il client resta indietro riceve solo l'ultimo campione di ogni sensore
+    e il numero di campioni scartati ("dropped"). Senza nuovi dati viene inviato
+    periodicamente un commento di keep-alive.
+    """
+    dt = await get_document("digital_twins", digital_twin_id, {"_id": 0, "id": 1, "owner_id": 1})
+    if not dt:
+        raise HTTPException(status_code=404, detail="Digital Twin non trovato")
+    
+    # Verifica che l'utente corrente possa accedere a questo digital twin
+    if dt.get("owner_id") != current_user["id"]:
+        raise HTTPException(
+            status_code=403, 
+            detail="Non hai i permessi per accedere a questo Digital Twin"
+        )
+    
+    return StreamingResponse(iter_sse_events([dt["id"]]), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/{digital_twin_id}/latest", response_model=Dict[str, Dict[str, Any]])
+async def get_latest_sensor_data(
+    digital_twin_id: str,
+    sensors: Optional[List[str]] = Query(None, description="Sensori da restituire (ripetibile)"),
+    current_user: Dict[str, Any] = Depends(get_current_active_user)
+):
+    """
+    Ottieni l'ultimo valore di ogni sensore di un digital twin
+    
+    Il valore, l'unità di misura e il timestamp dell'ultimo campione di ogni sensore sono
+    mantenuti nel twin ad ogni scrittura, quindi la risposta non dipende dallo storico
+    """
+    dt = await get_document("digital_twins", digital_twin_id, build_latest_projection(sensors))
+    if not dt:
+        raise HTTPException(status_code=404, detail="Digital Twin non trovato")
+    
+    # Verifica che l'utente corrente possa accedere a questo digital twin
+    if dt.get("owner_id") != current_user["id"]:
+        raise HTTPException(
+            status_code=403, 
+            detail="Non hai i permessi per accedere a questo Digital Twin"
+        )
+    
+    return get_latest_sensor_values(dt)
 
 @router.get("/{digital_twin_id}/compatibility", response_model=Dict[str, Any])
 async def check_sensor_compatibility(
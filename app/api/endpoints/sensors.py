@@ -1,8 +1,9 @@
 # app/api/endpoints/sensors.py
 from fastapi import APIRouter, HTTPException, Body, Query
 from typing import List, Dict, Any, Optional
-from app.models.sensor import SensorMeasurement, SensorType
+from app.models.sensor import SensorMeasurement, SensorType, UTCTimestamp
 from app.db.crud import create_document, get_document, update_document, delete_document, list_documents
+from app.db.database import get_database
 from app.ontology.manager import OntologyManager
 
 router = APIRouter()
@@ -93,8 +94,8 @@ async def add_sensor_measurement(measurement: SensorMeasurement):
 @router.get("/measurements", response_model=List[Dict[str, Any]])
 async def get_sensor_measurements(
     sensor_type: Optional[str] = None,
-    start_time: Optional[str] = None,
-    end_time: Optional[str] = None,
+    start_time: Optional[UTCTimestamp] = None,
+    end_time: Optional[UTCTimestamp] = None,
     limit: int = 100
 ):
     """Ottiene le misurazioni dei sensori con filtri opzionali"""
@@ -1,9 +1,11 @@
 # app/api/endpoints/templates.py
-from fastapi import APIRouter, HTTPException, Body, Depends, Query
-from typing import List, Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Body, Depends, Query, Response
+from typing import List, Optional, Dict, Any, Literal
 from app.models.device_template import DeviceTemplate, AttributeDefinition, AttributeType
-from app.db.crud import create_document, get_document, update_document, delete_document, list_documents
+from app.db.crud import create_document, get_document, update_document, delete_document, count_documents, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from app.api.auth_service import get_current_active_user
+from app.services.device_cache import invalidate_device_template
+from app.api.pagination import list_page
 from app.ontology.manager import OntologyManager
 import datetime
 router = APIRouter()
@@ -48,11 +50,16 @@ async def debug_templates():
 # Modifica temporaneamente l'endpoint list (rimuovi il parametro current_user)
 @router.get("/", response_model=List[DeviceTemplate])
 async def list_device_templates(
+    response: Response,
     owner_id: Optional[str] = None,
     is_ontology_based: Optional[bool] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Templates per page"),
+    cursor: Optional[str] = Query(None, description="Cursor of the next page (X-Next-Cursor header)"),
+    sort: Optional[Literal["name"]] = Query(None, description="Sort field (default: creation order)"),
+    order: Literal["asc", "desc"] = Query("asc", description="Sort direction"),
     current_user: Dict[str, Any] = Depends(get_current_active_user)
 ):
-    """Get all device templates, optionally filtering by owner or type"""
+    """Get device templates, optionally filtering by owner or type, one page at a time"""
     query = {}
     
     # If an owner_id is specified
@@ -63,8 +70,7 @@ async def list_device_templates(
     if is_ontology_based is not None:
         query["is_ontology_based"] = is_ontology_based
     
-    templates = await list_documents("device_templates", query)
-    return templates
+    return await list_page("device_templates", query, response, limit, cursor, sort, order)
 
 @router.get("/{template_id}", response_model=DeviceTemplate)
 async def get_device_template(
@@ -102,6 +108,7 @@ async def update_device_template(
     
     # Update the template
     await update_document("device_templates", template_id, update_data)
+    invalidate_device_template(template_id)
     updated_template = await get_document("device_templates", template_id)
     
     return updated_template
@@ -125,14 +132,15 @@ async def delete_device_template(
         )
     
     # Check if there are devices using this template
-    devices_with_template = await list_documents("devices", {"template_id": template_id})
+    devices_with_template = await count_documents("devices", {"template_id": template_id})
     if devices_with_template:
         raise HTTPException(
             status_code=400,
-            detail=f"Cannot delete template: it is used by {len(devices_with_template)} devices"
+            detail=f"Cannot delete template: it is used by {devices_with_template} devices"
         )
     
     await delete_document("device_templates", template_id)
+    invalidate_device_template(template_id)
     return None
 
 @router.post("/from-ontology", response_model=DeviceTemplate)
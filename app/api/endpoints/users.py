@@ -1,10 +1,17 @@
 # app/api/endpoints/users.py
-from fastapi import APIRouter, HTTPException, Body, Path, Depends
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, HTTPException, Body, Path, Depends, Query, Response
+from typing import List, Dict, Any, Optional, Literal
 
 from app.models.user import User
-from app.db.crud import create_document, get_document, update_document, delete_document, list_documents
+from app.models.digital_twin import DigitalTwinSummary
+from app.services.digital_twin_service import build_summary_projection, build_digital_twin_summary, SUMMARY_EXTRA_FIELDS
+from app.db.crud import create_document, get_document, update_document, delete_document, list_documents, list_documents_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.db.timeseries import delete_sensor_samples
+from app.db.rollups import delete_sensor_rollups
+from app.services.device_cache import invalidate_device
 from app.api.auth_service import get_current_active_user
+from app.api.pagination import list_page
+from app.api.serialization import trusted_response
 
 router = APIRouter()
 
@@ -24,14 +31,20 @@ async def create_user(user: User, current_user: Dict[str, Any] = Depends(get_cur
     return user
 
 @router.get("/", response_model=List[User])
-async def list_users(name: Optional[str] = None):
-    """Ottieni tutti gli utenti, opzionalmente filtrando per nome"""
+async def list_users(
+    response: Response,
+    name: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Utenti per pagina"),
+    cursor: Optional[str] = Query(None, description="Cursore della pagina successiva (header X-Next-Cursor)"),
+    sort: Optional[Literal["name", "email"]] = Query(None, description="Campo di ordinamento (predefinito: ordine di creazione)"),
+    order: Literal["asc", "desc"] = Query("asc", description="Verso dell'ordinamento"),
+):
+    """Ottieni gli utenti, opzionalmente filtrando per nome, una pagina alla volta"""
     query = {}
     if name:
         query["name"] = {"$regex": name, "$options": "i"}  # Case-insensitive regex
         
-    users = await list_documents("users", query)
-    return users
+    return await list_page("users", query, response, limit, cursor, sort, order)
 
 @router.get("/{user_id}", response_model=User)
 async def get_user(user_id: str):
@@ -93,14 +106,22 @@ async def delete_user(
     if not user:
         raise HTTPException(status_code=404, detail="Utente non trovato")
     
-    # Recupera tutti i dispositivi associati all'utente
-    devices = await list_documents("devices", {"owner_id": user_id})
-    
-    # Per ogni dispositivo, elimina anche il digital twin associato
-    for device in devices:
-        if "digital_twin_id" in device:
-            await delete_document("digital_twins", device["digital_twin_id"])
-        await delete_document("devices", device["id"])
+    # Elimina i dispositivi associati all'utente, una pagina alla volta
+    cursor = None
+    while True:
+        devices, cursor = await list_documents_page("devices", {"owner_id": user_id}, MAX_PAGE_SIZE, cursor)
+        
+        # Per ogni dispositivo, elimina anche il digital twin associato
+        for device in devices:
+            if "digital_twin_id" in device:
+                await delete_document("digital_twins", device["digital_twin_id"])
+                await delete_sensor_samples(device["digital_twin_id"])
+                await delete_sensor_rollups(device["digital_twin_id"])
+            await delete_document("devices", device["id"])
+            invalidate_device(device["id"])
+        
+        if not cursor:
+            break
     
     # Elimina l'utente
     await delete_document("users", user_id)
@@ -108,21 +129,39 @@ async def delete_user(
     return None
 
 @router.get("/{user_id}/devices", response_model=List[Dict[str, Any]])
-async def get_user_devices(user_id: str):
-    """Ottieni tutti i dispositivi di un utente"""
+async def get_user_devices(
+    user_id: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Dispositivi per pagina"),
+    cursor: Optional[str] = Query(None, description="Cursore della pagina successiva (header X-Next-Cursor)"),
+    sort: Optional[Literal["name"]] = Query(None, description="Campo di ordinamento (predefinito: ordine di creazione)"),
+    order: Literal["asc", "desc"] = Query("asc", description="Verso dell'ordinamento"),
+):
+    """Ottieni i dispositivi di un utente, una pagina alla volta"""
     user = await get_document("users", user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Utente non trovato")
     
-    devices = await list_documents("devices", {"owner_id": user_id})
-    return devices
+    return await list_page("devices", {"owner_id": user_id}, response, limit, cursor, sort, order)
 
-@router.get("/{user_id}/digital-twins", response_model=List[Dict[str, Any]])
-async def get_user_digital_twins(user_id: str):
-    """Ottieni tutti i digital twins di un utente"""
+@router.get("/{user_id}/digital-twins", response_model=List[DigitalTwinSummary], response_model_exclude_unset=True)
+async def get_user_digital_twins(
+    user_id: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Digital twin per pagina"),
+    cursor: Optional[str] = Query(None, description="Cursore della pagina successiva (header X-Next-Cursor)"),
+    sort: Optional[Literal["name"]] = Query(None, description="Campo di ordinamento (predefinito: ordine di creazione)"),
+    order: Literal["asc", "desc"] = Query("asc", description="Verso dell'ordinamento"),
+    fields: Optional[List[Literal[tuple(SUMMARY_EXTRA_FIELDS)]]] = Query(
+        None, description="Campi da aggiungere alla rappresentazione ridotta (ripetibile)"
+    ),
+):
+    """Ottieni i digital twins di un utente in forma ridotta (senza lo storico dei sensori), una pagina alla volta"""
     user = await get_document("users", user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Utente non trovato")
     
-    digital_twins = await list_documents("digital_twins", {"owner_id": user_id})
-    return digital_twins
\ No newline at end of file
+    digital_twins = await list_page(
+        "digital_twins", {"owner_id": user_id}, response, limit, cursor, sort, order, build_summary_projection(fields)
+    )
+    return trusted_response([build_digital_twin_summary(digital_twin) for digital_twin in digital_twins], response)
\ No newline at end of file
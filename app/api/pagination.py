@@ -0,0 +1,58 @@
+# app/api/pagination.py
+"""
+Paginazione keyset delle liste (dispositivi, digital twin, utenti, template).
+
+Il corpo della risposta resta la lista dei documenti della pagina; il cursore della
+pagina successiva viene restituito nell'header X-Next-Cursor (assente sull'ultima
+pagina) e va passato invariato nel parametro cursor della richiesta successiva, con
+gli stessi sort e order.
+"""
+from typing import Dict, List, Any, Optional
+import json
+
+from bson import json_util
+from fastapi import HTTPException, Response
+
+from app.db.crud import list_documents_page, explain_documents_page, InvalidCursorError
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+async def list_page(
+    collection_name: str,
+    query: Dict[str, Any],
+    response: Response,
+    limit: int,
+    cursor: Optional[str],
+    sort: Optional[str],
+    order: str,
+    projection: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """Legge una pagina di documenti (eventualmente solo alcuni campi) e imposta l'header con il cursore della successiva"""
+    try:
+        documents, next_cursor = await list_documents_page(
+            collection_name, query, limit, cursor, sort or "_id", order == "desc", projection
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return documents
+
+async def explain_page(
+    collection_name: str,
+    query: Dict[str, Any],
+    limit: int,
+    cursor: Optional[str],
+    sort: Optional[str],
+    order: str,
+    projection: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Filtro, ordinamento e piano di esecuzione della query di una pagina, in JSON esteso di Mongo"""
+    try:
+        plan = await explain_documents_page(
+            collection_name, query, limit, cursor, sort or "_id", order == "desc", projection
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json.loads(json_util.dumps(plan))
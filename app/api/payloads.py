@@ -0,0 +1,60 @@
+# app/api/payloads.py
+"""
+Lettura dei corpi delle richieste di ingestione in JSON, MessagePack o CBOR.
+
+Il formato viene scelto dall'header Content-Type; il corpo decodificato viene poi
+validato con lo stesso modello Pydantic usato per il JSON.
+"""
+from typing import Any, Callable, Awaitable
+from functools import lru_cache
+import json
+
+import cbor2
+import msgpack
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+
+JSON_CONTENT_TYPES = ("application/json",)
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+CBOR_CONTENT_TYPES = ("application/cbor",)
+
+def decode_payload(body: bytes, content_type: str) -> Any:
+    """Decodifica un corpo secondo il suo Content-Type (JSON se non indicato)"""
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+
+    try:
+        if media_type in MSGPACK_CONTENT_TYPES:
+            return msgpack.unpackb(body, raw=False)
+        if media_type in CBOR_CONTENT_TYPES:
+            return cbor2.loads(body)
+        if media_type in JSON_CONTENT_TYPES or media_type.endswith("+json"):
+            return json.loads(body)
+    except (ValueError, TypeError, cbor2.CBORDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Corpo della richiesta non valido: {str(e) or type(e).__name__}")
+
+    raise HTTPException(
+        status_code=415,
+        detail=f"Content-Type '{media_type}' non supportato: usare JSON, MessagePack o CBOR"
+    )
+
+async def read_ingestion_payload(request: Request) -> Any:
+    """Dipendenza che restituisce il corpo della richiesta decodificato, senza validarlo"""
+    return decode_payload(await request.body(), request.headers.get("content-type"))
+
+@lru_cache(maxsize=None)
+def _get_type_adapter(model: Any) -> TypeAdapter:
+    return TypeAdapter(model)
+
+def validate_payload(model: Any, payload: Any) -> Any:
+    """Valida un corpo decodificato; gli errori producono la stessa risposta 422 del JSON"""
+    try:
+        return _get_type_adapter(model).validate_python(payload)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False), body=payload)
+
+def ingestion_body(model: Any) -> Callable[[Request], Awaitable[Any]]:
+    """Crea una dipendenza che decodifica il corpo (JSON, MessagePack o CBOR) e lo valida con model"""
+    async def dependency(request: Request) -> Any:
+        return validate_payload(model, await read_ingestion_payload(request))
+    return dependency
@@ -0,0 +1,83 @@
+# app/api/serialization.py
+"""
+Serializzazione veloce delle letture.
+
+Le risposte delle letture vengono costruite da documenti scritti dall'applicazione,
+quindi già validati all'ingresso: invece di ricostruire ogni documento con il modello
+Pydantic della risposta (che per twin e dispositivi rilegge l'ontologia dal disco ad
+ogni documento) vengono ridotti ai campi del modello, completati con i valori
+predefiniti mancanti e codificati direttamente con orjson. Con
+FAST_READ_SERIALIZATION=False le risposte passano di nuovo dal response_model.
+"""
+from typing import Dict, Any, Optional, Tuple, Type
+from functools import lru_cache
+
+import orjson
+from bson import ObjectId
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from app.config import settings
+
+def _encode_default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class TrustedJSONResponse(JSONResponse):
+    """Risposta JSON codificata con orjson, senza passare dal response_model"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_encode_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+@lru_cache(maxsize=None)
+def _dump_plan(model: Type[BaseModel]) -> Tuple[Tuple[str, Any, Optional[Type[BaseModel]]], ...]:
+    """Campi del modello con le informazioni sul default e l'eventuale modello annidato"""
+    plan = []
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        nested = annotation if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+        plan.append((name, field, nested))
+    return tuple(plan)
+
+def trusted_dump(model: Type[BaseModel], document: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Riduce un documento salvato ai campi di un modello, senza validarlo
+
+    I campi in più (_id, version, ...) vengono scartati e quelli mancanti con un default
+    (documenti scritti prima che il campo esistesse) vengono aggiunti; i modelli annidati
+    direttamente (i layer del twin) vengono trattati allo stesso modo.
+    """
+    result = {}
+    for name, field, nested in _dump_plan(model):
+        if name in document:
+            value = document[name]
+            if nested is not None and isinstance(value, dict):
+                value = trusted_dump(nested, value)
+        elif field.is_required():
+            continue
+        else:
+            value = field.get_default(call_default_factory=True)
+            if nested is not None and isinstance(value, BaseModel):
+                value = value.model_dump()
+        result[name] = value
+    return result
+
+def trusted_response(content: Any, response: Optional[Response] = None) -> Any:
+    """
+    Risposta di una lettura codificata direttamente, con gli header già impostati su response
+
+    Se FAST_READ_SERIALIZATION è disattivato restituisce il contenuto invariato, che
+    FastAPI valida e serializza con il response_model della route.
+    """
+    if not settings.FAST_READ_SERIALIZATION:
+        return content
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return TrustedJSONResponse(content, headers=headers)
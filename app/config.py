@@ -34,6 +34,63 @@ class Settings(BaseSettings):
     # Dashboard configuration
     DASHBOARD_PORT: int = int(os.getenv("DASHBOARD_PORT", "8050"))
     
+    # Sensor data storage configuration
+    # embedded: storico nel documento del twin; dual: scrive su entrambi, legge dal twin;
+    # bucketed: scrive e legge solo dalla collezione dei bucket
+    SENSOR_STORAGE_MODE: str = os.getenv("SENSOR_STORAGE_MODE", "embedded")
+    SENSOR_BUCKET_SECONDS: int = int(os.getenv("SENSOR_BUCKET_SECONDS", "3600"))
+    # Campioni per bucket: una finestra con più campioni prosegue in un altro bucket
+    SENSOR_BUCKET_MAX_SAMPLES: int = int(os.getenv("SENSOR_BUCKET_MAX_SAMPLES", "1000"))
+    # Aggregati per minuto, ora e giorno aggiornati ad ogni scrittura (sensor_rollups)
+    SENSOR_ROLLUPS_ENABLED: bool = os.getenv("SENSOR_ROLLUPS_ENABLED", "False").lower() == "true"
+    
+    # Write-behind ingestion configuration
+    INGESTION_QUEUE_ENABLED: bool = os.getenv("INGESTION_QUEUE_ENABLED", "False").lower() == "true"
+    INGESTION_FLUSH_SIZE: int = int(os.getenv("INGESTION_FLUSH_SIZE", "500"))
+    INGESTION_FLUSH_INTERVAL_MS: int = int(os.getenv("INGESTION_FLUSH_INTERVAL_MS", "200"))
+    INGESTION_QUEUE_HIGH_WATER: int = int(os.getenv("INGESTION_QUEUE_HIGH_WATER", "20000"))
+    INGESTION_RETRY_AFTER_SECONDS: int = int(os.getenv("INGESTION_RETRY_AFTER_SECONDS", "1"))
+    # Without the WAL, failed flushes are retried with exponential backoff before dropping the batch
+    INGESTION_FLUSH_RETRIES: int = int(os.getenv("INGESTION_FLUSH_RETRIES", "3"))
+    
+    # Write-ahead log configuration (requires the ingestion pipeline)
+    WAL_ENABLED: bool = os.getenv("WAL_ENABLED", "False").lower() == "true"
+    WAL_DIR: str = os.getenv("WAL_DIR", os.path.join(DATA_DIR, "wal"))
+    WAL_SEGMENT_BYTES: int = int(os.getenv("WAL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+    WAL_FSYNC_INTERVAL_MS: int = int(os.getenv("WAL_FSYNC_INTERVAL_MS", "5"))
+    WAL_REPLAY_BATCH_SIZE: int = int(os.getenv("WAL_REPLAY_BATCH_SIZE", "1000"))
+    WAL_REPLAY_MAX_BACKOFF_SECONDS: int = int(os.getenv("WAL_REPLAY_MAX_BACKOFF_SECONDS", "60"))
+    
+    # Streaming NDJSON upload configuration
+    STREAM_UPLOAD_CHUNK_SIZE: int = int(os.getenv("STREAM_UPLOAD_CHUNK_SIZE", "5000"))
+    STREAM_UPLOAD_MAX_LINE_BYTES: int = int(os.getenv("STREAM_UPLOAD_MAX_LINE_BYTES", "65536"))
+    
+    # Streaming export configuration (bytes serialized before each chunk is sent)
+    EXPORT_CHUNK_BYTES: int = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+    
+    # Read responses encoded directly from stored documents, without response_model validation
+    FAST_READ_SERIALIZATION: bool = os.getenv("FAST_READ_SERIALIZATION", "True").lower() == "true"
+    
+    # Live updates configuration (Server-Sent Events)
+    LIVE_UPDATES_MAX_PENDING: int = int(os.getenv("LIVE_UPDATES_MAX_PENDING", "1000"))
+    LIVE_UPDATES_KEEPALIVE_SECONDS: int = int(os.getenv("LIVE_UPDATES_KEEPALIVE_SECONDS", "15"))
+    
+    # WebSocket ingestion configuration (frames are acknowledged in windows)
+    WEBSOCKET_ACK_WINDOW: int = int(os.getenv("WEBSOCKET_ACK_WINDOW", "200"))
+    WEBSOCKET_ACK_INTERVAL_MS: int = int(os.getenv("WEBSOCKET_ACK_INTERVAL_MS", "250"))
+    
+    # Sample deduplication configuration (recently seen keys kept in memory, 0 disables it)
+    DEDUP_CACHE_SIZE: int = int(os.getenv("DEDUP_CACHE_SIZE", "100000"))
+    # Idempotency-Key headers of recent requests, kept apart from the sample keys
+    IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "100000"))
+    
+    # Authenticated devices and templates cached in memory, reused while MongoDB is unreachable
+    DEVICE_CACHE_SIZE: int = int(os.getenv("DEVICE_CACHE_SIZE", "10000"))
+    DEVICE_CACHE_TTL_SECONDS: int = int(os.getenv("DEVICE_CACHE_TTL_SECONDS", "60"))
+    
+    # Comma-separated ids of the users allowed to run fleet queries across owners and see their query plans
+    ADMIN_USER_IDS: str = os.getenv("ADMIN_USER_IDS", "")
+    
     # File paths
     DATA_DIR: str = DATA_DIR
     CLASS_HIERARCHY_PATH: str = CLASS_HIERARCHY_PATH
@@ -1,8 +1,10 @@
 # app/db/crud.py
 from motor.motor_asyncio import AsyncIOMotorCollection
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from .database import get_database
-from bson import ObjectId
+from bson import ObjectId, json_util
+from pymongo import ASCENDING, DESCENDING
+import base64
 
 # Funzioni CRUD base per collezioni
 async def create_document(collection_name: str, document: Dict[str, Any]) -> str:
@@ -17,18 +19,22 @@ async def create_document(collection_name: str, document: Dict[str, Any]) -> str
     result = await collection.insert_one(document)
     return document["id"]
 
-async def get_document(collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
-    """Recupera un documento dalla collezione in base all'ID"""
+async def get_document(
+    collection_name: str,
+    document_id: str,
+    projection: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """Recupera un documento dalla collezione in base all'ID, opzionalmente solo alcuni campi"""
     db = get_database()
     collection = db[collection_name]
     
     # Try to find by id field first
-    document = await collection.find_one({"id": document_id})
+    document = await collection.find_one({"id": document_id}, projection)
     
     # If not found, try _id field (for backward compatibility)
     if not document:
         try:
-            document = await collection.find_one({"_id": document_id})
+            document = await collection.find_one({"_id": document_id}, projection)
         except:
             pass
     
@@ -61,6 +67,28 @@ async def update_document(collection_name: str, document_id: str, update_data: D
     
     return result.modified_count > 0
 
+async def update_document_atomic(
+    collection_name: str,
+    document_id: str,
+    update: Dict[str, Any],
+    conditions: Optional[Dict[str, Any]] = None
+) -> bool:
+    """
+    Applica un update con operatori Mongo ($push, $set, ...) in un'unica operazione atomica.
+
+    Le condizioni opzionali vengono aggiunte al filtro, così l'update viene applicato
+    solo se il documento le soddisfa. Restituisce True se un documento corrisponde al filtro.
+    """
+    db = get_database()
+    collection = db[collection_name]
+    
+    query = {"id": document_id}
+    if conditions:
+        query.update(conditions)
+    
+    result = await collection.update_one(query, update)
+    return result.matched_count > 0
+
 async def delete_document(collection_name: str, document_id: str) -> bool:
     """Elimina un documento dalla collezione"""
     db = get_database()
@@ -78,22 +106,163 @@ async def delete_document(collection_name: str, document_id: str) -> bool:
     
     return result.deleted_count > 0
 
-async def list_documents(collection_name: str, query: Dict[str, Any] = None) -> List[Dict[str, Any]]:
-    """Elenca documenti dalla collezione, opzionalmente filtrando per query"""
+def _normalize_ids(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Converte gli ObjectId in stringhe e garantisce la presenza del campo id"""
+    for doc in documents:
+        if "_id" in doc:
+            doc["_id"] = str(doc["_id"])
+            if "id" not in doc:
+                doc["id"] = doc["_id"]
+    return documents
+
+# Dimensione predefinita e massima di una pagina delle liste
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+async def list_documents(
+    collection_name: str,
+    query: Dict[str, Any] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    limit: int = MAX_PAGE_SIZE
+) -> List[Dict[str, Any]]:
+    """
+    Elenca i documenti della collezione, opzionalmente filtrando per query e solo alcuni campi.
+
+    Restituisce al massimo limit documenti, per le ricerche puntuali (email, API key);
+    le liste che possono crescere vanno lette con list_documents_page.
+    """
     db = get_database()
     collection = db[collection_name]
     
     if query is None:
         query = {}
         
-    cursor = collection.find(query)
-    documents = await cursor.to_list(length=100)  # Limita a 100 documenti
+    cursor = collection.find(query, projection)
+    documents = await cursor.to_list(length=limit)
+    return _normalize_ids(documents)
+
+async def count_documents(collection_name: str, query: Dict[str, Any]) -> int:
+    """Conta i documenti della collezione che soddisfano la query"""
+    db = get_database()
+    return await db[collection_name].count_documents(query)
+
+class InvalidCursorError(ValueError):
+    """Cursore di paginazione non valido o creato con un ordinamento diverso"""
+
+def encode_cursor(sort_key: str, descending: bool, document: Dict[str, Any]) -> str:
+    """Cursore opaco con il valore della chiave di ordinamento e l'_id dell'ultimo documento di una pagina"""
+    position = {"sort": sort_key, "desc": descending, "value": document.get(sort_key), "_id": document["_id"]}
+    return base64.urlsafe_b64encode(json_util.dumps(position).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str, sort_key: str, descending: bool) -> Tuple[Any, Any]:
+    """Valore della chiave di ordinamento e _id memorizzati in un cursore"""
+    try:
+        position = json_util.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        value, document_id = position["value"], position["_id"]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursorError("Cursore non valido")
+    if position.get("sort") != sort_key or position.get("desc") != descending:
+        raise InvalidCursorError("Il cursore è stato creato con un ordinamento diverso")
+    return value, document_id
+
+def _build_keyset_filter(sort_key: str, descending: bool, value: Any, document_id: Any) -> Dict[str, Any]:
+    """
+    Filtro dei documenti che seguono (value, document_id) nell'ordine (sort_key, _id)
+
+    Mongo ordina i valori mancanti o null prima di tutti gli altri, quindi vengono
+    trattati a parte: in ordine crescente seguono solo ai null, in decrescente li precedono.
+    """
+    after = "$lt" if descending else "$gt"
+    if sort_key == "_id":
+        return {"_id": {after: document_id}}
+    if value is None:
+        same_value = {sort_key: None, "_id": {after: document_id}}
+        return same_value if descending else {"$or": [same_value, {sort_key: {"$ne": None}}]}
     
-    # Convert ObjectIds to strings and ensure id field exists
-    for doc in documents:
-        if "_id" in doc:
-            doc["_id"] = str(doc["_id"])
-            if "id" not in doc:
-                doc["id"] = doc["_id"]
+    conditions = [{sort_key: {after: value}}, {sort_key: value, "_id": {after: document_id}}]
+    if descending:
+        conditions.append({sort_key: None})
+    return {"$or": conditions}
+
+def _build_page_query(
+    query: Optional[Dict[str, Any]],
+    cursor: Optional[str],
+    sort_key: str,
+    descending: bool,
+    projection: Optional[Dict[str, Any]]
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], List[Tuple[str, int]]]:
+    """Filtro, proiezione e ordinamento della query di una pagina"""
+    conditions = [query] if query else []
+    if cursor:
+        conditions.append(_build_keyset_filter(sort_key, descending, *decode_cursor(cursor, sort_key, descending)))
+    
+    # Il cursore della pagina successiva ha bisogno della chiave di ordinamento
+    if projection and sort_key not in projection and any(projection.values()):
+        projection = {**projection, sort_key: 1}
+    
+    direction = DESCENDING if descending else ASCENDING
+    sort = [(sort_key, direction)] if sort_key == "_id" else [(sort_key, direction), ("_id", direction)]
+    return {"$and": conditions} if conditions else {}, projection, sort
+
+async def list_documents_page(
+    collection_name: str,
+    query: Optional[Dict[str, Any]] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    sort_key: str = "_id",
+    descending: bool = False,
+    projection: Optional[Dict[str, Any]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Elenca una pagina di documenti in ordine di (sort_key, _id), con paginazione keyset
+
+    Restituisce i documenti e il cursore della pagina successiva (None se è l'ultima).
+    La pagina successiva riparte dall'ultimo documento con un filtro sulla chiave di
+    ordinamento invece di saltare i documenti precedenti, quindi con un indice su
+    (filtro, sort_key, _id) ogni pagina costa come la prima. Con projection vengono letti
+    solo alcuni campi: la chiave di ordinamento viene aggiunta se manca, _id non va escluso.
+    Solleva InvalidCursorError se il cursore non è valido.
+    """
+    db = get_database()
+    collection = db[collection_name]
+    
+    page_filter, projection, sort = _build_page_query(query, cursor, sort_key, descending, projection)
+    documents = await collection.find(page_filter, projection).sort(sort).limit(limit + 1).to_list(length=None)
+    
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(sort_key, descending, documents[-1])
+    return _normalize_ids(documents), next_cursor
+
+async def explain_documents_page(
+    collection_name: str,
+    query: Optional[Dict[str, Any]] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    sort_key: str = "_id",
+    descending: bool = False,
+    projection: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Filtro, ordinamento e piano di esecuzione (explain) della query che list_documents_page eseguirebbe"""
+    db = get_database()
+    collection = db[collection_name]
     
-    return documents
\ No newline at end of file
+    page_filter, projection, sort = _build_page_query(query, cursor, sort_key, descending, projection)
+    plan = await collection.find(page_filter, projection).sort(sort).limit(limit + 1).explain()
+    return {"filter": page_filter, "sort": sort, "explain": plan}
+
+# Indici delle liste paginate: filtro usato dagli endpoint seguito da (chiave di ordinamento, _id)
+LIST_INDEXES = {
+    "digital_twins": [["owner_id", "_id"], ["owner_id", "name", "_id"]],
+    "devices": [["owner_id", "_id"], ["owner_id", "name", "_id"]],
+    "device_templates": [["name", "_id"], ["owner_id", "_id"], ["owner_id", "name", "_id"]],
+    "users": [["name", "_id"], ["email", "_id"]]
+}
+
+async def ensure_list_indexes() -> None:
+    """Crea gli indici usati dalla paginazione delle liste"""
+    db = get_database()
+    for collection_name, indexes in LIST_INDEXES.items():
+        for fields in indexes:
+            await db[collection_name].create_index([(field, ASCENDING) for field in fields])
@@ -0,0 +1,153 @@
+# app/db/rollups.py
+"""
+Aggregati continui dei dati dei sensori (rollup) per minuto, ora e giorno.
+
+Per ogni (twin, sensore, risoluzione, inizio dell'intervallo) un documento della
+collezione sensor_rollups mantiene count (tutti i campioni), value_count, sum, sum_sq,
+min e max dei valori numerici. Gli aggregati vengono aggiornati in modo incrementale ad
+ogni scrittura con $inc/$min/$max, quindi i campioni arrivati in ritardo correggono
+l'intervallo a cui appartengono, indipendentemente dallo storage dei campioni.
+"""
+from typing import Dict, List, Any, Optional, Tuple
+import datetime
+
+from pymongo import ASCENDING, UpdateOne
+
+from .database import get_database
+from .timeseries import EPOCH, parse_timestamp, is_numeric
+
+SENSOR_ROLLUPS_COLLECTION = "sensor_rollups"
+
+# Risoluzioni dei rollup in secondi, dalla più grossolana alla più fine
+ROLLUP_RESOLUTIONS = {"1d": 86400, "1h": 3600, "1m": 60}
+
+def get_rollup_start(moment: datetime.datetime, resolution_seconds: int) -> datetime.datetime:
+    """Inizio dell'intervallo di un rollup che contiene l'istante indicato"""
+    seconds = int((moment - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % resolution_seconds)
+
+def build_rollup_operations(
+    digital_twin_id: str,
+    sensor_type: str,
+    samples: List[Dict[str, Any]],
+    lsns: Optional[List[Optional[int]]] = None,
+    resolutions: Optional[List[str]] = None
+) -> List[UpdateOne]:
+    """
+    Prepara gli upsert che aggiungono i campioni di un sensore ai rollup di ogni risoluzione
+
+    I campioni vengono raggruppati per intervallo, quindi ogni rollup toccato riceve un
+    solo update. Se sono indicate le posizioni nel write-ahead log (lsns, parallele a
+    samples), il rollup registra in wal_lsn l'ultima posizione applicata. Con resolutions
+    vengono aggiornati solo i rollup delle risoluzioni indicate.
+    """
+    operations = []
+    for resolution, resolution_seconds in ROLLUP_RESOLUTIONS.items():
+        if resolutions is not None and resolution not in resolutions:
+            continue
+        aggregates: Dict[datetime.datetime, Dict[str, Any]] = {}
+        for i, sample in enumerate(samples):
+            rollup_start = get_rollup_start(parse_timestamp(sample["timestamp"]), resolution_seconds)
+            aggregate = aggregates.setdefault(rollup_start, {"count": 0, "values": [], "wal_lsn": None})
+            aggregate["count"] += 1
+            if is_numeric(sample["value"]):
+                aggregate["values"].append(sample["value"])
+            if lsns and lsns[i] is not None:
+                aggregate["wal_lsn"] = max(lsns[i], aggregate["wal_lsn"] or 0)
+
+        for rollup_start, aggregate in aggregates.items():
+            values = aggregate["values"]
+            update: Dict[str, Any] = {
+                "$inc": {"count": aggregate["count"]},
+                "$setOnInsert": {
+                    "end": rollup_start + datetime.timedelta(seconds=resolution_seconds)
+                }
+            }
+            if values:
+                update["$inc"].update({
+                    "value_count": len(values),
+                    "sum": sum(values),
+                    "sum_sq": sum(value * value for value in values)
+                })
+                update["$min"] = {"min": min(values)}
+                update["$max"] = {"max": max(values)}
+            if aggregate["wal_lsn"] is not None:
+                update.setdefault("$max", {})["wal_lsn"] = aggregate["wal_lsn"]
+
+            operations.append(UpdateOne(
+                {
+                    "digital_twin_id": digital_twin_id,
+                    "sensor_type": sensor_type,
+                    "resolution": resolution,
+                    "start": rollup_start
+                },
+                update,
+                upsert=True
+            ))
+
+    return operations
+
+async def write_rollup_operations(operations: List[UpdateOne]) -> None:
+    """Esegue gli upsert dei rollup con un unico bulk_write non ordinato"""
+    if not operations:
+        return
+
+    db = get_database()
+    await db[SENSOR_ROLLUPS_COLLECTION].bulk_write(operations, ordered=False)
+
+def get_rollup_key(
+    entry: Tuple[str, str, Dict[str, Any], Optional[int]],
+    resolution: str
+) -> Tuple[str, str, str, datetime.datetime]:
+    """Chiave (twin, sensore, risoluzione, inizio) del rollup di una risoluzione che riceve un campione"""
+    digital_twin_id, sensor_type, sample = entry[0], entry[1], entry[2]
+    rollup_start = get_rollup_start(parse_timestamp(sample["timestamp"]), ROLLUP_RESOLUTIONS[resolution])
+    return digital_twin_id, sensor_type, resolution, rollup_start
+
+async def find_rollup_wal_watermarks(
+    entries: List[Tuple[str, str, Dict[str, Any], Optional[int]]]
+) -> Dict[Tuple[str, str, str, datetime.datetime], int]:
+    """
+    Legge l'ultima posizione del write-ahead log applicata ai rollup toccati dai campioni
+
+    Il bulk_write dei rollup non è ordinato né atomico: dopo un errore parziale i rollup
+    di un campione possono essere stati scritti solo per alcune risoluzioni, quindi ogni
+    rollup ha il proprio wal_lsn e viene letto per tutte le risoluzioni (chiavi di
+    get_rollup_key).
+    """
+    keys = {get_rollup_key(entry, resolution) for entry in entries for resolution in ROLLUP_RESOLUTIONS}
+    if not keys:
+        return {}
+
+    db = get_database()
+    cursor = db[SENSOR_ROLLUPS_COLLECTION].find(
+        {
+            "digital_twin_id": {"$in": list({key[0] for key in keys})},
+            "start": {"$in": list({key[3] for key in keys})}
+        },
+        {"_id": 0, "digital_twin_id": 1, "sensor_type": 1, "resolution": 1, "start": 1, "wal_lsn": 1}
+    )
+    return {
+        (rollup["digital_twin_id"], rollup["sensor_type"], rollup["resolution"], rollup["start"]): rollup.get("wal_lsn", 0)
+        async for rollup in cursor
+    }
+
+async def delete_sensor_rollups(digital_twin_id: str) -> int:
+    """Elimina tutti i rollup di un digital twin"""
+    db = get_database()
+    result = await db[SENSOR_ROLLUPS_COLLECTION].delete_many({"digital_twin_id": digital_twin_id})
+    return result.deleted_count
+
+async def ensure_rollup_indexes() -> None:
+    """Crea gli indici della collezione dei rollup (un intervallo per risoluzione per sensore per twin)"""
+    db = get_database()
+    await db[SENSOR_ROLLUPS_COLLECTION].create_index(
+        [
+            ("digital_twin_id", ASCENDING),
+            ("sensor_type", ASCENDING),
+            ("resolution", ASCENDING),
+            ("start", ASCENDING)
+        ],
+        unique=True,
+        name="twin_sensor_rollup"
+    )
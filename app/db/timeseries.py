@@ -0,0 +1,320 @@
+# app/db/timeseries.py
+"""
+Storage dei dati dei sensori in una collezione separata, organizzata a bucket.
+
+Ogni bucket contiene i campioni di un sensore di un digital twin in una finestra
+temporale (SENSOR_BUCKET_SECONDS) e mantiene aggregati precalcolati
+(count di tutti i campioni, value_count, sum, min e max dei valori numerici), così le
+letture non devono passare dal documento del twin. Un bucket contiene al massimo
+SENSOR_BUCKET_MAX_SAMPLES campioni: una finestra con più campioni prosegue in altri
+bucket, che le letture fondono in ordine di timestamp.
+"""
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator
+import datetime
+import heapq
+import logging
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from app.config import settings
+from app.models.sensor import parse_utc_timestamp
+from .database import get_database
+
+logger = logging.getLogger(__name__)
+
+SENSOR_BUCKETS_COLLECTION = "sensor_buckets"
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def parse_timestamp(timestamp: Any) -> datetime.datetime:
+    """Converte il timestamp di un campione in un datetime UTC naive (come lo salva Mongo)"""
+    try:
+        return parse_utc_timestamp(timestamp)
+    except ValueError:
+        # Timestamp non interpretabile (dati precedenti alla normalizzazione):
+        # il campione finisce nel bucket dell'istante di arrivo
+        return datetime.datetime.utcnow()
+
+def get_bucket_start(moment: datetime.datetime) -> datetime.datetime:
+    """Calcola l'inizio della finestra temporale che contiene l'istante indicato"""
+    seconds = int((moment - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % settings.SENSOR_BUCKET_SECONDS)
+
+def is_numeric(value: Any) -> bool:
+    """Vero per i valori int e float (i booleani esclusi)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def get_bucket_key(entry: Tuple[str, str, Dict[str, Any], Optional[int]]) -> Tuple[str, str, datetime.datetime]:
+    """Chiave (twin, sensore, inizio finestra) del bucket che riceve un campione"""
+    digital_twin_id, sensor_type, sample = entry[0], entry[1], entry[2]
+    return digital_twin_id, sensor_type, get_bucket_start(parse_timestamp(sample["timestamp"]))
+
+def build_bucket_operations(
+    digital_twin_id: str,
+    sensor_type: str,
+    samples: List[Dict[str, Any]],
+    lsns: Optional[List[Optional[int]]] = None
+) -> List[UpdateOne]:
+    """
+    Prepara gli upsert che aggiungono i campioni di un sensore ai rispettivi bucket
+
+    I campioni vengono raggruppati per finestra temporale, quindi ogni bucket toccato
+    riceve un solo update con $push/$each e l'aggiornamento incrementale degli aggregati.
+    Un campione arrivato in ritardo finisce nel bucket della sua finestra, inserito in
+    ordine di timestamp ($sort, su un array limitato a SENSOR_BUCKET_MAX_SAMPLES
+    campioni), e corregge gli aggregati del bucket con gli stessi $inc/$min/$max senza
+    ricalcolarli. L'update seleziona solo un bucket della finestra con spazio per tutti i
+    suoi campioni, altrimenti ne crea uno nuovo: un bucket pieno non cresce più.
+    Se sono indicate le posizioni nel write-ahead log (lsns, parallele a samples), il
+    bucket registra in wal_lsn l'ultima posizione applicata; in questo caso i campioni
+    di una finestra restano in un solo update (anche oltre il limite, con un blocco del
+    log più grande di un bucket), perché wal_lsn dica quali campioni sono stati scritti.
+    Senza posizioni una finestra con troppi campioni viene divisa su più bucket.
+    """
+    max_samples = settings.SENSOR_BUCKET_MAX_SAMPLES
+    samples_by_bucket: Dict[datetime.datetime, List[Dict[str, Any]]] = {}
+    wal_lsn_by_bucket: Dict[datetime.datetime, int] = {}
+    for i, sample in enumerate(samples):
+        bucket_start = get_bucket_start(parse_timestamp(sample["timestamp"]))
+        samples_by_bucket.setdefault(bucket_start, []).append(sample)
+        if lsns and lsns[i] is not None:
+            wal_lsn_by_bucket[bucket_start] = max(lsns[i], wal_lsn_by_bucket.get(bucket_start, 0))
+
+    operations = []
+    for bucket_start, window_samples in samples_by_bucket.items():
+        chunk_size = len(window_samples) if bucket_start in wal_lsn_by_bucket else max_samples
+        for offset in range(0, len(window_samples), chunk_size):
+            bucket_samples = window_samples[offset:offset + chunk_size]
+            values = [sample["value"] for sample in bucket_samples if is_numeric(sample["value"])]
+
+            update: Dict[str, Any] = {
+                "$push": {"samples": {"$each": bucket_samples, "$sort": {"timestamp": 1}}},
+                "$inc": {"count": len(bucket_samples), "value_count": len(values)},
+                "$setOnInsert": {
+                    "bucket_end": bucket_start + datetime.timedelta(seconds=settings.SENSOR_BUCKET_SECONDS)
+                }
+            }
+            if values:
+                update["$inc"]["sum"] = sum(values)
+                update["$min"] = {"min": min(values)}
+                update["$max"] = {"max": max(values)}
+            if bucket_start in wal_lsn_by_bucket:
+                update.setdefault("$max", {})["wal_lsn"] = wal_lsn_by_bucket[bucket_start]
+
+            operations.append(UpdateOne(
+                {
+                    "digital_twin_id": digital_twin_id,
+                    "sensor_type": sensor_type,
+                    "bucket_start": bucket_start,
+                    # Solo un bucket con spazio per tutti i campioni (count non supera mai il limite)
+                    "count": {"$lte": max(max_samples - len(bucket_samples), 0)}
+                },
+                update,
+                upsert=True
+            ))
+
+    return operations
+
+async def write_bucket_operations(operations: List[UpdateOne]) -> None:
+    """Esegue gli upsert dei bucket con un unico bulk_write non ordinato"""
+    if not operations:
+        return
+
+    db = get_database()
+    await db[SENSOR_BUCKETS_COLLECTION].bulk_write(operations, ordered=False)
+
+async def find_bucket_wal_watermarks(
+    entries: List[Tuple[str, str, Dict[str, Any], Optional[int]]]
+) -> Dict[Tuple[str, str, datetime.datetime], int]:
+    """
+    Legge l'ultima posizione del write-ahead log applicata ai bucket toccati dai campioni
+
+    Una finestra divisa su più bucket riceve i campioni di ogni blocco del log con un
+    solo update, quindi la sua posizione è la più alta tra quelle dei suoi bucket.
+    """
+    keys = {get_bucket_key(entry) for entry in entries}
+    if not keys:
+        return {}
+
+    db = get_database()
+    cursor = db[SENSOR_BUCKETS_COLLECTION].find(
+        {
+            "digital_twin_id": {"$in": list({key[0] for key in keys})},
+            "bucket_start": {"$in": list({key[2] for key in keys})}
+        },
+        {"_id": 0, "digital_twin_id": 1, "sensor_type": 1, "bucket_start": 1, "wal_lsn": 1}
+    )
+    watermarks: Dict[Tuple[str, str, datetime.datetime], int] = {}
+    async for bucket in cursor:
+        key = (bucket["digital_twin_id"], bucket["sensor_type"], bucket["bucket_start"])
+        watermarks[key] = max(bucket.get("wal_lsn", 0), watermarks.get(key, 0))
+    return watermarks
+
+def build_timestamp_condition(
+    variable: str,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None
+) -> Dict[str, Any]:
+    """Condizione di aggregazione start <= variable.timestamp <= end (estremi facoltativi)"""
+    conditions = []
+    if start is not None:
+        conditions.append({"$gte": [f"$${variable}.timestamp", start]})
+    if end is not None:
+        conditions.append({"$lte": [f"$${variable}.timestamp", end]})
+    return {"$and": conditions} if conditions else True
+
+def build_samples_expression(
+    samples: Any,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    limit: Optional[int] = None,
+    descending: bool = False,
+    fields: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Espressione di aggregazione che seleziona i campioni di un array ordinato per timestamp
+
+    Filtra l'intervallo [start, end], tiene i primi limit campioni (gli ultimi se
+    descending) e proietta solo i campi indicati. I campioni restano in ordine crescente:
+    l'inversione per l'ordine decrescente, su al massimo limit campioni, spetta al chiamante.
+    """
+    expression: Dict[str, Any] = {
+        "$filter": {
+            "input": samples,
+            "as": "sample",
+            "cond": build_timestamp_condition("sample", start, end)
+        }
+    }
+    if limit is not None:
+        expression = {"$slice": [expression, -limit if descending else limit]}
+    if fields:
+        expression = {
+            "$map": {
+                "input": expression,
+                "as": "sample",
+                "in": {field: f"$$sample.{field}" for field in fields}
+            }
+        }
+    return expression
+
+def _merge_window_samples(buckets: List[List[Dict[str, Any]]], descending: bool) -> List[Dict[str, Any]]:
+    """Fonde i campioni (ordinati) dei bucket di una stessa finestra in ordine di timestamp"""
+    if len(buckets) == 1:
+        return buckets[0]
+    return list(heapq.merge(
+        *buckets,
+        key=lambda sample: parse_timestamp(sample["timestamp"]),
+        reverse=descending
+    ))
+
+async def iter_bucket_windows(
+    buckets: AsyncIterator[Dict[str, Any]],
+    descending: bool = False
+) -> AsyncIterator[Tuple[str, datetime.datetime, List[Dict[str, Any]]]]:
+    """
+    Raggruppa i bucket della stessa finestra di un sensore in (sensore, inizio finestra, campioni)
+
+    I bucket devono arrivare con sensor_type, bucket_start e i campioni in ordine
+    crescente, con quelli della stessa finestra consecutivi: i campioni di una finestra
+    divisa su più bucket vengono fusi per timestamp, in ordine decrescente se descending.
+    """
+    key = None
+    window: List[List[Dict[str, Any]]] = []
+    async for bucket in buckets:
+        bucket_key = (bucket["sensor_type"], bucket["bucket_start"])
+        if window and bucket_key != key:
+            yield key[0], key[1], _merge_window_samples(window, descending)
+            window = []
+        key = bucket_key
+        samples = bucket.get("samples", [])
+        if descending:
+            samples.reverse()
+        window.append(samples)
+
+    if window:
+        yield key[0], key[1], _merge_window_samples(window, descending)
+
+async def find_sensor_samples(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    limit: Optional[int] = None,
+    descending: bool = False,
+    fields: Optional[List[str]] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Ricostruisce lo storico dei sensori di un digital twin leggendo i bucket in ordine temporale
+
+    L'intervallo [start, end] seleziona i bucket tramite l'indice (twin, sensore, inizio
+    finestra) e filtra i campioni dei bucket agli estremi nel database; limit è il numero
+    massimo di campioni restituiti per sensore, a partire dai più recenti se descending.
+    I bucket vengono proiettati (al massimo limit campioni ciascuno) prima di essere
+    ordinati e la lettura si ferma, a fine finestra, quando tutti i sensori richiesti
+    hanno raggiunto limit campioni.
+    """
+    db = get_database()
+
+    query: Dict[str, Any] = {"digital_twin_id": digital_twin_id}
+    if sensor_types is not None:
+        query["sensor_type"] = {"$in": sensor_types}
+    if start is not None or end is not None:
+        query["bucket_start"] = {}
+        if start is not None:
+            query["bucket_start"]["$gte"] = get_bucket_start(start)
+        if end is not None:
+            query["bucket_start"]["$lte"] = end
+
+    # Il timestamp serve a fondere i bucket di una stessa finestra
+    projected_fields = fields if not fields or "timestamp" in fields else [*fields, "timestamp"]
+    direction = DESCENDING if descending else ASCENDING
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": query},
+        {"$project": {
+            "_id": 0,
+            "sensor_type": 1,
+            "bucket_start": 1,
+            "samples": build_samples_expression("$samples", start, end, limit, descending, projected_fields)
+        }},
+        {"$sort": {"bucket_start": direction, "sensor_type": ASCENDING}}
+    ]
+
+    sensor_data: Dict[str, List[Dict[str, Any]]] = {}
+    windows = iter_bucket_windows(db[SENSOR_BUCKETS_COLLECTION].aggregate(pipeline), descending)
+    async for sensor_type, _, window_samples in windows:
+        if projected_fields is not fields:
+            for sample in window_samples:
+                del sample["timestamp"]
+        samples = sensor_data.setdefault(sensor_type, [])
+        remaining = None if limit is None else limit - len(samples)
+        samples.extend(window_samples[:remaining])
+
+        if limit is not None and sensor_types is not None and all(
+            len(sensor_data.get(sensor_type, [])) >= limit for sensor_type in sensor_types
+        ):
+            break
+
+    return sensor_data
+
+async def delete_sensor_samples(digital_twin_id: str) -> int:
+    """Elimina tutti i bucket di un digital twin"""
+    db = get_database()
+    result = await db[SENSOR_BUCKETS_COLLECTION].delete_many({"digital_twin_id": digital_twin_id})
+    return result.deleted_count
+
+async def ensure_timeseries_indexes() -> None:
+    """
+    Crea gli indici della collezione dei bucket (twin, sensore, inizio finestra)
+
+    L'indice non è univoco: una finestra piena prosegue in altri bucket. Un indice
+    univoco creato dalle versioni precedenti viene sostituito.
+    """
+    db = get_database()
+    collection = db[SENSOR_BUCKETS_COLLECTION]
+    indexes = await collection.index_information()
+    if indexes.get("twin_sensor_bucket", {}).get("unique"):
+        await collection.drop_index("twin_sensor_bucket")
+    await collection.create_index(
+        [("digital_twin_id", ASCENDING), ("sensor_type", ASCENDING), ("bucket_start", ASCENDING)],
+        name="twin_sensor_bucket"
+    )
@@ -20,6 +20,9 @@ class Device(BaseModel):
     digital_twin_id: Optional[str] = None
     owner_id: Optional[str] = None
     api_key: str = Field(default_factory=lambda: secrets.token_urlsafe(32))
+    # Un gateway può inviare dati solo per i dispositivi elencati, dello stesso proprietario
+    is_gateway: bool = False
+    gateway_device_ids: List[str] = Field(default_factory=list)
     
     @model_validator(mode='after')
     def validate_device_config(self):
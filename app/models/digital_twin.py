@@ -1,19 +1,24 @@
 # app/models/digital_twin.py
 from pydantic import BaseModel, Field, validator, model_validator
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Union
+import datetime
 import uuid
 from ..ontology.manager import OntologyManager
+from .sensor import UTCTimestamp
 
 class SensorData(BaseModel):
     """Represents data from a single sensor"""
-    timestamp: str
+    # Le stringhe non interpretabili salvate prima della normalizzazione restano leggibili
+    timestamp: Union[UTCTimestamp, str] = Field(union_mode='left_to_right')
     value: Any
     unit_measure: str = ""
 
 class DigitalReplicaLayer(BaseModel):
     """Layer that stores physical device data"""
     sensor_data: Dict[str, List[SensorData]] = Field(default_factory=dict)
-    last_updated: Optional[str] = None
+    # Ultimo campione di ogni sensore, aggiornato ad ogni scrittura
+    latest: Dict[str, SensorData] = Field(default_factory=dict)
+    last_updated: Optional[datetime.datetime] = None
     metadata: Dict[str, Any] = Field(default_factory=dict)
 
 class ServiceLayer(BaseModel):
@@ -28,6 +33,22 @@ class ApplicationLayer(BaseModel):
     visualization_configs: Dict[str, Any] = Field(default_factory=dict)
     user_interfaces: List[str] = []
 
+class DigitalTwinSummary(BaseModel):
+    """Reduced representation of a digital twin used by list endpoints, without sensor history"""
+    id: str
+    name: str
+    device_type: Optional[str] = None
+    last_updated: Optional[datetime.datetime] = None
+    latest: Dict[str, SensorData] = Field(default_factory=dict)
+    # Campi aggiuntivi, presenti solo se richiesti con fields
+    device_id: Optional[str] = None
+    template_id: Optional[str] = None
+    owner_id: Optional[str] = None
+    compatible_sensors: Optional[List[str]] = None
+    metadata: Optional[Dict[str, Any]] = None
+    service_layer: Optional[ServiceLayer] = None
+    application_layer: Optional[ApplicationLayer] = None
+
 class DigitalTwin(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -0,0 +1,31 @@
+# app/models/fleet_query.py
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional, Union, Literal, Annotated
+from .sensor import UTCTimestamp
+
+# I nomi dei sensori diventano parte dei percorsi Mongo (digital_replica.latest.<sensore>)
+SensorName = Annotated[str, Field(pattern=r"^[A-Za-z0-9_-]+$", max_length=100)]
+
+class LatestValueCondition(BaseModel):
+    """Comparison between the latest value of a sensor and a constant"""
+    sensor: SensorName
+    op: Literal["eq", "ne", "gt", "gte", "lt", "lte"]
+    value: Union[bool, int, float, str]
+
+class FleetQuery(BaseModel):
+    """Filter over the digital twins of a fleet; all the given conditions must hold"""
+    device_type: Optional[str] = None
+    # Include anche i twin delle sottoclassi di device_type nell'ontologia
+    include_subtypes: bool = False
+    owner_id: Optional[str] = None
+    sensors: List[SensorName] = Field(default_factory=list, max_length=20)
+    latest: List[LatestValueCondition] = Field(default_factory=list, max_length=20)
+    updated_after: Optional[UTCTimestamp] = None
+    updated_before: Optional[UTCTimestamp] = None
+
+    @model_validator(mode='after')
+    def validate_time_window(self):
+        """Validates that the last_updated window is not empty"""
+        if self.updated_after and self.updated_before and self.updated_after > self.updated_before:
+            raise ValueError("updated_after must not be later than updated_before")
+        return self
@@ -1,6 +1,36 @@
 # app/models/sensor.py
-from pydantic import BaseModel, Field, validator
-from typing import Dict, List, Optional, Any, Union
+from pydantic import BaseModel, BeforeValidator, Field, RootModel, validator, model_validator
+from typing import Dict, List, Optional, Any, Union, Annotated
+import datetime
+
+def parse_utc_timestamp(value: Any) -> datetime.datetime:
+    """
+    Converte un timestamp in un datetime UTC naive (come lo salva Mongo)
+
+    Accetta datetime, stringhe ISO-8601 (senza fuso orario si intendono UTC) e numeri,
+    interpretati come millisecondi dall'epoch. Qualsiasi altro valore solleva ValueError.
+    """
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=value)
+        except OverflowError:
+            raise ValueError(f"Epoch milliseconds out of range: {value}")
+    elif isinstance(value, str):
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid ISO-8601 timestamp: '{value}'")
+    else:
+        raise ValueError("Timestamp must be an ISO-8601 string or epoch milliseconds")
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+# Timestamp normalizzato in UTC all'ingresso
+UTCTimestamp = Annotated[datetime.datetime, BeforeValidator(parse_utc_timestamp)]
 
 class SensorAttribute(BaseModel):
     """Rappresenta un attributo di un sensore con valore e unità di misura"""
@@ -9,7 +39,7 @@ class SensorAttribute(BaseModel):
 
 class SensorMeasurement(BaseModel):
     """Rappresenta una misurazione di un sensore"""
-    timestamp: str
+    timestamp: UTCTimestamp
     attribute_name: str
     value: float
     unit_measure: str = ""
@@ -18,6 +48,33 @@ class BatchSensorMeasurements(BaseModel):
     """Rappresenta un batch di misurazioni di sensori"""
     measurements: List[SensorMeasurement] = Field(..., min_items=1, max_items=1000)
 
+# Numero massimo di campioni in un batch colonnare
+MAX_COLUMNAR_SAMPLES = 10000
+
+class SensorColumn(BaseModel):
+    """Rappresenta le misurazioni di un sensore in forma colonnare (timestamp e valori paralleli)"""
+    ts: List[UTCTimestamp]
+    values: List[float]
+    unit_measure: str = ""
+
+    @model_validator(mode='after')
+    def check_lengths(self):
+        if len(self.ts) != len(self.values):
+            raise ValueError("ts and values must have the same length")
+        return self
+
+class ColumnarSensorMeasurements(RootModel[Dict[str, SensorColumn]]):
+    """Rappresenta un batch di misurazioni in forma colonnare: {sensore: {ts: [...], values: [...]}}"""
+
+    @model_validator(mode='after')
+    def check_size(self):
+        total = sum(len(column.ts) for column in self.root.values())
+        if total == 0:
+            raise ValueError("At least one measurement is required")
+        if total > MAX_COLUMNAR_SAMPLES:
+            raise ValueError(f"At most {MAX_COLUMNAR_SAMPLES} measurements are allowed")
+        return self
+
 class SensorType(BaseModel):
     """Rappresenta un tipo di sensore dall'ontologia"""
     name: str
@@ -27,3 +84,14 @@ class SensorType(BaseModel):
     max_value: Optional[float] = None
     mean_value: Optional[float] = None
 
+
+class GatewayDeviceData(BaseModel):
+    """Rappresenta i dati di un dispositivo inoltrati da un gateway"""
+    device_id: Optional[str] = None
+    digital_twin_id: Optional[str] = None
+    timestamp: Optional[UTCTimestamp] = None
+    data: Dict[str, Any]
+
+class GatewayPayload(BaseModel):
+    """Rappresenta i dati di più dispositivi inviati da un gateway in una sola richiesta"""
+    devices: List[GatewayDeviceData] = Field(..., min_items=1, max_items=1000)
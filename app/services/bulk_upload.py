@@ -0,0 +1,140 @@
+# app/services/bulk_upload.py
+"""
+Caricamento in streaming di misurazioni in formato NDJSON (una misurazione JSON per riga).
+
+Il corpo della richiesta viene letto a blocchi, eventualmente decompresso (gzip) e
+validato riga per riga; le misurazioni valide vengono scritte a blocchi di
+STREAM_UPLOAD_CHUNK_SIZE con un solo bulk_write, quindi la memoria usata non dipende
+dalla dimensione del caricamento.
+"""
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator, Iterator
+import json
+import zlib
+
+from pydantic import ValidationError
+
+from app.config import settings
+from app.models.sensor import SensorMeasurement
+from app.services.digital_twin_service import write_sensor_samples_bulk, get_ontology_unit_measure
+
+# Numero massimo di errori riportati nel riepilogo (il conteggio resta completo)
+MAX_REPORTED_ERRORS = 100
+
+class StreamUploadError(ValueError):
+    """Il corpo della richiesta non si può interpretare (gzip non valido, riga troppo lunga)"""
+
+def _decompress(decompressor, chunk: bytes, limit: int) -> Iterator[bytes]:
+    """Decomprime un blocco senza produrre più di limit byte alla volta"""
+    try:
+        data = decompressor.decompress(chunk, limit)
+        yield data
+        while decompressor.unconsumed_tail:
+            yield decompressor.decompress(decompressor.unconsumed_tail, limit)
+    except zlib.error as e:
+        raise StreamUploadError(f"Invalid gzip body: {e}")
+
+async def iter_ndjson_lines(
+    chunks: AsyncIterator[bytes],
+    gzip_encoded: bool = False,
+    max_line_bytes: int = 65536
+) -> AsyncIterator[bytes]:
+    """Divide un flusso di byte (eventualmente gzip) in righe, senza mai tenerlo tutto in memoria"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzip_encoded else None
+    buffer = b""
+
+    async for chunk in chunks:
+        parts = _decompress(decompressor, chunk, max_line_bytes) if decompressor else [chunk]
+        for data in parts:
+            buffer += data
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            if len(buffer) > max_line_bytes:
+                raise StreamUploadError(f"Line longer than {max_line_bytes} bytes")
+            for line in lines:
+                yield line
+
+    if decompressor:
+        buffer += decompressor.flush()
+    for line in buffer.split(b"\n"):
+        yield line
+
+async def ingest_ndjson_stream(
+    digital_twin: Dict[str, Any],
+    chunks: AsyncIterator[bytes],
+    gzip_encoded: bool = False
+) -> Dict[str, Any]:
+    """
+    Valida e scrive le misurazioni NDJSON di un digital twin già caricato
+
+    Ogni riga deve essere un oggetto con timestamp, attribute_name, value e opzionalmente
+    unit_measure. Restituisce il riepilogo delle righe accettate, duplicate e scartate,
+    con il numero di riga (a partire da 1) degli errori.
+    """
+    digital_twin_id = digital_twin["id"]
+    compatible_sensors = set(digital_twin.get("compatible_sensors", []))
+    use_ontology_units = bool(digital_twin.get("device_type"))
+    unit_measures: Dict[str, str] = {}
+
+    accepted = 0
+    rejected = 0
+    duplicates = 0
+    errors: List[Dict[str, Any]] = []
+    chunk: List[Tuple[str, str, Dict[str, Any], Optional[int]]] = []
+
+    def reject(line_number: int, error: str) -> None:
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"line": line_number, "error": error})
+
+    line_number = 0
+    async for line in iter_ndjson_lines(chunks, gzip_encoded, settings.STREAM_UPLOAD_MAX_LINE_BYTES):
+        line_number += 1
+        if not line.strip():
+            continue
+
+        try:
+            measurement = SensorMeasurement(**json.loads(line))
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            reject(line_number, f"Invalid JSON: {e}")
+            continue
+        except (TypeError, ValidationError) as e:
+            reject(line_number, f"Invalid measurement: {e}")
+            continue
+
+        sensor_type = measurement.attribute_name
+        if sensor_type not in compatible_sensors:
+            reject(line_number, f"Il sensore '{sensor_type}' non è compatibile con questo Digital Twin")
+            continue
+
+        unit_measure = measurement.unit_measure
+        if not unit_measure:
+            # L'unità predefinita dell'ontologia viene risolta una sola volta per sensore
+            if sensor_type not in unit_measures:
+                unit_measures[sensor_type] = get_ontology_unit_measure(sensor_type) if use_ontology_units else ""
+            unit_measure = unit_measures[sensor_type]
+
+        chunk.append((
+            digital_twin_id,
+            sensor_type,
+            {"timestamp": measurement.timestamp, "value": measurement.value, "unit_measure": unit_measure},
+            None
+        ))
+        if len(chunk) >= settings.STREAM_UPLOAD_CHUNK_SIZE:
+            chunk_duplicates = await write_sensor_samples_bulk(chunk)
+            accepted += len(chunk) - chunk_duplicates
+            duplicates += chunk_duplicates
+            chunk = []
+
+    if chunk:
+        chunk_duplicates = await write_sensor_samples_bulk(chunk)
+        accepted += len(chunk) - chunk_duplicates
+        duplicates += chunk_duplicates
+
+    return {
+        "message": f"Processate {accepted + duplicates + rejected} righe",
+        "accepted": accepted,
+        "duplicates": duplicates,
+        "rejected": rejected,
+        "errors": errors
+    }
@@ -0,0 +1,88 @@
+# app/services/deduplication.py
+"""
+Deduplicazione dei campioni ritrasmessi dai dispositivi.
+
+Un campione è identificato da (digital_twin_id, sensor_type, timestamp); una richiesta
+può inoltre indicare una chiave di idempotenza (header Idempotency-Key). Le chiavi viste
+di recente sono tenute in memoria, al massimo DEDUP_CACHE_SIZE per i campioni e
+IDEMPOTENCY_CACHE_SIZE per le richieste (in due cache separate, così un twin molto
+attivo non fa dimenticare le chiavi di idempotenza), quindi un duplicato viene
+riconosciuto senza leggere lo storico. Le chiavi vengono prenotate prima della
+scrittura, senza await tra controllo e prenotazione, e rilasciate se la scrittura
+fallisce: due tentativi concorrenti non vengono scritti entrambi e un nuovo tentativo
+dopo un errore non viene scartato.
+"""
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+
+from app.config import settings
+
+class RecentKeys:
+    """Insieme limitato delle chiavi viste più di recente (le più vecchie vengono dimenticate)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._keys: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def claim(self, keys: List[Hashable]) -> List[bool]:
+        """Registra le chiavi e indica per ognuna se era nuova (False se duplicata)"""
+        if self.max_size <= 0:
+            return [True] * len(keys)
+
+        claimed = []
+        for key in keys:
+            if key in self._keys:
+                claimed.append(False)
+                continue
+            self._keys[key] = None
+            claimed.append(True)
+
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return claimed
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._keys
+
+    def release(self, keys: List[Hashable]) -> None:
+        """Dimentica chiavi prenotate per una scrittura non riuscita"""
+        for key in keys:
+            self._keys.pop(key, None)
+
+def get_sample_key(digital_twin_id: str, sensor_type: str, sample: Dict[str, Any]) -> Tuple[str, str, Any]:
+    """Chiave di deduplicazione di un campione: (twin, sensore, timestamp)"""
+    return digital_twin_id, sensor_type, sample["timestamp"]
+
+def claim_samples(samples: List[Tuple[Any, ...]]) -> Tuple[List[int], List[Hashable]]:
+    """
+    Prenota le chiavi di campioni (digital_twin_id, sensor_type, campione, ...)
+
+    Restituisce gli indici dei campioni nuovi e le chiavi prenotate, da rilasciare con
+    recent_keys.release se la scrittura non va a buon fine.
+    """
+    keys = [get_sample_key(*sample[:3]) for sample in samples]
+    claimed = recent_keys.claim(keys)
+    return (
+        [i for i, is_new in enumerate(claimed) if is_new],
+        [key for key, is_new in zip(keys, claimed) if is_new]
+    )
+
+def claim_request(digital_twin_id: str, idempotency_key: Optional[str]) -> bool:
+    """
+    Prenota la chiave di idempotenza di una richiesta
+
+    Restituisce False se una richiesta con la stessa chiave è già stata completata o è
+    in corso; senza chiave restituisce sempre True. La chiave va rilasciata con
+    release_request se la richiesta non va a buon fine.
+    """
+    if not idempotency_key:
+        return True
+    return recent_requests.claim([(digital_twin_id, idempotency_key)])[0]
+
+def release_request(digital_twin_id: str, idempotency_key: Optional[str]) -> None:
+    """Rilascia la chiave di idempotenza di una richiesta non riuscita"""
+    if idempotency_key:
+        recent_requests.release([(digital_twin_id, idempotency_key)])
+
+recent_keys = RecentKeys(settings.DEDUP_CACHE_SIZE)
+recent_requests = RecentKeys(settings.IDEMPOTENCY_CACHE_SIZE)
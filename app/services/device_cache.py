@@ -0,0 +1,108 @@
+# app/services/device_cache.py
+"""
+Cache in memoria dei dispositivi autenticati e dei template.
+
+Ogni invio di dati legge il dispositivo dalla sua API key e, se basato su template, il
+template: con MongoDB non raggiungibile queste letture attenderebbero il timeout di
+selezione del server e la richiesta fallirebbe prima di arrivare al write-ahead log.
+Le voci restano valide per DEVICE_CACHE_TTL_SECONDS e sono al massimo DEVICE_CACHE_SIZE
+(le meno usate vengono dimenticate). Una voce scaduta viene riletta dal database; solo
+se il database non è raggiungibile viene riusata e rinnovata, così i dispositivi che si
+sono autenticati di recente continuano a inviare dati durante l'interruzione.
+Rigenerazione dell'API key, modifica ed eliminazione del dispositivo o del template
+invalidano le voci di questo processo; gli altri processi le vedono alla scadenza.
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from collections import OrderedDict
+import time
+
+from pymongo.errors import ConnectionFailure
+
+from app.config import settings
+from app.db.crud import get_document, list_documents
+
+class ExpiringCache:
+    """Cache limitata con scadenza delle voci (le meno usate vengono dimenticate)"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+
+    def get(self, key: Hashable, allow_expired: bool = False) -> Optional[Any]:
+        """Restituisce il valore della chiave, None se assente o scaduto (salvo allow_expired)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if not allow_expired and expires_at <= time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Registra il valore della chiave, valido per ttl secondi"""
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def pop_where(self, predicate: Callable[[Any], bool]) -> None:
+        """Dimentica le voci il cui valore soddisfa il predicato"""
+        for key in [key for key, (value, _) in self._entries.items() if predicate(value)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+async def _cached_lookup(
+    cache: ExpiringCache,
+    key: Hashable,
+    load: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+) -> Optional[Dict[str, Any]]:
+    """Legge dalla cache o dal database, riusando la voce scaduta se il database non risponde"""
+    document = cache.get(key)
+    if document is not None:
+        return document
+
+    try:
+        document = await load()
+    except ConnectionFailure:
+        document = cache.get(key, allow_expired=True)
+        if document is None:
+            raise
+    if document is not None:
+        cache.set(key, document)
+    return document
+
+async def find_device_by_api_key(api_key: str) -> Optional[Dict[str, Any]]:
+    """Dispositivo con l'API key indicata, None se la chiave non è valida"""
+    async def load() -> Optional[Dict[str, Any]]:
+        devices = await list_documents("devices", {"api_key": api_key})
+        return devices[0] if devices else None
+
+    return await _cached_lookup(devices_by_api_key, api_key, load)
+
+async def get_device_template(template_id: str) -> Optional[Dict[str, Any]]:
+    """Template di dispositivo con l'id indicato, None se non esiste"""
+    return await _cached_lookup(
+        device_templates,
+        template_id,
+        lambda: get_document("device_templates", template_id)
+    )
+
+def invalidate_device(device_id: str) -> None:
+    """Dimentica il dispositivo, da chiamare quando viene modificato o eliminato"""
+    devices_by_api_key.pop_where(lambda device: device.get("id") == device_id)
+
+def invalidate_device_template(template_id: str) -> None:
+    """Dimentica il template, da chiamare quando viene modificato o eliminato"""
+    device_templates.pop(template_id)
+
+devices_by_api_key = ExpiringCache(settings.DEVICE_CACHE_SIZE, settings.DEVICE_CACHE_TTL_SECONDS)
+device_templates = ExpiringCache(settings.DEVICE_CACHE_SIZE, settings.DEVICE_CACHE_TTL_SECONDS)
@@ -0,0 +1,134 @@
+# app/services/device_stream.py
+"""
+Ingestione su WebSocket per dispositivi ad alta frequenza.
+
+Il dispositivo si autentica una sola volta all'apertura della connessione e invia poi
+frame compatti, ciascuno con le misurazioni di un istante:
+
+    {"s": 42, "t": "2024-01-01T10:00:00.250", "d": {"heartRate": 72, "steps": 3}}
+
+s è il numero di sequenza del frame (crescente), t il timestamp (ISO-8601 o millisecondi
+dall'epoch; se manca si usa l'istante di arrivo) e d i valori per sensore. Un messaggio
+può contenere un frame o una lista di frame. I frame vengono scritti a finestre
+(WEBSOCKET_ACK_WINDOW frame o WEBSOCKET_ACK_INTERVAL_MS) con il percorso di scrittura
+raggruppato, e ogni finestra viene confermata con l'ultimo numero di sequenza scritto:
+il client può scartare i frame confermati e ritrasmettere gli altri dopo una riconnessione.
+"""
+from typing import Dict, List, Any, Optional, Tuple
+import datetime
+import json
+
+from app.models.sensor import parse_utc_timestamp
+from app.services.digital_twin_service import write_sensor_samples_bulk, get_ontology_unit_measure
+from app.services.ingestion_queue import ingestion_pipeline
+
+# Numero massimo di errori riportati in una conferma
+MAX_REPORTED_ERRORS = 20
+
+class DeviceStreamSession:
+    """Stato di una connessione: frame validati in attesa di scrittura e della conferma"""
+
+    def __init__(self, digital_twin: Dict[str, Any]):
+        self.digital_twin_id = digital_twin["id"]
+        self.compatible_sensors = set(digital_twin.get("compatible_sensors", []))
+        self.use_ontology_units = bool(digital_twin.get("device_type"))
+        self.unit_measures: Dict[str, str] = {}
+
+        self.entries: List[Tuple[str, str, Dict[str, Any], Optional[int]]] = []
+        self.latest_values: Dict[str, Dict[str, Any]] = {}
+        self.frames = 0
+        self.last_seq: Optional[int] = None
+        self.rejected = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def _reject(self, seq: Any, error: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"seq": seq, "error": error})
+
+    def _get_unit_measure(self, sensor_type: str) -> str:
+        # L'unità predefinita dell'ontologia viene risolta una sola volta per sensore
+        if sensor_type not in self.unit_measures:
+            self.unit_measures[sensor_type] = (
+                get_ontology_unit_measure(sensor_type) if self.use_ontology_units else ""
+            )
+        return self.unit_measures[sensor_type]
+
+    def add_message(self, message: str) -> None:
+        """Valida un messaggio (un frame o una lista di frame) e accoda i campioni validi"""
+        try:
+            payload = json.loads(message)
+        except ValueError as e:
+            self._reject(None, f"Invalid JSON: {e}")
+            return
+
+        for frame in payload if isinstance(payload, list) else [payload]:
+            self.add_frame(frame)
+
+    def add_frame(self, frame: Any) -> None:
+        """Valida un frame e accoda un campione per ogni sensore compatibile"""
+        if not isinstance(frame, dict) or not isinstance(frame.get("d"), dict):
+            self._reject(None, "Invalid frame: expected an object with 'd'")
+            return
+
+        seq = frame.get("s")
+        if seq is not None:
+            if not isinstance(seq, int) or isinstance(seq, bool):
+                self._reject(seq, "Invalid frame: 's' must be an integer")
+                return
+            self.last_seq = seq if self.last_seq is None else max(self.last_seq, seq)
+        self.frames += 1
+
+        timestamp = datetime.datetime.utcnow()
+        if frame.get("t") is not None:
+            try:
+                timestamp = parse_utc_timestamp(frame["t"])
+            except ValueError as e:
+                self._reject(seq, f"Invalid frame: {e}")
+                return
+
+        for sensor_type, value in frame["d"].items():
+            if sensor_type not in self.compatible_sensors:
+                self._reject(seq, f"Il sensore '{sensor_type}' non è compatibile con questo Digital Twin")
+                continue
+
+            sample = {"timestamp": timestamp, "value": value, "unit_measure": self._get_unit_measure(sensor_type)}
+            self.entries.append((self.digital_twin_id, sensor_type, sample, None))
+            self.latest_values[sensor_type] = {"value": value, "unit_measure": sample["unit_measure"]}
+
+    def pending_frames(self) -> int:
+        """Numero di frame ricevuti dall'ultima conferma"""
+        return self.frames
+
+    async def flush(self) -> Dict[str, Any]:
+        """
+        Scrive i campioni della finestra e restituisce la conferma da inviare al dispositivo
+
+        Con la pipeline write-behind attiva i campioni vengono accodati; se la coda è piena
+        viene sollevata IngestionQueueFull e la finestra resta in sospeso.
+        """
+        duplicates = 0
+        if self.entries:
+            if ingestion_pipeline.running:
+                duplicates = await ingestion_pipeline.enqueue([entry[:3] for entry in self.entries])
+            else:
+                duplicates = await write_sensor_samples_bulk(self.entries)
+
+        ack = {
+            "ack": self.last_seq,
+            "frames": self.frames,
+            "accepted": len(self.entries) - duplicates,
+            "duplicates": duplicates,
+            "rejected": self.rejected,
+            "errors": self.errors
+        }
+        self.entries = []
+        self.frames = 0
+        self.rejected = 0
+        self.errors = []
+        return ack
+
+    def pop_latest_values(self) -> Dict[str, Dict[str, Any]]:
+        """Restituisce e azzera gli ultimi valori ricevuti per sensore (attributi del dispositivo)"""
+        latest_values, self.latest_values = self.latest_values, {}
+        return latest_values
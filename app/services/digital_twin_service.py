@@ -1,9 +1,32 @@
 # app/services/digital_twin_service.py
-from app.models.digital_twin import DigitalTwin, DigitalReplicaLayer, SensorData
+from app.models.digital_twin import DigitalTwin, DigitalReplicaLayer, SensorData, ServiceLayer, ApplicationLayer
 from app.models.device import Device
-from app.db.crud import create_document, get_document, update_document
+from app.models.sensor import SensorMeasurement, SensorColumn
+from app.db.crud import create_document, get_document, update_document, update_document_atomic
+from app.db.database import get_database
+from app.db.timeseries import (
+    build_bucket_operations,
+    write_bucket_operations,
+    find_sensor_samples,
+    find_bucket_wal_watermarks,
+    get_bucket_key,
+    build_samples_expression,
+    parse_timestamp
+)
+from app.db.rollups import (
+    build_rollup_operations,
+    write_rollup_operations,
+    find_rollup_wal_watermarks,
+    get_rollup_key,
+    ROLLUP_RESOLUTIONS
+)
+from app.services.deduplication import claim_samples, recent_keys
+from app.services.device_cache import invalidate_device
+from app.services.live_updates import sensor_updates
+from app.config import settings
 from app.ontology.manager import OntologyManager
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple, Union
+from pymongo import UpdateOne
 import datetime
 import uuid
 
@@ -156,82 +179,682 @@ async def create_digital_twin_for_device(device: Dict[str, Any]) -> DigitalTwin:
     
     # Aggiorna il dispositivo con l'ID del digital twin
     await update_document("devices", device['id'], {"digital_twin_id": digital_twin.id})
+    invalidate_device(device['id'])
     
     return digital_twin
 
+def get_ontology_unit_measure(sensor_type: str) -> str:
+    """Restituisce l'unità di misura predefinita di un sensore secondo l'ontologia"""
+    ontology = OntologyManager()
+    sensor_details = ontology.get_sensor_details(sensor_type)
+    if sensor_details:
+        unit_measures = sensor_details.get("unitMeasure")
+        if isinstance(unit_measures, list) and len(unit_measures) > 0:
+            return unit_measures[0]
+    return ""
+
+# Versione del twin, incrementata ad ogni modifica dei dati restituiti dalle letture
+VERSION_INCREMENT = {"digital_replica.version": 1}
+
+def _build_modified_state() -> Dict[str, Any]:
+    return {"digital_replica.modified_at": datetime.datetime.utcnow()}
+
+async def mark_digital_twin_modified(digital_twin_id: str) -> None:
+    """Segna un twin come modificato (versione e modified_at) dopo un aggiornamento dei suoi dati"""
+    await mark_digital_twins_modified([digital_twin_id])
+
+async def mark_digital_twins_modified(digital_twin_ids: List[str]) -> None:
+    """Segna più twin come modificati con un solo update"""
+    if not digital_twin_ids:
+        return
+    await get_database()["digital_twins"].update_many(
+        {"id": {"$in": digital_twin_ids}},
+        {"$inc": dict(VERSION_INCREMENT), "$max": _build_modified_state()}
+    )
+
+def _build_late_history_expression(
+    sensor_type: str,
+    samples: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Espressione che inserisce in ordine di timestamp campioni in ritardo nello storico
+
+    I campioni già salvati precedenti al più vecchio dei nuovi restano dove sono; solo la
+    coda successiva viene ordinata insieme ai nuovi campioni con $sortArray (MongoDB 5.2+).
+    Lo storico viene scandito una volta (due $filter lineari, senza costo per campione) e
+    solo coda e nuovi campioni vengono ordinati, invece di riordinare lo storico intero.
+    """
+    def select(operator: str, timestamp: Any) -> Dict[str, Any]:
+        return {"$filter": {
+            "input": history,
+            "as": "sample",
+            "cond": {operator: ["$$sample.timestamp", timestamp]}
+        }}
+
+    history = {"$ifNull": [f"$digital_replica.sensor_data.{sensor_type}", []]}
+    oldest = parse_timestamp(samples[0]["timestamp"])
+    sorted_tail = {"$sortArray": {
+        "input": {"$concatArrays": [select("$gte", oldest), {"$literal": samples}]},
+        "sortBy": {"timestamp": 1}
+    }}
+    return {"$concatArrays": [select("$lt", oldest), sorted_tail]}
+
+def _build_sensor_data_updates(
+    samples_by_sensor: Dict[str, List[Dict[str, Any]]],
+    wal_lsn: Optional[int] = None
+) -> List[Tuple[Dict[str, Any], Union[Dict[str, Any], List[Dict[str, Any]]]]]:
+    """
+    Costruisce gli update che accodano i campioni di più sensori, come coppie (filtro, update)
+
+    last_updated avanza solo in avanti ($max), così come lo stato più recente di ogni
+    sensore (digital_replica.latest): il sotto-documento inizia con il timestamp e $max
+    confronta i documenti campo per campo, quindi resta quello del campione più recente
+    anche se i campioni arrivano in ritardo o da scritture concorrenti. Lo storico resta
+    ordinato per timestamp: se nessun campione è precedente a last_updated i campioni
+    vengono accodati, altrimenti (dati arrivati in ritardo) vengono inseriti in ordine da
+    un update con pipeline (vedi _build_late_history_expression). I due update si
+    escludono tramite il filtro su last_updated e vanno provati in quest'ordine: dopo
+    quello per i dati in ritardo last_updated resta successivo al campione più vecchio,
+    quindi l'altro non corrisponde più al documento.
+    Ogni update incrementa anche la versione del twin e ne aggiorna modified_at, usati
+    dai GET condizionali (ETag e Last-Modified). In modalità bucketed lo storico è nei
+    bucket, scritti dopo il twin: la versione viene incrementata dal chiamante dopo averli
+    scritti (mark_digital_twins_modified), altrimenti una lettura concorrente potrebbe
+    associare il nuovo ETag ai bucket senza i nuovi campioni. wal_lsn, se indicato,
+    avanza la posizione del write-ahead log applicata al twin.
+    """
+    samples_by_sensor = {
+        sensor_type: sorted(samples, key=lambda sample: parse_timestamp(sample["timestamp"]))
+        for sensor_type, samples in samples_by_sensor.items()
+    }
+    oldest = min(parse_timestamp(samples[0]["timestamp"]) for samples in samples_by_sensor.values())
+    newest = max(parse_timestamp(samples[-1]["timestamp"]) for samples in samples_by_sensor.values())
+    
+    latest_state: Dict[str, Any] = {"digital_replica.last_updated": newest}
+    for sensor_type, samples in samples_by_sensor.items():
+        latest_state[f"digital_replica.latest.{sensor_type}"] = {
+            "timestamp": parse_timestamp(samples[-1]["timestamp"]),
+            "value": samples[-1]["value"],
+            "unit_measure": samples[-1].get("unit_measure", "")
+        }
+    if wal_lsn is not None:
+        latest_state["digital_replica.wal_lsn"] = wal_lsn
+    
+    # Con lo storage a bucket il documento del twin non contiene più lo storico
+    if settings.SENSOR_STORAGE_MODE == "bucketed":
+        return [({}, {"$max": latest_state})]
+    
+    latest_state.update(_build_modified_state())
+    
+    # Gli update con pipeline non hanno $max e $inc: stessi campi come espressioni
+    late_state = {
+        field: {"$max": [f"${field}", {"$literal": value}]}
+        for field, value in latest_state.items()
+    }
+    late_state.update({
+        field: {"$add": [{"$ifNull": [f"${field}", 0]}, increment]}
+        for field, increment in VERSION_INCREMENT.items()
+    })
+    late_update = [{"$set": {
+        **late_state,
+        **{
+            f"digital_replica.sensor_data.{sensor_type}": _build_late_history_expression(sensor_type, samples)
+            for sensor_type, samples in samples_by_sensor.items()
+        }
+    }}]
+    in_order_update = {
+        "$max": latest_state,
+        "$inc": dict(VERSION_INCREMENT),
+        "$push": {
+            f"digital_replica.sensor_data.{sensor_type}": {"$each": samples}
+            for sensor_type, samples in samples_by_sensor.items()
+        }
+    }
+    return [
+        ({"digital_replica.last_updated": {"$gt": oldest}}, late_update),
+        ({"digital_replica.last_updated": {"$not": {"$gt": oldest}}}, in_order_update)
+    ]
+
+async def _write_sensor_samples(
+    digital_twin_id: str,
+    samples_by_sensor: Dict[str, List[Dict[str, Any]]],
+    conditions: Dict[str, Any]
+) -> Tuple[bool, int]:
+    """
+    Scrive i campioni secondo SENSOR_STORAGE_MODE
+
+    Il documento del twin viene aggiornato con un update condizionato (due se i campioni
+    arrivano in ritardo rispetto a last_updated); i bucket e i rollup vengono scritti solo
+    se il twin esiste e soddisfa le condizioni. I campioni già ricevuti di recente (stesso
+    sensore e timestamp) vengono scartati: restituisce l'esito della scrittura e il numero
+    di duplicati. I campioni scritti vengono pubblicati ai client iscritti al twin.
+    """
+    entries = [
+        (digital_twin_id, sensor_type, sample)
+        for sensor_type, samples in samples_by_sensor.items()
+        for sample in samples
+    ]
+    new_indexes, claimed_keys = claim_samples(entries)
+    duplicates = len(entries) - len(new_indexes)
+    if duplicates:
+        samples_by_sensor = {}
+        for i in new_indexes:
+            samples_by_sensor.setdefault(entries[i][1], []).append(entries[i][2])
+        if not samples_by_sensor:
+            return True, duplicates
+    
+    try:
+        success = False
+        for update_conditions, update in _build_sensor_data_updates(samples_by_sensor):
+            success = await update_document_atomic(
+                "digital_twins",
+                digital_twin_id,
+                update,
+                {**conditions, **update_conditions}
+            )
+            if success:
+                break
+        
+        if success and settings.SENSOR_STORAGE_MODE in ("dual", "bucketed"):
+            operations = []
+            for sensor_type, samples in samples_by_sensor.items():
+                operations.extend(build_bucket_operations(digital_twin_id, sensor_type, samples))
+            await write_bucket_operations(operations)
+        
+        if success and settings.SENSOR_ROLLUPS_ENABLED:
+            operations = []
+            for sensor_type, samples in samples_by_sensor.items():
+                operations.extend(build_rollup_operations(digital_twin_id, sensor_type, samples))
+            await write_rollup_operations(operations)
+        
+        if success and settings.SENSOR_STORAGE_MODE == "bucketed":
+            await mark_digital_twin_modified(digital_twin_id)
+    except Exception:
+        recent_keys.release(claimed_keys)
+        raise
+    
+    if success:
+        sensor_updates.publish(digital_twin_id, samples_by_sensor)
+    else:
+        recent_keys.release(claimed_keys)
+    return success, duplicates
+
+async def _get_twin_wal_watermarks(digital_twin_ids: List[str]) -> Dict[str, int]:
+    """Legge per ogni twin esistente l'ultima posizione del write-ahead log già applicata"""
+    cursor = get_database()["digital_twins"].find(
+        {"id": {"$in": digital_twin_ids}},
+        {"_id": 0, "id": 1, "digital_replica.wal_lsn": 1}
+    )
+    return {
+        digital_twin["id"]: digital_twin.get("digital_replica", {}).get("wal_lsn", 0)
+        async for digital_twin in cursor
+    }
+
+async def write_sensor_samples_bulk(
+    entries: List[Tuple[str, str, Dict[str, Any], Optional[int]]],
+    skip_applied: bool = False,
+    deduplicate: bool = True
+) -> int:
+    """
+    Scrive campioni già validati di più digital twin con un solo bulk_write
+
+    entries contiene tuple (digital_twin_id, sensor_type, campione, lsn) in ordine di
+    arrivo, dove lsn è la posizione del campione nel write-ahead log (o None). Ogni twin
+    riceve un unico update ($push/$each per sensore e last_updated, vedi
+    _build_sensor_data_updates per i dati in ritardo); in modalità dual o bucketed anche
+    i bucket vengono scritti con un solo bulk_write, così come i rollup se abilitati.
+    I campioni di twin che non esistono più (ad esempio eliminati dopo l'accodamento)
+    vengono scartati, senza creare bucket o rollup orfani; quelli scritti vengono
+    pubblicati ai client iscritti agli aggiornamenti dei twin. Twin, bucket e rollup tengono traccia dell'ultimo lsn applicato (wal_lsn): con
+    skip_applied=True i campioni già applicati vengono scartati, così la riapplicazione
+    del log è idempotente.
+    Con deduplicate=True i campioni già ricevuti di recente vengono scartati (la pipeline
+    li scarta già all'accodamento); restituisce il numero di duplicati.
+    """
+    if not deduplicate:
+        await _apply_sensor_samples_bulk(entries, skip_applied)
+        return 0
+    
+    new_indexes, claimed_keys = claim_samples(entries)
+    try:
+        await _apply_sensor_samples_bulk([entries[i] for i in new_indexes], skip_applied)
+    except Exception:
+        recent_keys.release(claimed_keys)
+        raise
+    return len(entries) - len(new_indexes)
+
+async def _apply_sensor_samples_bulk(
+    entries: List[Tuple[str, str, Dict[str, Any], Optional[int]]],
+    skip_applied: bool
+) -> None:
+    if not entries:
+        return
+    
+    # Un twin eliminato non deve ricevere bucket, rollup o notifiche: il bulk_write dei
+    # twin non indica quali update hanno trovato il documento, quindi si legge prima
+    twin_watermarks = await _get_twin_wal_watermarks(list({entry[0] for entry in entries}))
+    entries = [entry for entry in entries if entry[0] in twin_watermarks]
+    if not entries:
+        return
+    
+    use_buckets = settings.SENSOR_STORAGE_MODE in ("dual", "bucketed")
+    twin_entries = entries
+    bucket_entries = entries if use_buckets else []
+    # Campioni da aggiungere ai rollup di ogni risoluzione
+    rollup_entries = {
+        resolution: entries for resolution in ROLLUP_RESOLUTIONS
+    } if settings.SENSOR_ROLLUPS_ENABLED else {}
+    
+    if skip_applied:
+        twin_entries = [
+            entry for entry in entries
+            if entry[3] is None or entry[3] > twin_watermarks.get(entry[0], 0)
+        ]
+        if use_buckets:
+            bucket_watermarks = await find_bucket_wal_watermarks(entries)
+            bucket_entries = [
+                entry for entry in entries
+                if entry[3] is None or entry[3] > bucket_watermarks.get(get_bucket_key(entry), 0)
+            ]
+        if rollup_entries:
+            rollup_watermarks = await find_rollup_wal_watermarks(entries)
+            rollup_entries = {
+                resolution: [
+                    entry for entry in entries
+                    if entry[3] is None or entry[3] > rollup_watermarks.get(get_rollup_key(entry, resolution), 0)
+                ]
+                for resolution in rollup_entries
+            }
+    
+    # Aggiornamenti dei documenti dei twin, uno per twin
+    samples_by_twin: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    wal_lsn_by_twin: Dict[str, int] = {}
+    for digital_twin_id, sensor_type, sample, lsn in twin_entries:
+        samples_by_twin.setdefault(digital_twin_id, {}).setdefault(sensor_type, []).append(sample)
+        if lsn is not None:
+            wal_lsn_by_twin[digital_twin_id] = max(lsn, wal_lsn_by_twin.get(digital_twin_id, 0))
+    
+    # Gli update alternativi di un twin (dati in ritardo o in ordine) devono essere
+    # eseguiti nell'ordine indicato, quindi il bulk_write dei twin è ordinato
+    twin_operations = []
+    for digital_twin_id, samples_by_sensor in samples_by_twin.items():
+        updates = _build_sensor_data_updates(samples_by_sensor, wal_lsn_by_twin.get(digital_twin_id))
+        for update_conditions, update in updates:
+            twin_operations.append(UpdateOne({"id": digital_twin_id, **update_conditions}, update))
+    
+    # Aggiornamenti dei bucket e dei rollup, raggruppati per twin e sensore
+    bucket_operations = []
+    for (digital_twin_id, sensor_type), (samples, lsns) in _group_entries_by_sensor(bucket_entries).items():
+        bucket_operations.extend(build_bucket_operations(digital_twin_id, sensor_type, samples, lsns))
+    rollup_operations = []
+    for resolution, resolution_entries in rollup_entries.items():
+        for (digital_twin_id, sensor_type), (samples, lsns) in _group_entries_by_sensor(resolution_entries).items():
+            rollup_operations.extend(
+                build_rollup_operations(digital_twin_id, sensor_type, samples, lsns, [resolution])
+            )
+    
+    if twin_operations:
+        await get_database()["digital_twins"].bulk_write(twin_operations, ordered=True)
+    await write_bucket_operations(bucket_operations)
+    await write_rollup_operations(rollup_operations)
+    
+    # In modalità bucketed la versione dei twin avanza solo dopo la scrittura dei bucket
+    if settings.SENSOR_STORAGE_MODE == "bucketed":
+        await mark_digital_twins_modified(list({entry[0] for entry in bucket_entries}))
+    
+    for digital_twin_id, samples_by_sensor in samples_by_twin.items():
+        sensor_updates.publish(digital_twin_id, samples_by_sensor)
+
+def _group_entries_by_sensor(
+    entries: List[Tuple[str, str, Dict[str, Any], Optional[int]]]
+) -> Dict[Tuple[str, str], Tuple[List[Dict[str, Any]], List[Optional[int]]]]:
+    """Raggruppa i campioni per (twin, sensore), con le posizioni nel write-ahead log parallele"""
+    grouped: Dict[Tuple[str, str], Tuple[List[Dict[str, Any]], List[Optional[int]]]] = {}
+    for digital_twin_id, sensor_type, sample, lsn in entries:
+        samples, lsns = grouped.setdefault((digital_twin_id, sensor_type), ([], []))
+        samples.append(sample)
+        lsns.append(lsn)
+    return grouped
+
+async def _push_sensor_data(
+    digital_twin_id: str,
+    sensor_type: str,
+    sensor_data: SensorData,
+    conditions: Dict[str, Any]
+) -> bool:
+    """Accoda un dato al sensore e aggiorna last_updated con un update atomico"""
+    # La compatibilità del sensore è verificata nel filtro, senza rileggere il documento
+    conditions = {"compatible_sensors": sensor_type, **conditions}
+    
+    success, _ = await _write_sensor_samples(
+        digital_twin_id,
+        {sensor_type: [sensor_data.dict()]},
+        conditions
+    )
+    return success
+
 async def add_sensor_data_to_digital_twin(
     digital_twin_id: str, 
     sensor_type: str, 
     value: float,
-    timestamp: Optional[str] = None,
+    timestamp: Optional[Union[str, datetime.datetime]] = None,
     unit_measure: Optional[str] = ""
 ) -> bool:
-    """Aggiunge dati del sensore al digital twin"""
-    dt = await get_document("digital_twins", digital_twin_id)
-    if not dt:
-        return False
-        
+    """
+    Aggiunge dati del sensore al digital twin
+
+    Il dato viene scritto con un singolo update ($push + $max di last_updated), quindi
+    il costo non dipende dalla lunghezza dello storico e scritture concorrenti non si
+    sovrascrivono; un dato arrivato in ritardo viene inserito in ordine di timestamp.
+    Restituisce False se il digital twin non esiste o se il sensore non è compatibile;
+    un dato già ricevuto di recente non viene riscritto.
+    """
     if not timestamp:
-        timestamp = datetime.datetime.now().isoformat()
-        
-    # Verifica se il sensore è compatibile con il digital twin
-    if sensor_type not in dt.get("compatible_sensors", []):
-        return False
+        timestamp = datetime.datetime.utcnow()
     
-    # Se non è stata specificata un'unità di misura e il digital twin è basato su ontologia
-    if not unit_measure and dt.get("device_type"):
-        # Ottieni l'unità di misura dall'ontologia
-        ontology = OntologyManager()
-        sensor_details = ontology.get_sensor_details(sensor_type)
-        if sensor_details:
-            unit_measures = sensor_details.get("unitMeasure")
-            if isinstance(unit_measures, list) and len(unit_measures) > 0:
-                unit_measure = unit_measures[0]
+    # Se non è stata specificata un'unità di misura, i digital twin basati su ontologia
+    # usano quella predefinita del sensore
+    if not unit_measure:
+        ontology_unit = get_ontology_unit_measure(sensor_type)
+        if ontology_unit:
+            sensor_data = SensorData(timestamp=timestamp, value=value, unit_measure=ontology_unit)
+            if await _push_sensor_data(
+                digital_twin_id,
+                sensor_type,
+                sensor_data,
+                {"device_type": {"$nin": [None, ""]}}
+            ):
+                return True
+            
+            # Digital twin senza device_type (template o generico): nessuna unità predefinita
+            sensor_data = SensorData(timestamp=timestamp, value=value, unit_measure="")
+            return await _push_sensor_data(
+                digital_twin_id,
+                sensor_type,
+                sensor_data,
+                {"device_type": {"$in": [None, ""]}}
+            )
     
-    # Prepara il dato del sensore
     sensor_data = SensorData(
         timestamp=timestamp,
         value=value,
-        unit_measure=unit_measure
+        unit_measure=unit_measure or ""
     )
+    return await _push_sensor_data(digital_twin_id, sensor_type, sensor_data, {})
+
+def build_sensor_sample(
+    digital_twin: Dict[str, Any],
+    sensor_type: str,
+    value: Any,
+    timestamp: Optional[Union[str, datetime.datetime]] = None,
+    unit_measure: Optional[str] = ""
+) -> Dict[str, Any]:
+    """Prepara un campione per un digital twin già caricato, con timestamp e unità predefiniti"""
+    if not unit_measure and digital_twin.get("device_type"):
+        unit_measure = get_ontology_unit_measure(sensor_type)
     
-    # Aggiorna il digital twin con il nuovo dato
-    replica_path = f"digital_replica.sensor_data.{sensor_type}"
-    
-    # Verifica se esiste già una lista per questo tipo di sensore
-    existing_dt = await get_document("digital_twins", digital_twin_id)
-    if existing_dt and "digital_replica" in existing_dt and "sensor_data" in existing_dt["digital_replica"]:
-        sensor_data_dict = existing_dt["digital_replica"]["sensor_data"]
-        if sensor_type in sensor_data_dict:
-            # Aggiungi alla lista esistente
-            update_result = await update_document(
-                "digital_twins", 
-                digital_twin_id,
-                {f"{replica_path}": sensor_data_dict[sensor_type] + [sensor_data.dict()]}
-            )
-        else:
-            # Crea una nuova lista
-            update_result = await update_document(
-                "digital_twins", 
-                digital_twin_id,
-                {f"{replica_path}": [sensor_data.dict()]}
-            )
-    else:
-        # Inizializza il dizionario dei dati del sensore
-        update_result = await update_document(
-            "digital_twins", 
-            digital_twin_id,
-            {f"{replica_path}": [sensor_data.dict()]}
+    sensor_data = SensorData(
+        timestamp=timestamp or datetime.datetime.utcnow(),
+        value=value,
+        unit_measure=unit_measure or ""
+    )
+    return sensor_data.dict()
+
+async def add_sensor_data_batch_to_digital_twin(
+    digital_twin: Dict[str, Any],
+    measurements: List[SensorMeasurement]
+) -> Dict[str, Any]:
+    """
+    Aggiunge un batch di misurazioni ad un digital twin già caricato
+
+    La compatibilità viene verificata in memoria, i campioni vengono raggruppati per
+    sensore e scritti con un solo update ($push/$each per sensore e un unico last_updated).
+    Restituisce il numero di misurazioni scritte, quello dei duplicati scartati e gli
+    errori indicizzati per posizione.
+    """
+    compatible_sensors = digital_twin.get("compatible_sensors", [])
+    use_ontology_units = bool(digital_twin.get("device_type"))
+    
+    errors = []
+    accepted = []
+    samples_by_sensor: Dict[str, List[Dict[str, Any]]] = {}
+    unit_measures: Dict[str, str] = {}
+    duplicates = 0
+    
+    for i, measurement in enumerate(measurements):
+        sensor_type = measurement.attribute_name
+        if sensor_type not in compatible_sensors:
+            errors.append({
+                "index": i,
+                "attribute_name": sensor_type,
+                "error": f"Il sensore '{sensor_type}' non è compatibile con questo Digital Twin"
+            })
+            continue
+        
+        # L'unità predefinita dell'ontologia viene risolta una sola volta per sensore
+        if sensor_type not in unit_measures:
+            unit_measures[sensor_type] = get_ontology_unit_measure(sensor_type) if use_ontology_units else ""
+        
+        sensor_data = SensorData(
+            timestamp=measurement.timestamp,
+            value=measurement.value,
+            unit_measure=unit_measures[sensor_type]
         )
+        samples_by_sensor.setdefault(sensor_type, []).append(sensor_data.dict())
+        accepted.append(i)
     
-    # Aggiorna anche last_updated
-    await update_document(
-        "digital_twins",
-        digital_twin_id,
-        {"digital_replica.last_updated": timestamp}
-    )
+    if accepted:
+        success, duplicates = await _write_sensor_samples(
+            digital_twin["id"],
+            samples_by_sensor,
+            {"compatible_sensors": {"$all": list(samples_by_sensor.keys())}}
+        )
+        
+        if not success:
+            for i in accepted:
+                errors.append({
+                    "index": i,
+                    "attribute_name": measurements[i].attribute_name,
+                    "error": "Impossibile aggiungere i dati del sensore"
+                })
+            errors.sort(key=lambda error: error["index"])
+            accepted = []
+            duplicates = 0
     
-    return True
+    return {
+        "successful": len(accepted) - duplicates,
+        "duplicates": duplicates,
+        "errors": errors
+    }
+
+async def add_sensor_columns_to_digital_twin(
+    digital_twin: Dict[str, Any],
+    columns: Dict[str, SensorColumn]
+) -> Dict[str, Any]:
+    """
+    Aggiunge ad un digital twin già caricato un batch in forma colonnare
+
+    Le colonne ts/values di ogni sensore vengono trasformate direttamente nei campioni
+    da salvare, senza costruire un SensorMeasurement per misurazione, e scritte con un
+    solo update come in add_sensor_data_batch_to_digital_twin. Gli errori sono per sensore.
+    """
+    compatible_sensors = digital_twin.get("compatible_sensors", [])
+    use_ontology_units = bool(digital_twin.get("device_type"))
+
+    errors = []
+    samples_by_sensor: Dict[str, List[Dict[str, Any]]] = {}
+    duplicates = 0
+
+    for sensor_type, column in columns.items():
+        if sensor_type not in compatible_sensors:
+            errors.append({
+                "attribute_name": sensor_type,
+                "count": len(column.ts),
+                "error": f"Il sensore '{sensor_type}' non è compatibile con questo Digital Twin"
+            })
+            continue
+        if not column.ts:
+            continue
+
+        unit_measure = column.unit_measure
+        if not unit_measure and use_ontology_units:
+            unit_measure = get_ontology_unit_measure(sensor_type)
+
+        samples_by_sensor[sensor_type] = [
+            {"timestamp": timestamp, "value": value, "unit_measure": unit_measure}
+            for timestamp, value in zip(column.ts, column.values)
+        ]
+
+    if samples_by_sensor:
+        success, duplicates = await _write_sensor_samples(
+            digital_twin["id"],
+            samples_by_sensor,
+            {"compatible_sensors": {"$all": list(samples_by_sensor.keys())}}
+        )
+
+        if not success:
+            for sensor_type, samples in samples_by_sensor.items():
+                errors.append({
+                    "attribute_name": sensor_type,
+                    "count": len(samples),
+                    "error": "Impossibile aggiungere i dati del sensore"
+                })
+            samples_by_sensor = {}
+            duplicates = 0
+
+    return {
+        "successful": sum(len(samples) for samples in samples_by_sensor.values()) - duplicates,
+        "duplicates": duplicates,
+        "errors": errors
+    }
+
+async def get_sensor_history(
+    digital_twin: Dict[str, Any],
+    sensor_types: Optional[List[str]] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    limit: Optional[int] = None,
+    descending: bool = False,
+    fields: Optional[List[str]] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Restituisce lo storico dei sensori di un digital twin dallo storage configurato
+
+    Il filtro sull'intervallo [start, end], il limite di campioni per sensore (i più
+    recenti se descending) e la proiezione dei campi dei campioni vengono applicati dal
+    database, quindi il digital twin può essere caricato senza lo storico.
+    """
+    if settings.SENSOR_STORAGE_MODE == "bucketed":
+        return await find_sensor_samples(digital_twin["id"], sensor_types, start, end, limit, descending, fields)
+    
+    samples = build_samples_expression("$sensor.v", start, end, limit, descending, fields)
+    
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": {"id": digital_twin["id"]}},
+        {"$project": {"_id": 0, "sensor": {"$objectToArray": "$digital_replica.sensor_data"}}},
+        {"$unwind": "$sensor"}
+    ]
+    if sensor_types is not None:
+        pipeline.append({"$match": {"sensor.k": {"$in": sensor_types}}})
+    pipeline.append({"$project": {"sensor_type": "$sensor.k", "samples": samples}})
+    
+    sensor_data = {}
+    async for sensor in get_database()["digital_twins"].aggregate(pipeline):
+        if descending:
+            sensor["samples"].reverse()
+        sensor_data[sensor["sensor_type"]] = sensor["samples"]
+    return sensor_data
+
+# Numero massimo di digital twin letti con una richiesta dello stato più recente
+MAX_LATEST_TWINS = 1000
+
+def build_latest_projection(sensor_types: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Proiezione che legge dal twin solo lo stato più recente dei sensori indicati"""
+    if sensor_types is None:
+        return {"_id": 0, "id": 1, "owner_id": 1, "digital_replica.latest": 1}
+    return {
+        "_id": 0, "id": 1, "owner_id": 1,
+        **{f"digital_replica.latest.{sensor_type}": 1 for sensor_type in sensor_types}
+    }
+
+def get_latest_sensor_values(digital_twin: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Ultimo campione di ogni sensore (timestamp, value, unit_measure) di un twin letto con build_latest_projection"""
+    return (digital_twin.get("digital_replica") or {}).get("latest") or {}
+
+async def find_latest_sensor_values(
+    digital_twin_ids: List[str],
+    owner_id: str,
+    sensor_types: Optional[List[str]] = None
+) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Stato più recente dei sensori di più digital twin dello stesso proprietario
+
+    Legge solo il sotto-documento digital_replica.latest, mantenuto ad ogni scrittura,
+    quindi il costo non dipende dalla lunghezza dello storico. I twin inesistenti o di
+    altri proprietari vengono omessi.
+    """
+    cursor = get_database()["digital_twins"].find(
+        {"id": {"$in": digital_twin_ids}, "owner_id": owner_id},
+        build_latest_projection(sensor_types)
+    )
+    return {
+        digital_twin["id"]: get_latest_sensor_values(digital_twin)
+        async for digital_twin in cursor
+    }
+
+# Campi aggiuntivi della rappresentazione ridotta dei twin (fields=) e loro percorso nel documento
+SUMMARY_EXTRA_FIELDS = {
+    "device_id": "device_id",
+    "template_id": "template_id",
+    "owner_id": "owner_id",
+    "compatible_sensors": "compatible_sensors",
+    "metadata": "digital_replica.metadata",
+    "service_layer": "service_layer",
+    "application_layer": "application_layer"
+}
+
+def build_summary_projection(fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Proiezione che legge dai twin solo i campi della rappresentazione ridotta, più quelli richiesti"""
+    projection = {
+        "id": 1,
+        "name": 1,
+        "device_type": 1,
+        "digital_replica.last_updated": 1,
+        "digital_replica.latest": 1
+    }
+    for field in fields or []:
+        projection[SUMMARY_EXTRA_FIELDS[field]] = 1
+    return projection
+
+def build_digital_twin_summary(digital_twin: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rappresentazione ridotta di un twin letto con build_summary_projection
+
+    last_updated e latest vengono portati al primo livello; i campi aggiuntivi compaiono
+    solo se presenti nel documento letto, cioè se sono stati richiesti.
+    """
+    digital_replica = digital_twin.get("digital_replica") or {}
+    summary = {
+        "id": digital_twin["id"],
+        "name": digital_twin.get("name"),
+        "device_type": digital_twin.get("device_type"),
+        "last_updated": digital_replica.get("last_updated"),
+        "latest": digital_replica.get("latest") or {}
+    }
+    for field, path in SUMMARY_EXTRA_FIELDS.items():
+        document, key = (digital_replica, path.split(".", 1)[1]) if path.startswith("digital_replica.") else (digital_twin, path)
+        if key in document:
+            summary[field] = document[key]
+    # I layer vengono completati con i valori predefiniti, come nella rappresentazione completa
+    for field, model in (("service_layer", ServiceLayer), ("application_layer", ApplicationLayer)):
+        if summary.get(field) is not None:
+            summary[field] = model.model_validate(summary[field]).model_dump()
+    return summary
+
+async def find_owner_digital_twin_ids(owner_id: str) -> List[str]:
+    """ID di tutti i digital twin di un proprietario, senza leggere i documenti"""
+    cursor = get_database()["digital_twins"].find({"owner_id": owner_id}, {"_id": 0, "id": 1})
+    return [digital_twin["id"] async for digital_twin in cursor]
 
 async def generate_random_sensor_data(digital_twin_id: str) -> Dict[str, Any]:
     """Genera dati random per tutti i sensori compatibili di un digital twin"""
@@ -239,7 +862,7 @@ async def generate_random_sensor_data(digital_twin_id: str) -> Dict[str, Any]:
     if not dt:
         return {"success": False, "message": "Digital Twin non trovato"}
     
-    timestamp = datetime.datetime.now().isoformat()
+    timestamp = datetime.datetime.utcnow()
     generated_data = {}
     
     # Se il digital twin è basato su ontologia
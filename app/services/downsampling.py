@@ -0,0 +1,132 @@
+# app/services/downsampling.py
+"""
+Decimazione visuale dello storico dei sensori per i grafici.
+
+Riduce i campioni di ogni sensore ad un numero massimo di punti scegliendo quelli che
+preservano la forma della curva, invece di mediarli come l'aggregazione a intervalli:
+
+- lttb: Largest-Triangle-Three-Buckets, per ogni gruppo di campioni tiene quello che
+  forma il triangolo più grande con il punto scelto prima e la media del gruppo dopo
+- minmax: per ogni gruppo tiene il minimo e il massimo, così nessun picco va perso
+
+Il primo e l'ultimo campione vengono sempre mantenuti. I calcoli sono vettoriali con
+NumPy; i sensori con valori non numerici vengono ridotti a campioni equidistanti.
+"""
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from app.db.timeseries import EPOCH, parse_timestamp, is_numeric
+
+DOWNSAMPLING_METHODS = ("lttb", "minmax")
+
+DEFAULT_DOWNSAMPLE_POINTS = 1000
+MAX_DOWNSAMPLE_POINTS = 10000
+
+def _get_group_edges(start: int, end: int, groups: int) -> np.ndarray:
+    """Confini di groups gruppi contigui e non vuoti degli indici [start, end)"""
+    return np.linspace(start, end, groups + 1).astype(np.int64)
+
+def lttb_indexes(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Indici dei punti scelti da Largest-Triangle-Three-Buckets (x crescente)
+
+    Le medie dei gruppi vengono calcolate tutte insieme con le somme cumulative; la scelta
+    in ogni gruppo dipende dal punto scelto nel precedente, quindi i gruppi vengono
+    visitati in ordine, ma le aree di ciascun gruppo sono calcolate in un'unica operazione.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    # Coordinate relative al primo punto, per non perdere precisione sui timestamp
+    x = x - x[0]
+    edges = _get_group_edges(1, n - 1, points - 2)
+    starts, ends = edges[:-1], edges[1:]
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = ends - starts
+    # Il punto "successivo" di ogni gruppo è la media del gruppo dopo (l'ultimo punto per l'ultimo gruppo)
+    next_x = np.append(((sum_x[ends] - sum_x[starts]) / sizes)[1:], x[-1])
+    next_y = np.append(((sum_y[ends] - sum_y[starts]) / sizes)[1:], y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(points - 2):
+        start, end = starts[i], ends[i]
+        areas = np.abs(
+            (x[previous] - next_x[i]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y[i] - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+def minmax_indexes(y: np.ndarray, points: int) -> np.ndarray:
+    """Indici del minimo e del massimo di ogni gruppo, più il primo e l'ultimo punto"""
+    n = len(y)
+    if points >= n or points < 4:
+        return np.arange(n) if points >= n else even_indexes(n, points)
+
+    edges = _get_group_edges(1, n - 1, (points - 2) // 2)
+    group = np.repeat(np.arange(len(edges) - 1), np.diff(edges))
+    inner = np.arange(1, n - 1)
+    # Ordinando per (gruppo, valore) il primo elemento di ogni gruppo è il minimo e l'ultimo il massimo
+    order = inner[np.lexsort((y[1:-1], group))]
+    group_starts = edges[:-1] - 1
+    group_ends = edges[1:] - 2
+    return np.unique(np.concatenate(([0, n - 1], order[group_starts], order[group_ends])))
+
+def even_indexes(n: int, points: int) -> np.ndarray:
+    """Indici di points campioni equidistanti, compresi il primo e l'ultimo"""
+    if points >= n:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, max(points, 2)).round().astype(np.int64))
+
+def downsample_samples(samples: List[Dict[str, Any]], points: int, method: str = "lttb") -> List[Dict[str, Any]]:
+    """Riduce i campioni di un sensore (in ordine di timestamp) a non più di points"""
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"Metodo di decimazione non supportato: '{method}'")
+    if len(samples) <= points:
+        return samples
+
+    if not all(is_numeric(sample.get("value")) for sample in samples):
+        indexes = even_indexes(len(samples), points)
+    elif method == "minmax":
+        indexes = minmax_indexes(np.array([sample["value"] for sample in samples], dtype=np.float64), points)
+    else:
+        # Secondi dall'epoch: più veloce della conversione di datetime in datetime64
+        x = np.fromiter(
+            ((parse_timestamp(sample["timestamp"]) - EPOCH).total_seconds() for sample in samples),
+            dtype=np.float64,
+            count=len(samples)
+        )
+        y = np.array([sample["value"] for sample in samples], dtype=np.float64)
+        indexes = lttb_indexes(x, y, points)
+    return [samples[i] for i in indexes]
+
+def downsample_sensor_data(
+    sensor_data: Dict[str, List[Dict[str, Any]]],
+    points: int = DEFAULT_DOWNSAMPLE_POINTS,
+    method: str = "lttb",
+    descending: bool = False,
+    fields: Optional[List[str]] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Decima lo storico di ogni sensore a non più di points campioni
+
+    Con descending i campioni sono in ordine decrescente e lo restano; fields indica i
+    campi da restituire, se lo storico è stato letto con timestamp e value in più per
+    poterlo decimare.
+    """
+    result = {}
+    for sensor_type, samples in sensor_data.items():
+        ordered = samples[::-1] if descending else samples
+        selected = downsample_samples(ordered, points, method)
+        if descending:
+            selected = selected[::-1]
+        if fields:
+            selected = [{field: sample[field] for field in fields if field in sample} for sample in selected]
+        result[sensor_type] = selected
+    return result
@@ -0,0 +1,86 @@
+# app/services/fleet_query.py
+"""
+Query sulla flotta dei digital twin.
+
+Un FleetQuery seleziona i twin per tipo (o sottoalbero dell'ontologia), proprietario,
+sensori compatibili, confronti sull'ultimo valore dei sensori e finestra sull'ultimo
+aggiornamento. Il filtro viene tradotto in una query Mongo sui campi mantenuti ad ogni
+scrittura (digital_replica.latest e digital_replica.last_updated), quindi lo storico
+non viene mai letto; FLEET_QUERY_INDEXES coprono proprietario, tipo e ultimo
+aggiornamento e, con un indice wildcard, i confronti sugli ultimi valori.
+"""
+from typing import Dict, List, Any, Optional
+
+from pymongo import ASCENDING
+
+from app.db.database import get_database
+from app.models.fleet_query import FleetQuery
+from app.ontology.manager import OntologyManager
+
+COMPARISON_OPERATORS = {"eq": "$eq", "ne": "$ne", "gt": "$gt", "gte": "$gte", "lt": "$lt", "lte": "$lte"}
+
+# Indici dei twin per le query sulla flotta, oltre a quelli delle liste (owner_id, _id/name)
+FLEET_QUERY_INDEXES = [
+    [("owner_id", ASCENDING), ("device_type", ASCENDING), ("_id", ASCENDING)],
+    [("owner_id", ASCENDING), ("device_type", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)],
+    [("owner_id", ASCENDING), ("digital_replica.last_updated", ASCENDING)],
+    [("device_type", ASCENDING), ("_id", ASCENDING)],
+    # Indice wildcard sugli ultimi valori di tutti i sensori (MongoDB 4.2+), per ultimo
+    [("digital_replica.latest.$**", ASCENDING)]
+]
+
+async def ensure_fleet_query_indexes() -> None:
+    """Crea gli indici usati dalle query sulla flotta"""
+    collection = get_database()["digital_twins"]
+    for keys in FLEET_QUERY_INDEXES:
+        await collection.create_index(keys)
+
+def resolve_device_types(device_type: str, include_subtypes: bool) -> List[str]:
+    """
+    Tipi di dispositivo selezionati da device_type, con le sottoclassi se richieste
+
+    Solleva ValueError se il tipo non è definito nell'ontologia.
+    """
+    ontology = OntologyManager()
+    if device_type not in ontology.get_all_sensor_types():
+        raise ValueError(f"Il tipo '{device_type}' non è definito nell'ontologia")
+    if not include_subtypes:
+        return [device_type]
+    return [device_type] + sorted(ontology.get_all_subclasses(device_type))
+
+def build_fleet_filter(fleet_query: FleetQuery, owner_id: Optional[str]) -> Dict[str, Any]:
+    """
+    Filtro Mongo dei twin selezionati da una query sulla flotta
+
+    owner_id limita i twin ad un proprietario (None: tutti i proprietari). I confronti
+    sugli ultimi valori escludono i twin senza campioni del sensore, anche con "ne".
+    Solleva ValueError se device_type non è definito nell'ontologia.
+    """
+    query: Dict[str, Any] = {}
+    if owner_id is not None:
+        query["owner_id"] = owner_id
+    
+    if fleet_query.device_type:
+        device_types = resolve_device_types(fleet_query.device_type, fleet_query.include_subtypes)
+        query["device_type"] = device_types[0] if len(device_types) == 1 else {"$in": device_types}
+    
+    if fleet_query.sensors:
+        query["compatible_sensors"] = {"$all": list(dict.fromkeys(fleet_query.sensors))}
+    
+    if fleet_query.updated_after or fleet_query.updated_before:
+        window = query["digital_replica.last_updated"] = {}
+        if fleet_query.updated_after:
+            window["$gte"] = fleet_query.updated_after
+        if fleet_query.updated_before:
+            window["$lte"] = fleet_query.updated_before
+    
+    comparisons = []
+    for condition in fleet_query.latest:
+        comparison: Dict[str, Any] = {COMPARISON_OPERATORS[condition.op]: condition.value}
+        if condition.op == "ne":
+            comparison["$exists"] = True
+        comparisons.append({f"digital_replica.latest.{condition.sensor}.value": comparison})
+    if comparisons:
+        query["$and"] = comparisons
+    
+    return query
@@ -0,0 +1,179 @@
+# app/services/gateway_ingestion.py
+"""
+Ingestione dei dati di più dispositivi inoltrati da un gateway.
+
+Il gateway è un dispositivo registrato con is_gateway: può inviare dati solo per i
+dispositivi elencati in gateway_device_ids che hanno il suo stesso proprietario, così
+l'API key di un singolo sensore non permette di scrivere su tutti i twin del proprietario.
+I twin vengono risolti e verificati con una sola query, i campioni di tutti i dispositivi
+vengono scritti con un solo bulk_write e la risposta riporta il risultato di ogni
+dispositivo.
+"""
+from typing import Dict, List, Any, Tuple
+import datetime
+
+from pymongo import UpdateOne
+
+from app.db.database import get_database
+from app.models.sensor import GatewayDeviceData
+from app.services.digital_twin_service import write_sensor_samples_bulk, get_ontology_unit_measure
+from app.services.ingestion_queue import ingestion_pipeline
+
+async def _find_allowed_digital_twins(
+    gateway: Dict[str, Any],
+    items: List[GatewayDeviceData]
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """
+    Carica con una sola query i twin indicati (per ID o per dispositivo) su cui il gateway può scrivere
+
+    Sono i twin dello stesso proprietario del gateway associati a un dispositivo in
+    gateway_device_ids.
+    """
+    digital_twin_ids = list({item.digital_twin_id for item in items if item.digital_twin_id})
+    device_ids = list({item.device_id for item in items if item.device_id})
+
+    db = get_database()
+    cursor = db["digital_twins"].find(
+        {
+            "owner_id": gateway.get("owner_id"),
+            "device_id": {"$in": gateway.get("gateway_device_ids", [])},
+            "$or": [{"id": {"$in": digital_twin_ids}}, {"device_id": {"$in": device_ids}}]
+        },
+        {"_id": 0, "id": 1, "device_id": 1, "device_type": 1, "compatible_sensors": 1}
+    )
+
+    by_id: Dict[str, Dict[str, Any]] = {}
+    by_device: Dict[str, Dict[str, Any]] = {}
+    async for digital_twin in cursor:
+        by_id[digital_twin["id"]] = digital_twin
+        if digital_twin.get("device_id"):
+            by_device[digital_twin["device_id"]] = digital_twin
+    return by_id, by_device
+
+async def ingest_gateway_data(gateway: Dict[str, Any], items: List[GatewayDeviceData]) -> Dict[str, Any]:
+    """
+    Valida e scrive i dati di più dispositivi inviati da un gateway
+
+    Ogni elemento indica device_id o digital_twin_id, un timestamp facoltativo e i valori
+    per sensore. Gli elementi di twin inesistenti, di altri proprietari o di dispositivi
+    non associati al gateway vengono scartati; i sensori non compatibili vengono riportati
+    tra gli errori dell'elemento. Gli elementi senza timestamp ricevono l'ora del server:
+    una seconda lettura senza timestamp dello stesso twin e sensore avrebbe la stessa
+    chiave di deduplicazione, quindi viene rifiutata tra gli errori invece di essere
+    scartata come duplicato. I campioni già ricevuti (stesso twin, sensore e timestamp)
+    vengono contati tra i duplicati.
+    Con la pipeline write-behind attiva i campioni vengono accodati (IngestionQueueFull
+    se la coda è piena).
+    """
+    twins_by_id, twins_by_device = await _find_allowed_digital_twins(gateway, items)
+
+    now = datetime.datetime.utcnow()
+    unit_measures: Dict[str, str] = {}
+    entries = []
+    attributes_by_device: Dict[str, Dict[str, Tuple[datetime.datetime, Dict[str, Any]]]] = {}
+    results = []
+    # (twin, sensore) che hanno già ricevuto una lettura senza timestamp in questo payload
+    untimed_sensors = set()
+
+    for i, item in enumerate(items):
+        result: Dict[str, Any] = {
+            "index": i,
+            "device_id": item.device_id,
+            "digital_twin_id": item.digital_twin_id,
+            "status": "success",
+            "updated_sensors": [],
+            "errors": []
+        }
+        results.append(result)
+
+        if bool(item.device_id) == bool(item.digital_twin_id):
+            result["status"] = "error"
+            result["errors"].append({"error": "Indicare device_id oppure digital_twin_id"})
+            continue
+
+        digital_twin = twins_by_device.get(item.device_id) if item.device_id else twins_by_id.get(item.digital_twin_id)
+        if not digital_twin:
+            # Stessa risposta per twin inesistenti, di altri proprietari o non associati al gateway
+            result["status"] = "error"
+            result["errors"].append({"error": "Digital Twin non trovato"})
+            continue
+
+        result["device_id"] = digital_twin.get("device_id")
+        result["digital_twin_id"] = digital_twin["id"]
+        compatible_sensors = digital_twin.get("compatible_sensors", [])
+        timestamp = item.timestamp or now
+        attributes = {}
+
+        for sensor_type, value in item.data.items():
+            if sensor_type not in compatible_sensors:
+                result["errors"].append({
+                    "attribute_name": sensor_type,
+                    "error": f"Il sensore '{sensor_type}' non è compatibile con questo Digital Twin"
+                })
+                continue
+            if item.timestamp is None:
+                if (digital_twin["id"], sensor_type) in untimed_sensors:
+                    result["errors"].append({
+                        "attribute_name": sensor_type,
+                        "error": "Più letture senza timestamp per lo stesso sensore: indicare timestamp"
+                    })
+                    continue
+                untimed_sensors.add((digital_twin["id"], sensor_type))
+
+            # L'unità predefinita dell'ontologia viene risolta una sola volta per sensore
+            unit_measure = ""
+            if digital_twin.get("device_type"):
+                if sensor_type not in unit_measures:
+                    unit_measures[sensor_type] = get_ontology_unit_measure(sensor_type)
+                unit_measure = unit_measures[sensor_type]
+
+            entries.append((
+                digital_twin["id"],
+                sensor_type,
+                {"timestamp": timestamp, "value": value, "unit_measure": unit_measure},
+                None
+            ))
+            attributes[sensor_type] = {"value": value, "unit_measure": unit_measure}
+            result["updated_sensors"].append(sensor_type)
+
+        if not result["updated_sensors"]:
+            result["status"] = "error"
+        elif result["device_id"]:
+            # Un gateway può inviare dati bufferizzati fuori ordine: per ogni sensore vale il più recente
+            device_attributes = attributes_by_device.setdefault(result["device_id"], {})
+            for sensor_type, attribute in attributes.items():
+                if sensor_type not in device_attributes or timestamp >= device_attributes[sensor_type][0]:
+                    device_attributes[sensor_type] = (timestamp, attribute)
+
+    duplicates = 0
+    if entries:
+        if ingestion_pipeline.running:
+            duplicates = await ingestion_pipeline.enqueue([entry[:3] for entry in entries])
+        else:
+            duplicates = await write_sensor_samples_bulk(entries)
+
+    if attributes_by_device and not ingestion_pipeline.degraded:
+        # Come POST /devices/data, gli attributi del dispositivo contengono gli ultimi valori;
+        # dati arrivati in ritardo non sovrascrivono attributi più recenti (attributes_updated_at)
+        operations = []
+        for device_id, device_attributes in attributes_by_device.items():
+            newest = max(timestamp for timestamp, _ in device_attributes.values())
+            operations.append(UpdateOne(
+                {"id": device_id, "attributes_updated_at": {"$not": {"$gt": newest}}},
+                {"$set": {
+                    "attributes": {sensor_type: attribute for sensor_type, (_, attribute) in device_attributes.items()},
+                    "attributes_updated_at": newest
+                }}
+            ))
+        db = get_database()
+        await db["devices"].bulk_write(operations, ordered=False)
+
+    successful = sum(1 for result in results if result["status"] == "success")
+    return {
+        "status": "success" if successful == len(results) else "partial" if successful else "error",
+        "successful": successful,
+        "failed": len(results) - successful,
+        "samples": len(entries) - duplicates,
+        "duplicates": duplicates,
+        "results": results
+    }
@@ -0,0 +1,293 @@
+# app/services/ingestion_queue.py
+"""
+Pipeline di ingestione write-behind.
+
+Gli endpoint accodano campioni già validati e rispondono subito; un task in background
+raggruppa i campioni per digital twin e li scrive con un solo bulk_write quando il
+batch raggiunge INGESTION_FLUSH_SIZE campioni o dopo INGESTION_FLUSH_INTERVAL_MS.
+
+Con il write-ahead log attivo ogni campione viene prima reso persistente su disco: se
+MongoDB non è raggiungibile il writer smette di scrivere (i campioni sono già nel log)
+e un replayer riapplica il log con backoff esponenziale quando il database torna
+disponibile, invece di ritentare ogni singola scrittura. Solo gli errori di connessione
+indicano che il database non è raggiungibile: i record che MongoDB rifiuta per altri
+motivi vengono messi in quarantena (vedi apply_write_ahead_log_records).
+
+Senza write-ahead log i campioni confermati esistono solo in memoria: un flush fallito
+non raggiungibile viene ritentato INGESTION_FLUSH_RETRIES volte con backoff esponenziale,
+poi i campioni (come quelli rifiutati da MongoDB per altri motivi) vengono scartati (e le loro chiavi di deduplicazione rilasciate, così un nuovo invio
+non viene ignorato). Dati già confermati possono quindi andare persi se MongoDB resta
+irraggiungibile o se il processo termina; solo WAL_ENABLED garantisce la durabilità.
+"""
+from typing import Dict, List, Any, Optional, Tuple
+import asyncio
+import logging
+
+from pymongo.errors import ConnectionFailure
+
+from app.config import settings
+from app.db.database import get_database
+from app.services.digital_twin_service import write_sensor_samples_bulk
+from app.services.deduplication import claim_samples, get_sample_key, recent_keys
+from app.services.write_ahead_log import (
+    WriteAheadLog,
+    apply_write_ahead_log_records,
+    create_write_ahead_log,
+    replay_write_ahead_log
+)
+
+logger = logging.getLogger(__name__)
+
+class IngestionQueueFull(Exception):
+    """La coda ha superato l'high-water mark: il client deve riprovare più tardi"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Ingestion queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class IngestionPipeline:
+    """Coda in memoria con un unico writer che esegue flush raggruppati per digital twin"""
+
+    def __init__(
+        self,
+        flush_size: int,
+        flush_interval: float,
+        high_water_mark: int,
+        retry_after: int,
+        wal: Optional[WriteAheadLog] = None
+    ):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.high_water_mark = high_water_mark
+        self.retry_after = retry_after
+        self.wal = wal
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._replayer: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Con il database non raggiungibile i campioni restano solo nel write-ahead log
+        self._degraded = False
+
+    @property
+    def running(self) -> bool:
+        return self._writer is not None and not self._stopping
+
+    @property
+    def degraded(self) -> bool:
+        """True se MongoDB non è raggiungibile e i campioni vengono solo registrati nel log"""
+        return self._degraded
+
+    def pending(self) -> int:
+        """Numero di campioni in attesa di essere scritti"""
+        return self._queue.qsize() if self._queue else 0
+
+    def status(self) -> Dict[str, Any]:
+        """Stato della pipeline e, se attivo, del write-ahead log"""
+        status = {
+            "running": self.running,
+            "queued": self.pending(),
+            "degraded": self._degraded
+        }
+        if self.wal:
+            status["wal"] = self.wal.status()
+        return status
+
+    async def start(self) -> None:
+        """Avvia il writer in background e riapplica i record del log rimasti da un arresto precedente"""
+        if self._writer is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        if self.wal:
+            self.wal.open()
+            if self.wal.last_lsn > self.wal.applied_lsn:
+                self._enter_degraded()
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Smette di accettare campioni e attende che la coda venga svuotata su Mongo"""
+        if self._writer is None:
+            return
+        self._stopping = True
+        # La sentinella sveglia il writer, che scrive tutto ciò che precede e termina
+        self._queue.put_nowait(None)
+        await self._writer
+        self._writer = None
+        self._queue = None
+
+        if self._replayer is not None:
+            # I record non ancora applicati restano nel log per il prossimo avvio
+            self._replayer.cancel()
+            try:
+                await self._replayer
+            except asyncio.CancelledError:
+                pass
+            self._replayer = None
+        if self.wal:
+            self.wal.close()
+
+    async def enqueue(self, samples: List[Tuple[str, str, Dict[str, Any]]]) -> int:
+        """
+        Accoda campioni già validati, come tuple (digital_twin_id, sensor_type, campione)
+
+        I campioni di una richiesta vengono accodati tutti o nessuno: se la coda ha
+        raggiunto l'high-water mark viene sollevata IngestionQueueFull. I campioni già
+        ricevuti di recente vengono scartati qui, prima del log; restituisce il numero
+        di duplicati. Con il write-ahead log attivo ritorna solo quando i campioni sono
+        stati scritti su disco.
+        """
+        if not self.running:
+            raise RuntimeError("Ingestion pipeline is not running")
+        if self._queue.qsize() >= self.high_water_mark:
+            raise IngestionQueueFull(self.retry_after)
+
+        new_indexes, claimed_keys = claim_samples(samples)
+        duplicates = len(samples) - len(new_indexes)
+        samples = [samples[i] for i in new_indexes]
+        try:
+            lsns = self.wal.append(samples) if self.wal else [None] * len(samples)
+        except Exception:
+            recent_keys.release(claimed_keys)
+            raise
+        # Accodati nello stesso ordine del log, prima di attendere il fsync
+        for (digital_twin_id, sensor_type, sample), lsn in zip(samples, lsns):
+            self._queue.put_nowait((digital_twin_id, sensor_type, sample, lsn))
+
+        if self.wal:
+            await self.wal.sync()
+        return duplicates
+
+    async def _next_batch(self) -> Tuple[List[Tuple[str, str, Dict[str, Any]]], bool]:
+        """Raccoglie campioni fino al limite di dimensione o di tempo; indica se è arrivata la sentinella"""
+        loop = asyncio.get_running_loop()
+        item = await self._queue.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.flush_size:
+            # Prima prende tutto ciò che è già in coda, poi attende fino alla scadenza
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self._queue.get_nowait()
+
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    async def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch, stopped = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+
+        # Dopo la sentinella non arrivano altri campioni: scrive quelli rimasti
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.flush_size):
+            await self._flush(remaining[start:start + self.flush_size])
+
+    async def _flush(self, batch: List[Tuple[str, str, Dict[str, Any], Optional[int]]]) -> None:
+        """Raggruppa i campioni per twin e sensore e li scrive con un solo bulk_write"""
+        if self._degraded:
+            # I campioni sono nel write-ahead log: li scriverà il replayer
+            return
+
+        if self.wal:
+            # Scarta i campioni già riapplicati dal replayer
+            batch = [entry for entry in batch if entry[3] > self.wal.applied_lsn]
+            if not batch:
+                return
+
+        # Un errore di scrittura non deve fermare il writer
+        delay = 1
+        for attempt in range(settings.INGESTION_FLUSH_RETRIES + 1):
+            try:
+                # I duplicati sono già stati scartati all'accodamento
+                await write_sensor_samples_bulk(batch, deduplicate=False)
+                break
+            except ConnectionFailure as e:
+                if self.wal:
+                    logger.warning(f"Could not flush {len(batch)} sensor samples, switching to WAL replay: {e}")
+                    self._enter_degraded()
+                    return
+                if attempt == settings.INGESTION_FLUSH_RETRIES:
+                    self._drop(batch, e)
+                    return
+                logger.warning(f"Could not flush {len(batch)} sensor samples, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                if not self.wal:
+                    self._drop(batch, e)
+                    return
+                # Un record che MongoDB rifiuta sempre non deve bloccare il log
+                try:
+                    await apply_write_ahead_log_records(self.wal, batch)
+                except ConnectionFailure as e:
+                    logger.warning(f"Could not flush {len(batch)} sensor samples, switching to WAL replay: {e}")
+                    self._enter_degraded()
+                return
+
+        if self.wal:
+            self.wal.mark_applied(batch[-1][3])
+
+    def _drop(self, batch: List[Tuple[str, str, Dict[str, Any], Optional[int]]], error: Exception) -> None:
+        """Scarta un batch non scrivibile senza write-ahead log"""
+        # Un nuovo invio degli stessi campioni non deve risultare duplicato
+        recent_keys.release([get_sample_key(*entry[:3]) for entry in batch])
+        logger.error(f"Could not flush {len(batch)} sensor samples, dropping them: {error}")
+
+    def _enter_degraded(self) -> None:
+        self._degraded = True
+        if self._replayer is None:
+            self._replayer = asyncio.create_task(self._replay_until_caught_up())
+
+    async def _replay_until_caught_up(self) -> None:
+        """Attende che Mongo sia raggiungibile e riapplica il log fino a raggiungere i nuovi campioni"""
+        delay = 1
+        while True:
+            try:
+                await get_database().command("ping")
+                result = await replay_write_ahead_log(self.wal, settings.WAL_REPLAY_BATCH_SIZE)
+            except ConnectionFailure as e:
+                logger.warning(f"Database unavailable, retrying WAL replay in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, settings.WAL_REPLAY_MAX_BACKOFF_SECONDS)
+                continue
+            except Exception as e:
+                # I record rifiutati sono già in quarantena: qui arrivano solo errori del log
+                logger.exception(f"WAL replay failed, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, settings.WAL_REPLAY_MAX_BACKOFF_SECONDS)
+                continue
+
+            # Controllo e cambio di stato senza await: nessun campione può inserirsi nel mezzo
+            if self.wal.last_lsn <= self.wal.applied_lsn:
+                self._degraded = False
+                self._replayer = None
+                logger.info(f"WAL replay completed: {result}")
+                return
+            delay = 1
+
+ingestion_pipeline = IngestionPipeline(
+    flush_size=settings.INGESTION_FLUSH_SIZE,
+    flush_interval=settings.INGESTION_FLUSH_INTERVAL_MS / 1000,
+    high_water_mark=settings.INGESTION_QUEUE_HIGH_WATER,
+    retry_after=settings.INGESTION_RETRY_AFTER_SECONDS,
+    wal=create_write_ahead_log() if settings.WAL_ENABLED else None
+)
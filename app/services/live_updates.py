@@ -0,0 +1,122 @@
+# app/services/live_updates.py
+"""
+Aggiornamenti in tempo reale dei digital twin (Server-Sent Events).
+
+Il percorso di scrittura pubblica sull'hub i campioni appena salvati di ogni twin; ogni
+client iscritto ha una sottoscrizione che li accumula finché il client non li legge,
+quindi i messaggi vengono raggruppati e chi scrive non attende mai i client lenti.
+Se un client resta indietro di più di LIVE_UPDATES_MAX_PENDING campioni viene tenuto
+solo l'ultimo campione di ogni sensore e il messaggio indica quanti ne sono stati
+scartati, così il client sa di doversi risincronizzare.
+
+L'hub è in memoria: un client riceve solo le scritture eseguite dallo stesso processo.
+"""
+from typing import Dict, List, Any, Optional, Iterable, Set, AsyncIterator
+import asyncio
+import datetime
+import json
+
+from app.config import settings
+from app.db.timeseries import parse_timestamp
+
+class SensorSubscription:
+    """Campioni pubblicati per alcuni digital twin e non ancora inviati al client"""
+
+    def __init__(self, digital_twin_ids: Iterable[str], max_pending: int):
+        self.digital_twin_ids = frozenset(digital_twin_ids)
+        self.max_pending = max_pending
+        self._pending: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        self._pending_count = 0
+        self._dropped = 0
+        self._ready = asyncio.Event()
+
+    def push(self, digital_twin_id: str, samples_by_sensor: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Accoda i campioni senza attendere: il client li riceverà con il prossimo messaggio"""
+        pending = self._pending.setdefault(digital_twin_id, {})
+        for sensor_type, samples in samples_by_sensor.items():
+            pending.setdefault(sensor_type, []).extend(samples)
+            self._pending_count += len(samples)
+        if self._pending_count > self.max_pending:
+            self._coalesce()
+        self._ready.set()
+
+    def _coalesce(self) -> None:
+        """Tiene solo l'ultimo campione di ogni sensore, contando quelli scartati"""
+        for pending in self._pending.values():
+            for sensor_type, samples in pending.items():
+                latest = max(samples, key=lambda sample: parse_timestamp(sample["timestamp"]))
+                self._dropped += len(samples) - 1
+                pending[sensor_type] = [latest]
+        self._pending_count = sum(len(pending) for pending in self._pending.values())
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Attende i campioni accumulati e li restituisce tutti insieme
+
+        Restituisce {"samples": {twin: {sensore: [campioni]}}, "dropped": n}, oppure None
+        se non arriva nulla entro timeout secondi.
+        """
+        if not self._pending:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self._ready.clear()
+        update = {"samples": self._pending, "dropped": self._dropped}
+        self._pending, self._pending_count, self._dropped = {}, 0, 0
+        return update
+
+class SensorUpdateHub:
+    """Pub/sub in memoria dei campioni scritti, per digital twin"""
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self._subscriptions: Dict[str, Set[SensorSubscription]] = {}
+
+    def subscribe(self, digital_twin_ids: Iterable[str]) -> SensorSubscription:
+        """Crea una sottoscrizione ai campioni dei digital twin indicati"""
+        subscription = SensorSubscription(digital_twin_ids, self.max_pending)
+        for digital_twin_id in subscription.digital_twin_ids:
+            self._subscriptions.setdefault(digital_twin_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: SensorSubscription) -> None:
+        for digital_twin_id in subscription.digital_twin_ids:
+            subscriptions = self._subscriptions.get(digital_twin_id)
+            if subscriptions is None:
+                continue
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[digital_twin_id]
+
+    def publish(self, digital_twin_id: str, samples_by_sensor: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Consegna i campioni di un twin alle sottoscrizioni, senza bloccare chi scrive"""
+        for subscription in self._subscriptions.get(digital_twin_id, ()):
+            subscription.push(digital_twin_id, samples_by_sensor)
+
+def _format_timestamp(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+async def iter_sse_events(digital_twin_ids: Iterable[str]) -> AsyncIterator[bytes]:
+    """
+    Invia i campioni dei digital twin indicati come eventi SSE "samples"
+
+    La sottoscrizione esiste solo mentre la risposta viene inviata: alla disconnessione
+    del client viene rimossa. Un commento di keep-alive ogni LIVE_UPDATES_KEEPALIVE_SECONDS
+    tiene aperta la connessione attraverso i proxy.
+    """
+    subscription = sensor_updates.subscribe(digital_twin_ids)
+    try:
+        while True:
+            update = await subscription.get(settings.LIVE_UPDATES_KEEPALIVE_SECONDS)
+            if update is None:
+                yield b": keep-alive\n\n"
+                continue
+            data = json.dumps(update, default=_format_timestamp)
+            yield f"event: samples\ndata: {data}\n\n".encode("utf-8")
+    finally:
+        sensor_updates.unsubscribe(subscription)
+
+sensor_updates = SensorUpdateHub(max_pending=settings.LIVE_UPDATES_MAX_PENDING)
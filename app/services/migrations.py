@@ -0,0 +1,236 @@
+# app/services/migrations.py
+"""Migrazioni dei dati esistenti, eseguite tramite manage.py"""
+from typing import Dict, Any, Optional, Tuple
+import datetime
+import logging
+
+from app.db.database import get_database
+from app.models.sensor import parse_utc_timestamp
+from app.db.timeseries import (
+    SENSOR_BUCKETS_COLLECTION,
+    build_bucket_operations,
+    write_bucket_operations
+)
+from app.db.rollups import (
+    SENSOR_ROLLUPS_COLLECTION,
+    build_rollup_operations,
+    write_rollup_operations
+)
+from app.services.digital_twin_service import get_sensor_history, mark_digital_twin_modified
+
+logger = logging.getLogger(__name__)
+
+# Numero massimo di campi aggiornati con un solo $set
+MAX_FIELDS_PER_UPDATE = 1000
+
+async def migrate_sensor_data_to_buckets(purge: bool = False) -> Dict[str, Any]:
+    """
+    Copia lo storico incorporato nei digital twin nella collezione dei bucket
+
+    I bucket di ogni twin migrato vengono ricostruiti da zero a partire dallo storico
+    incorporato, quindi la migrazione si può ripetere senza duplicare i campioni.
+    Con purge=True lo storico viene rimosso dal documento del twin dopo la copia.
+    Da eseguire a ingestione ferma (o in modalità dual) prima di passare a "bucketed".
+    """
+    db = get_database()
+    migrated_twins = 0
+    migrated_samples = 0
+    
+    cursor = db["digital_twins"].find(
+        {"digital_replica.sensor_data": {"$nin": [{}, None]}},
+        {"_id": 0, "id": 1, "digital_replica.sensor_data": 1}
+    )
+    async for digital_twin in cursor:
+        digital_twin_id = digital_twin["id"]
+        sensor_data = digital_twin["digital_replica"]["sensor_data"]
+        
+        operations = []
+        for sensor_type, samples in sensor_data.items():
+            if samples:
+                operations.extend(build_bucket_operations(digital_twin_id, sensor_type, samples))
+                migrated_samples += len(samples)
+        
+        await db[SENSOR_BUCKETS_COLLECTION].delete_many({"digital_twin_id": digital_twin_id})
+        await write_bucket_operations(operations)
+        
+        if purge:
+            await db["digital_twins"].update_one(
+                {"id": digital_twin_id},
+                {"$set": {"digital_replica.sensor_data": {}}}
+            )
+            await mark_digital_twin_modified(digital_twin_id)
+        
+        migrated_twins += 1
+        logger.info(f"Migrated sensor data of digital twin {digital_twin_id}")
+    
+    return {"digital_twins": migrated_twins, "samples": migrated_samples}
+
+async def rebuild_latest_sensor_values() -> Dict[str, Any]:
+    """
+    Ricostruisce lo stato più recente dei sensori (digital_replica.latest) dallo storico
+
+    Per i twin con dati precedenti all'introduzione dello stato più recente. L'ultimo
+    campione di ogni sensore viene letto dallo storage configurato e applicato con lo
+    stesso $max usato dall'ingestione, quindi si può eseguire con l'ingestione attiva
+    senza sovrascrivere campioni più recenti.
+    """
+    db = get_database()
+    result = {"digital_twins": 0, "sensors": 0}
+    
+    cursor = db["digital_twins"].find({}, {"_id": 0, "id": 1})
+    async for digital_twin in cursor:
+        history = await get_sensor_history(digital_twin, limit=1, descending=True)
+        latest = {}
+        for sensor_type, samples in history.items():
+            try:
+                timestamp = parse_utc_timestamp(samples[0]["timestamp"]) if samples else None
+            except ValueError:
+                timestamp = None
+            if timestamp is not None:
+                latest[f"digital_replica.latest.{sensor_type}"] = {
+                    "timestamp": timestamp,
+                    "value": samples[0].get("value"),
+                    "unit_measure": samples[0].get("unit_measure", "")
+                }
+        
+        if latest:
+            await db["digital_twins"].update_one({"id": digital_twin["id"]}, {"$max": latest})
+            await mark_digital_twin_modified(digital_twin["id"])
+            result["digital_twins"] += 1
+            result["sensors"] += len(latest)
+            logger.info(f"Rebuilt latest sensor values of digital twin {digital_twin['id']}")
+    
+    return result
+
+async def rebuild_sensor_rollups(digital_twin_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Ricalcola i rollup dei sensori dallo storico dei campioni
+
+    I rollup di ogni twin (o solo di quello indicato) vengono eliminati e ricostruiti dai
+    campioni letti dallo storage configurato, quindi il comando si può ripetere. Da
+    eseguire a ingestione ferma: i campioni scritti durante la ricostruzione di un twin
+    potrebbero essere contati due volte o persi.
+    """
+    db = get_database()
+    result = {"digital_twins": 0, "samples": 0, "rollups": 0}
+    
+    query = {"id": digital_twin_id} if digital_twin_id else {}
+    cursor = db["digital_twins"].find(query, {"_id": 0, "id": 1})
+    async for digital_twin in cursor:
+        history = await get_sensor_history(digital_twin)
+        
+        operations = []
+        for sensor_type, samples in history.items():
+            operations.extend(build_rollup_operations(digital_twin["id"], sensor_type, samples))
+            result["samples"] += len(samples)
+        
+        await db[SENSOR_ROLLUPS_COLLECTION].delete_many({"digital_twin_id": digital_twin["id"]})
+        await write_rollup_operations(operations)
+        
+        result["digital_twins"] += 1
+        result["rollups"] += len(operations)
+        logger.info(f"Rebuilt sensor rollups of digital twin {digital_twin['id']}")
+    
+    return result
+
+def _convert_timestamp(value: Any) -> Optional[datetime.datetime]:
+    """Converte un timestamp salvato come stringa; None se non va convertito o non è interpretabile"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return parse_utc_timestamp(value)
+    except ValueError:
+        return None
+
+async def _set_array_timestamps(
+    collection: str,
+    document_filter: Dict[str, Any],
+    conversions: Dict[Tuple[str, str], datetime.datetime]
+) -> None:
+    """
+    Sostituisce i timestamp stringa negli array di campioni di un documento, a blocchi
+
+    conversions associa (percorso dell'array, timestamp stringa) al datetime convertito.
+    I campioni vengono individuati dal valore del timestamp con arrayFilters e non dalla
+    posizione, che cambia quando una scrittura concorrente inserisce campioni in ritardo.
+    """
+    db = get_database()
+    items = list(conversions.items())
+    for start in range(0, len(items), MAX_FIELDS_PER_UPDATE):
+        fields: Dict[str, Any] = {}
+        array_filters = []
+        for i, ((array_path, value), converted) in enumerate(items[start:start + MAX_FIELDS_PER_UPDATE]):
+            fields[f"{array_path}.$[t{i}].timestamp"] = converted
+            array_filters.append({f"t{i}.timestamp": value})
+        await db[collection].update_one(document_filter, {"$set": fields}, array_filters=array_filters)
+
+async def migrate_sensor_timestamps() -> Dict[str, Any]:
+    """
+    Converte in datetime UTC i timestamp dei campioni salvati come stringa ISO-8601
+
+    I campioni negli array (storico dei twin e bucket) vengono aggiornati in base al
+    vecchio valore del timestamp e last_updated solo se è ancora la stringa letta, quindi
+    la migrazione si può eseguire con l'ingestione attiva, anche se nel frattempo arrivano
+    campioni in ritardo che spostano quelli esistenti. Converte anche la collezione
+    sensor_measurements. I timestamp non interpretabili restano invariati e vengono
+    contati in "invalid".
+    """
+    db = get_database()
+    result = {"digital_twins": 0, "buckets": 0, "measurements": 0, "samples": 0, "invalid": 0}
+    
+    def convert(conversions: Dict[Tuple[str, str], datetime.datetime], array_path: str, value: Any) -> None:
+        converted = _convert_timestamp(value)
+        if converted is not None:
+            conversions[(array_path, value)] = converted
+            result["samples"] += 1
+        elif isinstance(value, str):
+            result["invalid"] += 1
+    
+    cursor = db["digital_twins"].find(
+        {},
+        {"_id": 0, "id": 1, "digital_replica.sensor_data": 1, "digital_replica.last_updated": 1}
+    )
+    async for digital_twin in cursor:
+        digital_replica = digital_twin.get("digital_replica") or {}
+        conversions: Dict[Tuple[str, str], datetime.datetime] = {}
+        for sensor_type, samples in (digital_replica.get("sensor_data") or {}).items():
+            for sample in samples or []:
+                convert(conversions, f"digital_replica.sensor_data.{sensor_type}", sample.get("timestamp"))
+        if conversions:
+            await _set_array_timestamps("digital_twins", {"id": digital_twin["id"]}, conversions)
+        
+        last_updated = _convert_timestamp(digital_replica.get("last_updated"))
+        if last_updated is not None:
+            await db["digital_twins"].update_one(
+                {"id": digital_twin["id"], "digital_replica.last_updated": digital_replica["last_updated"]},
+                {"$set": {"digital_replica.last_updated": last_updated}}
+            )
+        
+        if conversions or last_updated is not None:
+            await mark_digital_twin_modified(digital_twin["id"])
+            result["digital_twins"] += 1
+            logger.info(f"Migrated sensor timestamps of digital twin {digital_twin['id']}")
+    
+    cursor = db[SENSOR_BUCKETS_COLLECTION].find({"samples.timestamp": {"$type": "string"}}, {"samples": 1})
+    async for bucket in cursor:
+        conversions = {}
+        for sample in bucket.get("samples", []):
+            convert(conversions, "samples", sample.get("timestamp"))
+        if conversions:
+            await _set_array_timestamps(SENSOR_BUCKETS_COLLECTION, {"_id": bucket["_id"]}, conversions)
+            result["buckets"] += 1
+    
+    cursor = db["sensor_measurements"].find({"timestamp": {"$type": "string"}}, {"timestamp": 1})
+    async for measurement in cursor:
+        converted = _convert_timestamp(measurement.get("timestamp"))
+        if converted is None:
+            result["invalid"] += 1
+            continue
+        await db["sensor_measurements"].update_one(
+            {"_id": measurement["_id"], "timestamp": measurement["timestamp"]},
+            {"$set": {"timestamp": converted}}
+        )
+        result["samples"] += 1
+        result["measurements"] += 1
+    
+    return result
@@ -0,0 +1,505 @@
+# app/services/sensor_aggregation.py
+"""
+Aggregazione dei dati dei sensori a intervalli fissi (downsampling lato server).
+
+Le serie restituite hanno un punto per ogni intervallo tra start ed end (None se
+l'intervallo non contiene campioni) e vengono calcolate con una pipeline di aggregazione
+Mongo, sullo storico del twin o sui bucket. Un semplice planner sceglie la sorgente:
+
+- con SENSOR_ROLLUPS_ENABLED, il rollup (minuto, ora, giorno) più grossolano che divide
+  l'intervallo; le parti di [start, end] non coperte da rollup completi vengono
+  aggregate dai campioni
+- in modalità bucketed, se l'intervallo è un multiplo di SENSOR_BUCKET_SECONDS, gli
+  aggregati precalcolati dei bucket, leggendo i campioni solo nei bucket agli estremi
+- altrimenti i campioni
+"""
+from typing import Dict, List, Any, Optional, Tuple
+import datetime
+import math
+import re
+
+from app.config import settings
+from app.db.database import get_database
+from app.db.timeseries import SENSOR_BUCKETS_COLLECTION, EPOCH, get_bucket_start, build_timestamp_condition
+from app.db.rollups import SENSOR_ROLLUPS_COLLECTION, ROLLUP_RESOLUTIONS, get_rollup_start
+
+AGGREGATION_FUNCTIONS = ("avg", "min", "max", "sum", "count", "first", "last", "stddev")
+
+# Funzioni calcolabili dagli aggregati precalcolati dei bucket e dei rollup
+BUCKET_FUNCTIONS = ("avg", "min", "max", "sum", "count", "first", "last")
+ROLLUP_FUNCTIONS = ("avg", "min", "max", "sum", "count", "stddev")
+
+# Accumulatori Mongo con un nome diverso dalla funzione
+ACCUMULATORS = {"stddev": "$stdDevPop"}
+
+# Preset di time_range_presets nell'application layer dei digital twin
+TIME_RANGE_PRESETS = {
+    "last_hour": datetime.timedelta(hours=1),
+    "last_day": datetime.timedelta(days=1),
+    "last_week": datetime.timedelta(weeks=1),
+    "last_month": datetime.timedelta(days=30)
+}
+
+MAX_AGGREGATION_POINTS = 10000
+
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+NUMERIC_TYPES = ["double", "int", "long", "decimal"]
+
+def parse_interval(interval: str) -> int:
+    """Converte un intervallo come '1m', '15m', '1h' o '1d' in secondi"""
+    match = re.fullmatch(r"(\d+)([smhd])", interval.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Intervallo non valido: '{interval}' (usare ad esempio 1m, 1h, 1d)")
+    return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+def _slot_expression(timestamp: str, interval_ms: int) -> Dict[str, Any]:
+    """Inizio dell'intervallo che contiene il timestamp, in millisecondi dall'epoch"""
+    elapsed = {"$subtract": [timestamp, EPOCH]}
+    return {"$subtract": [elapsed, {"$mod": [elapsed, interval_ms]}]}
+
+def _get_slot(moment: datetime.datetime, interval_ms: int) -> int:
+    """Inizio dell'intervallo che contiene un istante, calcolato come fa _slot_expression"""
+    elapsed = (moment - EPOCH) // datetime.timedelta(milliseconds=1)
+    return elapsed - elapsed % interval_ms
+
+def _is_numeric_expression(value: str) -> Dict[str, Any]:
+    return {"$in": [{"$type": value}, NUMERIC_TYPES]}
+
+def _build_sample_match(
+    prefix: str,
+    fn: str,
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime]
+) -> Dict[str, Any]:
+    """Filtro sui campioni scomposti con $unwind: intervallo temporale e valori numerici"""
+    timestamp_condition: Dict[str, Any] = {"$type": "date"}
+    if start is not None:
+        timestamp_condition["$gte"] = start
+    if end is not None:
+        timestamp_condition["$lte"] = end
+
+    match: Dict[str, Any] = {f"{prefix}.timestamp": timestamp_condition}
+    if fn != "count":
+        match[f"{prefix}.value"] = {"$type": "number"}
+    return match
+
+def _build_accumulator(fn: str, prefix: str) -> Dict[str, Any]:
+    if fn == "count":
+        return {"$sum": 1}
+    if fn in ("first", "last"):
+        # Il campione con il timestamp minimo o massimo, senza dipendere dall'ordine in cui
+        # arrivano i campioni (tra i bucket di una stessa finestra non è garantito)
+        return {"$min" if fn == "first" else "$max": _sample_expression(f"${prefix}")}
+    return {ACCUMULATORS.get(fn, f"${fn}"): f"${prefix}.value"}
+
+def _sample_expression(sample: str) -> Dict[str, Any]:
+    """Documento {timestamp, value} di un campione, confrontato prima per timestamp da $min/$max"""
+    return {"timestamp": f"{sample}.timestamp", "value": f"{sample}.value"}
+
+def _build_partial_accumulators(fn: str, value: str) -> Dict[str, Any]:
+    """Accumulatori degli aggregati parziali (count, sum, sum_sq, min, max) che servono a fn"""
+    accumulators: Dict[str, Any] = {"count": {"$sum": 1}}
+    if fn in ("avg", "sum", "stddev"):
+        accumulators["sum"] = {"$sum": value}
+    if fn == "stddev":
+        accumulators["sum_sq"] = {"$sum": {"$multiply": [value, value]}}
+    if fn in ("min", "max"):
+        accumulators[fn] = {f"${fn}": value}
+    return accumulators
+
+def _build_samples_pipeline(
+    prefix: str,
+    sensor_type: str,
+    fn: str,
+    interval_ms: int,
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime],
+    partial: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Fasi comuni che raggruppano per sensore e intervallo i campioni scomposti con $unwind
+
+    Con partial=True ogni gruppo contiene gli aggregati parziali invece del valore di fn,
+    per essere combinato con quelli dei rollup.
+    """
+    if partial:
+        accumulators = _build_partial_accumulators(fn, f"${prefix}.value")
+    else:
+        accumulators = {"value": _build_accumulator(fn, prefix)}
+    pipeline: List[Dict[str, Any]] = [
+        {"$unwind": f"${prefix}"},
+        {"$match": _build_sample_match(prefix, fn, start, end)},
+        {"$group": {
+            "_id": {"sensor_type": sensor_type, "slot": _slot_expression(f"${prefix}.timestamp", interval_ms)},
+            **accumulators
+        }}
+    ]
+    if not partial and fn in ("first", "last"):
+        pipeline.append({"$project": {"value": "$value.value"}})
+    return pipeline
+
+def _build_embedded_pipeline(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]],
+    fn: str,
+    interval_ms: int,
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime],
+    partial: bool = False
+) -> List[Dict[str, Any]]:
+    """Aggrega lo storico nel documento del twin (modalità embedded e dual)"""
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": {"id": digital_twin_id}},
+        {"$project": {"_id": 0, "sensor": {"$objectToArray": "$digital_replica.sensor_data"}}},
+        {"$unwind": "$sensor"}
+    ]
+    if sensor_types is not None:
+        pipeline.append({"$match": {"sensor.k": {"$in": sensor_types}}})
+    pipeline.extend(_build_samples_pipeline("sensor.v", "$sensor.k", fn, interval_ms, start, end, partial))
+    return pipeline
+
+def _build_raw_pipeline(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]],
+    fn: str,
+    interval_ms: int,
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime],
+    partial: bool = False
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """Collezione e pipeline che aggregano i campioni dallo storage configurato"""
+    if settings.SENSOR_STORAGE_MODE == "bucketed":
+        return SENSOR_BUCKETS_COLLECTION, [
+            {"$match": _build_bucket_match(digital_twin_id, sensor_types, start, end)},
+            *_build_samples_pipeline("samples", "$sensor_type", fn, interval_ms, start, end, partial)
+        ]
+    return "digital_twins", _build_embedded_pipeline(digital_twin_id, sensor_types, fn, interval_ms, start, end, partial)
+
+def _build_bucket_match(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]],
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime]
+) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"digital_twin_id": digital_twin_id}
+    if sensor_types is not None:
+        query["sensor_type"] = {"$in": sensor_types}
+    if start is not None or end is not None:
+        query["bucket_start"] = {}
+        if start is not None:
+            query["bucket_start"]["$gte"] = get_bucket_start(start)
+        if end is not None:
+            query["bucket_start"]["$lte"] = end
+    return query
+
+def _build_bucket_aggregates_pipeline(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]],
+    fn: str,
+    interval_ms: int,
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime]
+) -> List[Dict[str, Any]]:
+    """
+    Aggrega i bucket usando i loro aggregati precalcolati
+
+    L'intervallo è un multiplo della finestra dei bucket, quindi ogni bucket cade in un
+    solo intervallo. Solo i bucket che contengono start ed end possono essere coperti in
+    parte: per questi gli aggregati vengono ricalcolati dai campioni nell'intervallo.
+    Come per i rollup, count conta tutti i campioni solo per fn="count" e altrimenti i
+    soli valori numerici (value_count), gli stessi usati da sum, min e max. Per first e
+    last ogni bucket propone il suo primo o ultimo campione e il gruppo sceglie quello
+    con il timestamp minimo o massimo, quindi i bucket non vanno ordinati (una finestra
+    può essere divisa su più bucket).
+    """
+    edge_buckets = [get_bucket_start(moment) for moment in (start, end) if moment is not None]
+    is_edge = {"$in": ["$bucket_start", edge_buckets]}
+    time_condition = build_timestamp_condition("sample", start, end)
+    in_range = {"$filter": {"input": "$samples", "as": "sample", "cond": time_condition}}
+    numeric_in_range = {
+        "$filter": {
+            "input": "$samples",
+            "as": "sample",
+            "cond": {"$and": [time_condition, _is_numeric_expression("$$sample.value")]}
+        }
+    }
+
+    if fn == "count":
+        count = {"$cond": [is_edge, {"$size": in_range}, "$count"]}
+    else:
+        # I bucket scritti prima di value_count contano i valori numerici dai campioni
+        numeric = {
+            "$filter": {
+                "input": "$samples",
+                "as": "sample",
+                "cond": _is_numeric_expression("$$sample.value")
+            }
+        }
+        is_legacy = {"$eq": [{"$type": "$value_count"}, "missing"]}
+        value_count = {"$cond": [is_legacy, {"$size": numeric}, "$value_count"]}
+        count = {"$cond": [is_edge, {"$size": numeric_in_range}, value_count]}
+
+    # I campioni vengono selezionati solo nei bucket agli estremi, tranne per first/last
+    # (i campioni di un bucket sono ordinati per timestamp)
+    selected = {
+        "_id": 0,
+        "sensor_type": 1,
+        "slot": _slot_expression("$bucket_start", interval_ms),
+        "edge": is_edge,
+        # count serve sempre per riconoscere gli intervalli senza campioni
+        "count": count,
+        "sum": 1,
+        "min": 1,
+        "max": 1,
+        "values": numeric_in_range if fn in ("first", "last") else {"$cond": [is_edge, numeric_in_range, []]}
+    }
+
+    partial: Dict[str, Any] = {"count": 1}
+    group: Dict[str, Any] = {"count": {"$sum": "$count"}}
+    if fn in ("avg", "sum"):
+        partial["sum"] = {"$cond": ["$edge", {"$sum": "$values.value"}, "$sum"]}
+        group["sum"] = {"$sum": "$sum"}
+    elif fn in ("min", "max"):
+        partial[fn] = {"$cond": ["$edge", {f"${fn}": "$values.value"}, f"${fn}"]}
+        group[fn] = {f"${fn}": f"${fn}"}
+    elif fn in ("first", "last"):
+        # null (ignorato da $min/$max) per i bucket senza valori numerici nell'intervallo
+        partial[fn] = {"$cond": [
+            {"$gt": [{"$size": "$values"}, 0]},
+            {"$let": {
+                "vars": {"sample": {"$arrayElemAt": ["$values", 0 if fn == "first" else -1]}},
+                "in": _sample_expression("$$sample")
+            }},
+            None
+        ]}
+        group[fn] = {"$min" if fn == "first" else "$max": f"${fn}"}
+
+    return [
+        {"$match": _build_bucket_match(digital_twin_id, sensor_types, start, end)},
+        {"$project": selected},
+        {"$project": {"sensor_type": 1, "slot": 1, **partial}},
+        {"$group": {"_id": {"sensor_type": "$sensor_type", "slot": "$slot"}, **group}}
+    ]
+
+def _aggregate_value(fn: str, group: Dict[str, Any]) -> Any:
+    """Valore di un intervallo calcolato dagli aggregati parziali (bucket o rollup)"""
+    if fn == "count":
+        return group["count"]
+    if not group["count"]:
+        return None
+    if fn == "avg":
+        return group["sum"] / group["count"]
+    if fn == "stddev":
+        mean = group["sum"] / group["count"]
+        return math.sqrt(max(group["sum_sq"] / group["count"] - mean * mean, 0.0))
+    if fn in ("first", "last"):
+        return group[fn]["value"] if group[fn] else None
+    return group[fn]
+
+def _get_rollup_coverage(
+    resolution_seconds: int,
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime]
+) -> Tuple[Optional[datetime.datetime], Optional[datetime.datetime]]:
+    """
+    Intervallo [covered_start, covered_end) dei rollup interamente compresi in [start, end]
+
+    Gli estremi sono None se start o end non sono indicati (nessun limite).
+    """
+    covered_start = None
+    if start is not None:
+        covered_start = get_rollup_start(start, resolution_seconds)
+        if covered_start < start:
+            covered_start += datetime.timedelta(seconds=resolution_seconds)
+    covered_end = None
+    if end is not None:
+        # end è incluso e i timestamp salvati da Mongo hanno la precisione del millisecondo
+        covered_end = get_rollup_start(end + datetime.timedelta(milliseconds=1), resolution_seconds)
+    return covered_start, covered_end
+
+def plan_rollup_resolution(
+    interval_seconds: int,
+    fn: str,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None
+) -> Optional[str]:
+    """
+    Sceglie il rollup più grossolano che soddisfa la risoluzione richiesta
+
+    Il rollup deve dividere l'intervallo, così ognuno cade in un solo punto della serie,
+    e almeno un rollup deve essere interamente compreso in [start, end]. Restituisce None
+    se i rollup non sono abilitati o non sono utilizzabili.
+    """
+    if not settings.SENSOR_ROLLUPS_ENABLED or fn not in ROLLUP_FUNCTIONS:
+        return None
+    for resolution, resolution_seconds in ROLLUP_RESOLUTIONS.items():
+        if interval_seconds % resolution_seconds:
+            continue
+        covered_start, covered_end = _get_rollup_coverage(resolution_seconds, start, end)
+        if covered_start is None or covered_end is None or covered_start < covered_end:
+            return resolution
+    return None
+
+def _build_rollups_pipeline(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]],
+    resolution: str,
+    fn: str,
+    interval_ms: int,
+    covered_start: Optional[datetime.datetime],
+    covered_end: Optional[datetime.datetime]
+) -> List[Dict[str, Any]]:
+    """Combina per sensore e intervallo gli aggregati dei rollup di una risoluzione"""
+    query: Dict[str, Any] = {"digital_twin_id": digital_twin_id, "resolution": resolution}
+    if sensor_types is not None:
+        query["sensor_type"] = {"$in": sensor_types}
+    if covered_start is not None or covered_end is not None:
+        query["start"] = {}
+        if covered_start is not None:
+            query["start"]["$gte"] = covered_start
+        if covered_end is not None:
+            query["start"]["$lt"] = covered_end
+
+    # count conta tutti i campioni, value_count solo quelli con valore numerico
+    group: Dict[str, Any] = {"count": {"$sum": "$count" if fn == "count" else "$value_count"}}
+    if fn in ("avg", "sum", "stddev"):
+        group["sum"] = {"$sum": "$sum"}
+    if fn == "stddev":
+        group["sum_sq"] = {"$sum": "$sum_sq"}
+    if fn in ("min", "max"):
+        group[fn] = {f"${fn}": f"${fn}"}
+
+    return [
+        {"$match": query},
+        {"$group": {"_id": {"sensor_type": "$sensor_type", "slot": _slot_expression("$start", interval_ms)}, **group}}
+    ]
+
+def _merge_partial(partials: Dict[Tuple[str, int], Dict[str, Any]], group: Dict[str, Any]) -> None:
+    """Aggiunge gli aggregati parziali di un gruppo a quelli dello stesso sensore e intervallo"""
+    key = (group["_id"]["sensor_type"], int(group["_id"]["slot"]))
+    aggregates = {name: value for name, value in group.items() if name != "_id"}
+    merged = partials.setdefault(key, {"count": 0})
+    for name, value in aggregates.items():
+        if value is None:
+            continue
+        if name not in merged or merged[name] is None:
+            merged[name] = value
+        elif name == "min":
+            merged[name] = min(merged[name], value)
+        elif name == "max":
+            merged[name] = max(merged[name], value)
+        else:
+            merged[name] += value
+
+async def _aggregate_rollups(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]],
+    resolution: str,
+    fn: str,
+    interval_ms: int,
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime]
+) -> Dict[Tuple[str, int], Any]:
+    """
+    Calcola i valori degli intervalli dai rollup di una risoluzione
+
+    I rollup tagliati da start o end non vengono usati: le parti di [start, end] prima del
+    primo e dopo l'ultimo rollup completo vengono aggregate dai campioni.
+    """
+    db = get_database()
+    covered_start, covered_end = _get_rollup_coverage(ROLLUP_RESOLUTIONS[resolution], start, end)
+
+    partials: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    pipeline = _build_rollups_pipeline(
+        digital_twin_id, sensor_types, resolution, fn, interval_ms, covered_start, covered_end
+    )
+    async for group in db[SENSOR_ROLLUPS_COLLECTION].aggregate(pipeline):
+        _merge_partial(partials, group)
+
+    edges = []
+    if covered_start is not None and start < covered_start:
+        edges.append((start, covered_start - datetime.timedelta(milliseconds=1)))
+    if covered_end is not None and covered_end <= end:
+        edges.append((covered_end, end))
+    for edge_start, edge_end in edges:
+        collection, pipeline = _build_raw_pipeline(
+            digital_twin_id, sensor_types, fn, interval_ms, edge_start, edge_end, partial=True
+        )
+        async for group in db[collection].aggregate(pipeline):
+            _merge_partial(partials, group)
+
+    return {key: _aggregate_value(fn, aggregates) for key, aggregates in partials.items()}
+
+async def aggregate_sensor_data(
+    digital_twin: Dict[str, Any],
+    sensor_types: Optional[List[str]],
+    interval: str,
+    fn: str,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None
+) -> Dict[str, Any]:
+    """
+    Calcola per ogni sensore una serie a intervalli fissi con la funzione fn
+
+    Restituisce l'asse dei tempi (inizio di ogni intervallo) e una lista di valori per
+    sensore, parallela all'asse (None, o 0 per count, negli intervalli senza campioni),
+    oltre alla sorgente scelta dal planner (source). Senza start o end l'asse parte dal
+    primo o finisce all'ultimo intervallo con dati. Solleva ValueError per intervalli o funzioni non
+    validi e per serie di più di MAX_AGGREGATION_POINTS punti.
+    """
+    if fn not in AGGREGATION_FUNCTIONS:
+        raise ValueError(f"Funzione di aggregazione non valida: '{fn}'")
+    interval_seconds = parse_interval(interval)
+    interval_ms = interval_seconds * 1000
+    if start is not None and end is not None:
+        if start > end:
+            raise ValueError("start deve precedere end")
+        if (end - start).total_seconds() / interval_seconds >= MAX_AGGREGATION_POINTS:
+            raise ValueError(f"La serie supera {MAX_AGGREGATION_POINTS} punti: usare un intervallo più ampio")
+
+    values: Dict[Tuple[str, int], Any] = {}
+    resolution = plan_rollup_resolution(interval_seconds, fn, start, end)
+    if resolution is not None:
+        source = f"rollups:{resolution}"
+        values = await _aggregate_rollups(digital_twin["id"], sensor_types, resolution, fn, interval_ms, start, end)
+    elif (
+        settings.SENSOR_STORAGE_MODE == "bucketed"
+        and fn in BUCKET_FUNCTIONS
+        and interval_seconds % settings.SENSOR_BUCKET_SECONDS == 0
+    ):
+        source = "buckets"
+        pipeline = _build_bucket_aggregates_pipeline(digital_twin["id"], sensor_types, fn, interval_ms, start, end)
+        async for group in get_database()[SENSOR_BUCKETS_COLLECTION].aggregate(pipeline):
+            values[(group["_id"]["sensor_type"], int(group["_id"]["slot"]))] = _aggregate_value(fn, group)
+    else:
+        source = "samples"
+        collection, pipeline = _build_raw_pipeline(digital_twin["id"], sensor_types, fn, interval_ms, start, end)
+        async for group in get_database()[collection].aggregate(pipeline):
+            values[(group["_id"]["sensor_type"], int(group["_id"]["slot"]))] = group["value"]
+
+    # Asse dei tempi a intervalli fissi, anche dove non ci sono campioni
+    slots = [slot for _, slot in values]
+    first_slot = _get_slot(start, interval_ms) if start is not None else min(slots, default=None)
+    last_slot = _get_slot(end, interval_ms) if end is not None else max(slots, default=None)
+    if first_slot is None or last_slot is None or first_slot > last_slot:
+        axis = []
+    else:
+        axis = list(range(first_slot, last_slot + 1, interval_ms))
+    if len(axis) > MAX_AGGREGATION_POINTS:
+        raise ValueError(f"La serie supera {MAX_AGGREGATION_POINTS} punti: usare un intervallo più ampio")
+
+    empty_value = 0 if fn == "count" else None
+    series_sensors = sensor_types
+    if series_sensors is None:
+        series_sensors = sorted(set(digital_twin.get("compatible_sensors", [])) | {sensor_type for sensor_type, _ in values})
+    return {
+        "interval": interval,
+        "fn": fn,
+        "source": source,
+        "timestamps": [EPOCH + datetime.timedelta(milliseconds=slot) for slot in axis],
+        "series": {
+            sensor_type: [values.get((sensor_type, slot), empty_value) for slot in axis]
+            for sensor_type in series_sensors
+        }
+    }
@@ -0,0 +1,227 @@
+# app/services/sensor_export.py
+"""
+Esportazione in streaming dello storico dei sensori in formato CSV, NDJSON o Arrow.
+
+I campioni vengono letti con un cursore Mongo a batch (dal documento del twin scomposto
+con $unwind, oppure un bucket alla volta) e serializzati in blocchi di circa
+EXPORT_CHUNK_BYTES byte, eventualmente compressi in gzip al volo, quindi la memoria
+usata non dipende dalla dimensione dell'esportazione. Il formato Arrow è uno stream IPC
+di record batch colonnari (ARROW_BATCH_ROWS righe ciascuno), che i client analitici
+leggono senza decodifica riga per riga.
+"""
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator
+import csv
+import datetime
+import io
+import json
+import zlib
+
+import pyarrow as pa
+from pymongo import ASCENDING
+
+from app.config import settings
+from app.db.database import get_database
+from app.db.timeseries import (
+    SENSOR_BUCKETS_COLLECTION,
+    get_bucket_start,
+    build_samples_expression,
+    is_numeric,
+    iter_bucket_windows
+)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+CSV_COLUMNS = ["sensor_type", "timestamp", "value", "unit_measure"]
+
+# Sensore e unità di misura hanno pochi valori distinti: colonne dizionario
+ARROW_SCHEMA = pa.schema([
+    ("sensor_type", pa.dictionary(pa.int32(), pa.string())),
+    ("timestamp", pa.timestamp("ms", tz="UTC")),
+    ("value", pa.float64()),
+    ("unit_measure", pa.dictionary(pa.int32(), pa.string()))
+])
+ARROW_BATCH_ROWS = 65536
+
+# Documenti per batch del cursore: un bucket contiene molti campioni
+SAMPLE_BATCH_SIZE = 1000
+BUCKET_BATCH_SIZE = 10
+
+async def iter_embedded_samples(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]],
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime]
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Scorre lo storico nel documento del twin un campione alla volta, per sensore"""
+    timestamp_condition: Dict[str, Any] = {}
+    if start is not None:
+        timestamp_condition["$gte"] = start
+    if end is not None:
+        timestamp_condition["$lte"] = end
+
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": {"id": digital_twin_id}},
+        {"$project": {"_id": 0, "sensor": {"$objectToArray": "$digital_replica.sensor_data"}}},
+        {"$unwind": "$sensor"}
+    ]
+    if sensor_types is not None:
+        pipeline.append({"$match": {"sensor.k": {"$in": sensor_types}}})
+    pipeline.append({"$unwind": "$sensor.v"})
+    if timestamp_condition:
+        pipeline.append({"$match": {"sensor.v.timestamp": timestamp_condition}})
+    pipeline.append({"$project": {"sensor_type": "$sensor.k", "sample": "$sensor.v"}})
+
+    cursor = get_database()["digital_twins"].aggregate(pipeline, batchSize=SAMPLE_BATCH_SIZE)
+    async for row in cursor:
+        yield row["sensor_type"], row["sample"]
+
+async def iter_bucket_samples(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]],
+    start: Optional[datetime.datetime],
+    end: Optional[datetime.datetime]
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Scorre i bucket di un twin in ordine di sensore e tempo, seguendo l'indice (twin, sensore, finestra)
+
+    L'ordinamento usa l'indice, quindi i bucket non vengono ordinati in memoria; i
+    bucket di una finestra divisa vengono fusi in ordine di timestamp.
+    """
+    query: Dict[str, Any] = {"digital_twin_id": digital_twin_id}
+    if sensor_types is not None:
+        query["sensor_type"] = {"$in": sensor_types}
+    if start is not None or end is not None:
+        query["bucket_start"] = {}
+        if start is not None:
+            query["bucket_start"]["$gte"] = get_bucket_start(start)
+        if end is not None:
+            query["bucket_start"]["$lte"] = end
+
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": query},
+        {"$sort": {"sensor_type": ASCENDING, "bucket_start": ASCENDING}},
+        {"$project": {
+            "_id": 0,
+            "sensor_type": 1,
+            "bucket_start": 1,
+            "samples": build_samples_expression("$samples", start, end)
+        }}
+    ]
+    cursor = get_database()[SENSOR_BUCKETS_COLLECTION].aggregate(pipeline, batchSize=BUCKET_BATCH_SIZE)
+    async for sensor_type, _, samples in iter_bucket_windows(cursor):
+        for sample in samples:
+            yield sensor_type, sample
+
+def iter_sensor_samples(
+    digital_twin_id: str,
+    sensor_types: Optional[List[str]] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Scorre i campioni (sensore, campione) dallo storage configurato, per sensore e in ordine di tempo"""
+    if settings.SENSOR_STORAGE_MODE == "bucketed":
+        return iter_bucket_samples(digital_twin_id, sensor_types, start, end)
+    return iter_embedded_samples(digital_twin_id, sensor_types, start, end)
+
+def _format_timestamp(timestamp: Any) -> Any:
+    return timestamp.isoformat() if isinstance(timestamp, datetime.datetime) else timestamp
+
+def _format_csv_value(value: Any) -> Any:
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+async def iter_export_chunks(
+    samples: AsyncIterator[Tuple[str, Dict[str, Any]]],
+    export_format: str,
+    gzip_encoded: bool = False
+) -> AsyncIterator[bytes]:
+    """Serializza i campioni in blocchi di byte CSV o NDJSON, eventualmente compressi in gzip"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if gzip_encoded else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if export_format == "csv" else None
+    if writer:
+        writer.writerow(CSV_COLUMNS)
+
+    def flush() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    async for sensor_type, sample in samples:
+        timestamp = _format_timestamp(sample.get("timestamp"))
+        if writer:
+            writer.writerow([sensor_type, timestamp, _format_csv_value(sample.get("value")), sample.get("unit_measure", "")])
+        else:
+            buffer.write(json.dumps({
+                "sensor_type": sensor_type,
+                "timestamp": timestamp,
+                "value": sample.get("value"),
+                "unit_measure": sample.get("unit_measure", "")
+            }, default=str))
+            buffer.write("\n")
+
+        if buffer.tell() >= settings.EXPORT_CHUNK_BYTES:
+            chunk = flush()
+            if chunk:
+                yield chunk
+
+    chunk = flush()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+def build_arrow_batch(
+    sensor_types: List[str],
+    timestamps: List[Any],
+    values: List[Any],
+    units: List[str]
+) -> pa.RecordBatch:
+    """Record batch Arrow da colonne parallele; i valori non numerici diventano null"""
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(sensor_types, type=pa.string()).dictionary_encode(),
+            pa.array(timestamps, type=ARROW_SCHEMA.field("timestamp").type),
+            pa.array([value if is_numeric(value) else None for value in values], type=pa.float64()),
+            pa.array(units, type=pa.string()).dictionary_encode()
+        ],
+        schema=ARROW_SCHEMA
+    )
+
+async def iter_arrow_chunks(samples: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """
+    Serializza i campioni in uno stream IPC Arrow, un record batch ogni ARROW_BATCH_ROWS campioni
+
+    Ogni blocco inviato contiene i messaggi IPC di un batch (lo schema con il primo),
+    quindi in memoria resta al più un batch.
+    """
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, ARROW_SCHEMA)
+
+    def flush() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    columns: Tuple[List[Any], ...] = ([], [], [], [])
+    async for sensor_type, sample in samples:
+        columns[0].append(sensor_type)
+        # I timestamp rimasti stringa (dati precedenti alla normalizzazione) diventano null
+        timestamp = sample.get("timestamp")
+        columns[1].append(timestamp if isinstance(timestamp, datetime.datetime) else None)
+        columns[2].append(sample.get("value"))
+        columns[3].append(sample.get("unit_measure") or "")
+        if len(columns[0]) >= ARROW_BATCH_ROWS:
+            writer.write_batch(build_arrow_batch(*columns))
+            columns = ([], [], [], [])
+            yield flush()
+
+    if columns[0]:
+        writer.write_batch(build_arrow_batch(*columns))
+    writer.close()
+    yield flush()
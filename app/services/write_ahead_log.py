@@ -0,0 +1,255 @@
+# app/services/write_ahead_log.py
+"""
+Write-ahead log locale per l'ingestione dei dati dei sensori.
+
+I campioni vengono aggiunti in append a segmenti su disco (WAL_DIR), un record JSON per
+riga con la sua posizione (lsn). Le richieste attendono un fsync raggruppato prima di
+rispondere, quindi un campione confermato sopravvive ad un'interruzione di MongoDB o del
+processo. Il checkpoint registra l'ultimo lsn scritto su Mongo; i segmenti già applicati
+vengono eliminati e quelli successivi vengono riapplicati da replay_write_ahead_log.
+Solo gli errori di connessione indicano che MongoDB non è raggiungibile: i record che
+MongoDB rifiuta per altri motivi vengono spostati in un file di quarantena, così non
+bloccano l'applicazione di quelli successivi.
+"""
+from typing import Dict, List, Any, Optional, Tuple, Iterator
+import asyncio
+import json
+import logging
+import os
+
+from pymongo.errors import ConnectionFailure
+
+from app.config import settings
+from app.models.sensor import parse_utc_timestamp
+from app.services.digital_twin_service import write_sensor_samples_bulk
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".wal"
+CHECKPOINT_FILE = "checkpoint"
+QUARANTINE_FILE = "quarantine.jsonl"
+
+class WriteAheadLog:
+    """Log append-only a segmenti con fsync raggruppato e checkpoint dell'ultimo lsn applicato"""
+
+    def __init__(self, directory: str, segment_bytes: int, fsync_interval: float):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.last_lsn = 0
+        self.applied_lsn = 0
+        # Record messi in quarantena da questo processo
+        self.quarantined = 0
+        self._file = None
+        self._pending_sync: Optional[asyncio.Task] = None
+        self._sync_lock: Optional[asyncio.Lock] = None
+
+    def _segment_path(self, first_lsn: int) -> str:
+        return os.path.join(self.directory, f"{first_lsn:020d}{SEGMENT_SUFFIX}")
+
+    def _list_segments(self) -> List[int]:
+        """Restituisce il primo lsn di ogni segmento presente, in ordine"""
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _read_segment(self, first_lsn: int) -> Iterator[Dict[str, Any]]:
+        """Legge i record di un segmento, fermandosi ad un'eventuale riga troncata"""
+        with open(self._segment_path(first_lsn), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Ultima riga scritta a metà prima di un crash: non era stata confermata
+                    return
+
+    def open(self) -> None:
+        """Apre il log, recupera checkpoint e ultimo lsn e avvia un nuovo segmento"""
+        os.makedirs(self.directory, exist_ok=True)
+
+        checkpoint_path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r") as f:
+                self.applied_lsn = int(f.read().strip() or 0)
+
+        segments = self._list_segments()
+        self.last_lsn = self.applied_lsn
+        if segments:
+            self.last_lsn = max(self.last_lsn, segments[-1] - 1)
+            for record in self._read_segment(segments[-1]):
+                self.last_lsn = max(self.last_lsn, record["lsn"])
+
+        # Si riparte sempre da un segmento nuovo, per non accodare dopo una riga troncata
+        self._sync_lock = asyncio.Lock()
+        self._open_segment()
+
+    def _open_segment(self) -> None:
+        self._file = open(self._segment_path(self.last_lsn + 1), "a", encoding="utf-8")
+
+    def close(self) -> None:
+        """Scrive su disco i record in sospeso e chiude il segmento corrente"""
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def append(self, samples: List[Tuple[str, str, Dict[str, Any]]]) -> List[int]:
+        """
+        Aggiunge campioni (digital_twin_id, sensor_type, campione) e restituisce i loro lsn
+
+        I record sono solo nel buffer: il chiamante deve attendere sync() prima di confermarli.
+        """
+        lsns = []
+        for digital_twin_id, sensor_type, sample in samples:
+            self.last_lsn += 1
+            self._file.write(json.dumps(_encode_record(digital_twin_id, sensor_type, sample, self.last_lsn)) + "\n")
+            lsns.append(self.last_lsn)
+        return lsns
+
+    async def sync(self) -> None:
+        """Attende il prossimo fsync raggruppato, condiviso da tutte le richieste in corso"""
+        if self._pending_sync is None:
+            self._pending_sync = asyncio.get_running_loop().create_task(self._sync_after_delay())
+        await asyncio.shield(self._pending_sync)
+
+    async def _sync_after_delay(self) -> None:
+        await asyncio.sleep(self.fsync_interval)
+        async with self._sync_lock:
+            # I record aggiunti da qui in poi attenderanno il fsync successivo
+            self._pending_sync = None
+            self._file.flush()
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, self._file.fileno())
+
+            if self._file.tell() >= self.segment_bytes:
+                # I record aggiunti durante il fsync sono ancora nel buffer del vecchio segmento
+                self.close()
+                self._open_segment()
+
+    def mark_applied(self, lsn: int) -> None:
+        """Registra che tutti i record fino a lsn sono su Mongo ed elimina i segmenti superati"""
+        if lsn <= self.applied_lsn:
+            return
+        self.applied_lsn = lsn
+
+        checkpoint_path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(checkpoint_path + ".tmp", "w") as f:
+            f.write(str(lsn))
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+        # Un segmento si può eliminare quando anche il suo ultimo record è applicato
+        segments = self._list_segments()
+        for first_lsn, next_first_lsn in zip(segments, segments[1:]):
+            if next_first_lsn - 1 <= self.applied_lsn:
+                os.remove(self._segment_path(first_lsn))
+
+    def quarantine(self, entry: Tuple[str, str, Dict[str, Any], int], error: Exception) -> None:
+        """Sposta nel file di quarantena un record che MongoDB ha rifiutato, con l'errore ricevuto"""
+        record = {**_encode_record(*entry), "error": str(error)}
+        with open(os.path.join(self.directory, QUARANTINE_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.quarantined += 1
+        logger.error(f"WAL record {entry[3]} rejected by the database, moved to {QUARANTINE_FILE}: {error}")
+
+    def read_unapplied(self, batch_size: int) -> Iterator[List[Tuple[str, str, Dict[str, Any], int]]]:
+        """Legge a blocchi i record successivi al checkpoint, come tuple pronte per la scrittura"""
+        if self._file is not None:
+            self._file.flush()
+
+        after_lsn = self.applied_lsn
+        segments = self._list_segments()
+        batch = []
+        for i, first_lsn in enumerate(segments):
+            # Salta i segmenti interamente già applicati
+            if i + 1 < len(segments) and segments[i + 1] - 1 <= after_lsn:
+                continue
+            for record in self._read_segment(first_lsn):
+                if record["lsn"] <= after_lsn:
+                    continue
+                sample = {**record["sample"], "timestamp": parse_utc_timestamp(record["sample"]["timestamp"])}
+                batch.append((record["digital_twin_id"], record["sensor_type"], sample, record["lsn"]))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def status(self) -> Dict[str, Any]:
+        """Stato del log: ultimo lsn scritto, ultimo applicato e record in attesa"""
+        return {
+            "last_lsn": self.last_lsn,
+            "applied_lsn": self.applied_lsn,
+            "pending": self.last_lsn - self.applied_lsn,
+            "segments": len(self._list_segments()),
+            "quarantined": self.quarantined
+        }
+
+def _encode_record(digital_twin_id: str, sensor_type: str, sample: Dict[str, Any], lsn: int) -> Dict[str, Any]:
+    """Record del log serializzabile in JSON"""
+    return {
+        "lsn": lsn,
+        "digital_twin_id": digital_twin_id,
+        "sensor_type": sensor_type,
+        "sample": {**sample, "timestamp": sample["timestamp"].isoformat()}
+    }
+
+async def apply_write_ahead_log_records(
+    wal: WriteAheadLog,
+    batch: List[Tuple[str, str, Dict[str, Any], int]]
+) -> None:
+    """
+    Scrive su Mongo un blocco di record del log e ne registra l'applicazione
+
+    Gli errori di connessione (ConnectionFailure, che comprende il timeout di selezione
+    del server e NetworkTimeout) vengono propagati e il blocco resta nel log. Se MongoDB
+    rifiuta il blocco per un altro motivo (ad esempio un twin oltre i 16 MB o un errore
+    di validazione) i record vengono riscritti uno alla volta e quelli rifiutati messi
+    in quarantena. Grazie a skip_applied i record già scritti non vengono duplicati.
+    """
+    try:
+        await write_sensor_samples_bulk(batch, skip_applied=True, deduplicate=False)
+    except ConnectionFailure:
+        raise
+    except Exception as e:
+        logger.warning(f"Could not apply {len(batch)} WAL records, applying them one at a time: {e}")
+        for entry in batch:
+            try:
+                await write_sensor_samples_bulk([entry], skip_applied=True, deduplicate=False)
+            except ConnectionFailure:
+                raise
+            except Exception as record_error:
+                wal.quarantine(entry, record_error)
+            wal.mark_applied(entry[3])
+    wal.mark_applied(batch[-1][3])
+
+async def replay_write_ahead_log(wal: WriteAheadLog, batch_size: int) -> Dict[str, Any]:
+    """
+    Riapplica su Mongo i record del log successivi al checkpoint, a blocchi di batch_size
+
+    Ogni blocco viene scritto con apply_write_ahead_log_records, che scarta i campioni già
+    presenti su Mongo: un replay interrotto si può ripetere senza duplicati. Un errore di
+    connessione interrompe il replay; i record rifiutati vanno in quarantena.
+    """
+    replayed = 0
+    for batch in wal.read_unapplied(batch_size):
+        await apply_write_ahead_log_records(wal, batch)
+        replayed += len(batch)
+        logger.info(
+            f"WAL replay: {replayed} records replayed, applied up to lsn "
+            f"{wal.applied_lsn}/{wal.last_lsn}"
+        )
+
+    return {"replayed": replayed, **wal.status()}
+
+def create_write_ahead_log() -> WriteAheadLog:
+    """Crea il write-ahead log secondo la configurazione"""
+    return WriteAheadLog(
+        directory=settings.WAL_DIR,
+        segment_bytes=settings.WAL_SEGMENT_BYTES,
+        fsync_interval=settings.WAL_FSYNC_INTERVAL_MS / 1000
+    )
@@ -24,8 +24,8 @@ function showError(message) {
     }, 5000);
 }
 
-// Funzione per le richieste API
-async function apiRequest(endpoint, method = 'GET', data = null) {
+// Funzione per le richieste API; con withHeaders restituisce anche gli header della risposta
+async function apiRequest(endpoint, method = 'GET', data = null, withHeaders = false) {
     try {
         const options = {
             method,
@@ -75,7 +75,8 @@ async function apiRequest(endpoint, method = 'GET', data = null) {
             return { success: true };
         }
 
-        return await response.json();
+        const body = await response.json();
+        return withHeaders ? { data: body, headers: response.headers } : body;
     } catch (error) {
         console.error('Errore API:', error);
         const errorMessage = error.message || 'Si è verificato un errore durante la richiesta API';
@@ -84,6 +85,20 @@ async function apiRequest(endpoint, method = 'GET', data = null) {
     }
 }
 
+// Richiede tutte le pagine di una lista, seguendo il cursore dell'header X-Next-Cursor
+async function apiRequestAll(endpoint) {
+    const items = [];
+    const separator = endpoint.includes('?') ? '&' : '?';
+    let cursor = null;
+    do {
+        const url = cursor ? `${endpoint}${separator}cursor=${encodeURIComponent(cursor)}` : endpoint;
+        const page = await apiRequest(url, 'GET', null, true);
+        items.push(...page.data);
+        cursor = page.headers.get('X-Next-Cursor');
+    } while (cursor);
+    return items;
+}
+
 // Formatta data e ora
 function formatDateTime(dateTimeStr) {
     if (!dateTimeStr) return 'N/A';
@@ -1,5 +1,18 @@
 // dashboard.js - Funzioni per la dashboard
 
+// Campioni più recenti per sensore letti per i dettagli di un digital twin
+const SENSOR_HISTORY_LIMIT = 50000;
+// Punti per sensore disegnati nel grafico: lo storico viene decimato dal server (LTTB)
+const SENSOR_CHART_POINTS = 1000;
+// Punti per sensore mantenuti nel grafico mentre arrivano gli aggiornamenti in tempo reale
+const LIVE_CHART_MAX_POINTS = 5000;
+// Attesa prima di riconnettersi agli aggiornamenti in tempo reale dopo un'interruzione
+const LIVE_RECONNECT_DELAY_MS = 3000;
+
+// Connessione agli aggiornamenti del digital twin visualizzato e indice delle tracce del grafico per sensore
+let liveUpdates = null;
+let chartTraceIndexes = {};
+
 document.addEventListener('DOMContentLoaded', function () {
     // Verifica l'autenticazione all'avvio
     if (!isAuthenticated()) {
@@ -214,7 +227,7 @@ function loadUserInfo() {
 // Carica la lista dei digital twins
 async function loadDigitalTwins() {
     try {
-        const response = await apiRequest('/digital-twins', 'GET');  // Usa apiRequest che ha già il prefisso corretto
+        const response = await apiRequestAll('/digital-twins?fields=compatible_sensors');  // Usa apiRequest (tutte le pagine) che ha già il prefisso corretto
         displayDigitalTwins(response);
     } catch (error) {
         console.error('Error loading digital twins:', error);
@@ -240,7 +253,7 @@ function displayDigitalTwins(digitalTwins) {
         <a href="#" class="list-group-item list-group-item-action" onclick="loadDigitalTwinDetails('${dt.id}')">
             <div class="d-flex w-100 justify-content-between">
                 <h6 class="mb-1">${dt.name}</h6>
-                <small class="text-muted">${dt.digital_replica?.last_updated ? new Date(dt.digital_replica.last_updated).toLocaleDateString() : 'N/A'}</small>
+                <small class="text-muted">${dt.last_updated ? new Date(dt.last_updated).toLocaleDateString() : 'N/A'}</small>
             </div>
             <p class="mb-1 text-truncate">${dt.device_type || 'No type specified'}</p>
             <small class="text-muted">Sensori: ${dt.compatible_sensors?.length || 0}</small>
@@ -252,10 +265,25 @@ function displayDigitalTwins(digitalTwins) {
 
 // Carica i dettagli di un digital twin
 async function loadDigitalTwinDetails(dtId) {
+    stopLiveUpdates();
     try {
         const response = await apiRequest(`/digital-twins/${dtId}`, 'GET');
+
+        // Lo storico dei sensori può essere salvato fuori dal documento del twin (storage a bucket);
+        // vengono richiesti i campioni più recenti, decimati dal server mantenendo la forma
+        // della curva e l'ultimo valore, poi riportati in ordine cronologico
+        const sensorData = await apiRequest(
+            `/digital-twins/${dtId}/data?limit=${SENSOR_HISTORY_LIMIT}&order=desc&downsample=lttb&points=${SENSOR_CHART_POINTS}`,
+            'GET'
+        );
+        Object.values(sensorData).forEach(samples => samples.reverse());
+        response.digital_replica = { ...(response.digital_replica || {}), sensor_data: sensorData };
+
         displayDigitalTwinDetails(response);
 
+        // I nuovi campioni arrivano dal server man mano che vengono scritti, senza ricaricare lo storico
+        startLiveUpdates(response);
+
         // Segna come attivo nella lista
         document.querySelectorAll('#digitalTwinsList .list-group-item').forEach(item => {
             item.classList.remove('active');
@@ -274,17 +302,15 @@ function displayDigitalTwinDetails(dt) {
     const sensorDataHtml = dt.digital_replica?.sensor_data ?
         Object.keys(dt.digital_replica.sensor_data).map(sensorType => {
             const data = dt.digital_replica.sensor_data[sensorType];
-            const lastValue = data && data.length > 0 ? data[data.length - 1] : null;
+            // Ultimo valore mantenuto dal server ad ogni scrittura, indipendente dallo storico caricato
+            const lastValue = dt.digital_replica.latest?.[sensorType] || (data && data.length > 0 ? data[data.length - 1] : null);
             return `
                 <div class="col-md-6 mb-3">
                     <div class="card">
                         <div class="card-body">
                             <h6 class="card-title">${sensorType}</h6>
-                            <p class="card-text">
-                                ${lastValue ?
-                    `<strong>${lastValue.value}</strong> ${lastValue.unit_measure}<br>
-                                     <small class="text-muted">${new Date(lastValue.timestamp).toLocaleString()}</small>`
-                    : 'No data available'}
+                            <p class="card-text" id="latest-${sensorType}">
+                                ${formatLatestValue(lastValue)}
                             </p>
                         </div>
                     </div>
@@ -312,7 +338,7 @@ function displayDigitalTwinDetails(dt) {
                         <li><strong>ID:</strong> ${dt.id}</li>
                         <li><strong>Device Type:</strong> ${dt.device_type}</li>
                         <li><strong>Device ID:</strong> ${dt.device_id || 'N/A'}</li>
-                        <li><strong>Last Updated:</strong> ${dt.digital_replica?.last_updated ? new Date(dt.digital_replica.last_updated).toLocaleString() : 'Never'}</li>
+                        <li><strong>Last Updated:</strong> <span id="lastUpdated">${dt.digital_replica?.last_updated ? new Date(dt.digital_replica.last_updated).toLocaleString() : 'Never'}</span></li>
                     </ul>
                 </div>
                 <div class="col-md-6">
@@ -344,13 +370,23 @@ function displayDigitalTwinDetails(dt) {
     }
 }
 
+// Valore, unità di misura e timestamp dell'ultimo campione di un sensore
+function formatLatestValue(lastValue) {
+    return lastValue ?
+        `<strong>${lastValue.value}</strong> ${lastValue.unit_measure}<br>
+         <small class="text-muted">${new Date(lastValue.timestamp).toLocaleString()}</small>`
+        : 'No data available';
+}
+
 // Crea il grafico dei sensori
 function createSensorChart(sensorData) {
     const traces = [];
+    chartTraceIndexes = {};
 
     Object.keys(sensorData).forEach(sensorType => {
         const data = sensorData[sensorType];
         if (data && data.length > 0) {
+            chartTraceIndexes[sensorType] = traces.length;
             traces.push({
                 x: data.map(d => d.timestamp),
                 y: data.map(d => d.value),
@@ -376,14 +412,124 @@ function createSensorChart(sensorData) {
     }
 }
 
+// Apre la connessione Server-Sent Events con i nuovi campioni del digital twin visualizzato
+function startLiveUpdates(dt) {
+    stopLiveUpdates();
+    const controller = new AbortController();
+    liveUpdates = controller;
+
+    readLiveUpdates(dt, controller.signal)
+        .catch(error => {
+            if (!controller.signal.aborted) {
+                console.error('Live updates interrupted:', error);
+            }
+        })
+        .finally(() => {
+            if (liveUpdates !== controller || controller.signal.aborted) {
+                return;
+            }
+            liveUpdates = null;
+            // I campioni scritti durante l'interruzione si recuperano ricaricando i dettagli
+            setTimeout(() => {
+                if (!liveUpdates && !controller.signal.aborted) {
+                    loadDigitalTwinDetails(dt.id);
+                }
+            }, LIVE_RECONNECT_DELAY_MS);
+        });
+}
+
+// Chiude la connessione degli aggiornamenti in tempo reale, se aperta
+function stopLiveUpdates() {
+    if (liveUpdates) {
+        liveUpdates.abort();
+        liveUpdates = null;
+    }
+}
+
+// Legge lo stream SSE con fetch, che a differenza di EventSource può inviare il token di autenticazione
+async function readLiveUpdates(dt, signal) {
+    const response = await fetch(`${API_BASE_URL}/digital-twins/${dt.id}/events`, {
+        headers: {
+            'Accept': 'text/event-stream',
+            'Authorization': `Bearer ${localStorage.getItem('auth_token')}`
+        },
+        signal
+    });
+    if (!response.ok) {
+        throw new Error(`Errore ${response.status}: ${response.statusText}`);
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            return;
+        }
+        buffer += value;
+
+        // Gli eventi sono separati da una riga vuota; i commenti (keep-alive) non hanno righe data
+        let end;
+        while ((end = buffer.indexOf('\n\n')) >= 0) {
+            const event = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            const data = event.split('\n')
+                .filter(line => line.startsWith('data:'))
+                .map(line => line.slice(5).trim())
+                .join('\n');
+            if (data) {
+                applyLiveUpdate(dt, JSON.parse(data));
+            }
+        }
+    }
+}
+
+// Aggiorna l'ultimo valore e il grafico di ogni sensore con i campioni ricevuti
+function applyLiveUpdate(dt, update) {
+    const samplesBySensor = update.samples[dt.id] || {};
+
+    // Client rimasto indietro o sensore nuovo: il server non ha inviato tutti i campioni, si ricarica
+    if (update.dropped > 0 || Object.keys(samplesBySensor).some(sensorType => !(sensorType in chartTraceIndexes))) {
+        loadDigitalTwinDetails(dt.id);
+        return;
+    }
+
+    const latest = dt.digital_replica.latest || (dt.digital_replica.latest = {});
+    const x = [], y = [], indexes = [];
+    Object.entries(samplesBySensor).forEach(([sensorType, samples]) => {
+        samples.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+        const newest = samples[samples.length - 1];
+        if (!latest[sensorType] || new Date(newest.timestamp) >= new Date(latest[sensorType].timestamp)) {
+            latest[sensorType] = newest;
+            const card = document.getElementById(`latest-${sensorType}`);
+            if (card) {
+                card.innerHTML = formatLatestValue(newest);
+            }
+        }
+        if (!dt.digital_replica.last_updated || new Date(newest.timestamp) > new Date(dt.digital_replica.last_updated)) {
+            dt.digital_replica.last_updated = newest.timestamp;
+        }
+        x.push(samples.map(d => d.timestamp));
+        y.push(samples.map(d => d.value));
+        indexes.push(chartTraceIndexes[sensorType]);
+    });
+
+    if (indexes.length > 0) {
+        Plotly.extendTraces('sensorChart', { x, y }, indexes, LIVE_CHART_MAX_POINTS);
+        document.getElementById('lastUpdated').textContent = new Date(dt.digital_replica.last_updated).toLocaleString();
+    }
+}
+
 // Genera dati casuali per un digital twin
 async function generateRandomData(dtId) {
     try {
         await apiRequest(`/digital-twins/${dtId}/generate-data`, 'POST');
         showSuccess('Random data generated successfully');
 
-        // Ricarica i dettagli del digital twin
-        loadDigitalTwinDetails(dtId);
+        // I nuovi valori arrivano con gli aggiornamenti in tempo reale; senza connessione si ricarica
+        if (!liveUpdates) {
+            loadDigitalTwinDetails(dtId);
+        }
     } catch (error) {
         console.error('Error generating random data:', error);
         showError('Failed to generate random data: ' + error.message);
@@ -398,6 +544,7 @@ async function deleteDigitalTwin(dtId) {
 
     try {
         await apiRequest(`/digital-twins/${dtId}`, 'DELETE');
+        stopLiveUpdates();
 
         // Clear details and reload list
         document.getElementById('digitalTwinDetails').innerHTML = `
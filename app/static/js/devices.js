@@ -30,7 +30,7 @@ document.addEventListener('DOMContentLoaded', function () {
     // Funzione per caricare la lista dei dispositivi
     async function loadDevicesList() {
         try {
-            const devices = await apiRequest('/devices/');
+            const devices = await apiRequestAll('/devices/');
 
             // Pulisci la lista
             devicesList.innerHTML = '';
@@ -72,7 +72,7 @@ document.addEventListener('DOMContentLoaded', function () {
     // Funzione per caricare la lista degli utenti
     async function loadUsersList() {
         try {
-            const users = await apiRequest('/users/');
+            const users = await apiRequestAll('/users/');
 
             // Se la lista utenti è vuota, crea un utente di esempio
             if (users.length === 0) {
@@ -84,7 +84,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
             // Aggiorna il campo input owner_id con il suggerimento
             if (ownerIdInput) {
-                const updatedUsers = await apiRequest('/users/');
+                const updatedUsers = await apiRequestAll('/users/');
                 if (updatedUsers.length > 0) {
                     ownerIdInput.placeholder = `Es: ${updatedUsers[0].id}`;
                 }
@@ -16,7 +16,7 @@ document.addEventListener('DOMContentLoaded', function () {
     // Funzione per caricare la lista degli utenti
     async function loadUsersList() {
         try {
-            const users = await apiRequest('/users/');
+            const users = await apiRequestAll('/users/');
 
             // Pulisci la lista
             usersList.innerHTML = '';
@@ -98,10 +98,10 @@ document.addEventListener('DOMContentLoaded', function () {
             const user = await apiRequest(`/users/${userId}`);
 
             // Ottieni i dispositivi dell'utente
-            const devices = await apiRequest(`/users/${userId}/devices`);
+            const devices = await apiRequestAll(`/users/${userId}/devices`);
 
             // Ottieni i digital twins dell'utente
-            const digitalTwins = await apiRequest(`/users/${userId}/digital-twins`);
+            const digitalTwins = await apiRequestAll(`/users/${userId}/digital-twins`);
 
             // Prepara il contenuto del modal
             const modalContent = document.getElementById('user-details-content');
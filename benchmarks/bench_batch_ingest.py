@@ -0,0 +1,57 @@
+# benchmarks/bench_batch_ingest.py
+"""
+Latenza di un batch di 1000 misurazioni verso un digital twin.
+
+Confronta il ciclo di add_sensor_data_to_digital_twin (una scrittura per misurazione)
+con add_sensor_data_batch_to_digital_twin (un solo update raggruppato per sensore).
+
+Uso: python -m benchmarks.bench_batch_ingest  (richiede MongoDB su MONGODB_URL)
+"""
+import datetime
+
+from app.db.crud import get_document
+from app.models.sensor import SensorMeasurement
+from app.services.digital_twin_service import (
+    add_sensor_data_to_digital_twin,
+    add_sensor_data_batch_to_digital_twin
+)
+from benchmarks.common import create_bench_digital_twin, measure, run
+
+SENSORS = ["temperature", "humidity", "pressure"]
+BATCH_SIZE = 1000
+REPEAT = 5
+
+def make_batch():
+    start = datetime.datetime.now()
+    return [
+        SensorMeasurement(
+            timestamp=(start + datetime.timedelta(milliseconds=i)).isoformat(),
+            attribute_name=SENSORS[i % len(SENSORS)],
+            value=float(i % 100)
+        )
+        for i in range(BATCH_SIZE)
+    ]
+
+async def main():
+    batch = make_batch()
+    loop_id = await create_bench_digital_twin(SENSORS)
+    batch_id = await create_bench_digital_twin(SENSORS)
+    
+    async def per_sample():
+        for measurement in batch:
+            await add_sensor_data_to_digital_twin(
+                loop_id, measurement.attribute_name, measurement.value, measurement.timestamp
+            )
+    
+    async def grouped():
+        dt = await get_document("digital_twins", batch_id)
+        await add_sensor_data_batch_to_digital_twin(dt, batch)
+    
+    loop_stats = await measure(per_sample, REPEAT)
+    batch_stats = await measure(grouped, REPEAT)
+    print(f"{BATCH_SIZE} misurazioni per richiesta")
+    print(f"  per campione: mean {loop_stats['mean_ms']:.1f}ms  p95 {loop_stats['p95_ms']:.1f}ms")
+    print(f"  raggruppato:  mean {batch_stats['mean_ms']:.1f}ms  p95 {batch_stats['p95_ms']:.1f}ms")
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,113 @@
+# benchmarks/bench_list_serialization.py
+"""
+Costo della serializzazione delle liste di digital twin e dispositivi.
+
+Confronta, per pagine da 100 e 1000 documenti, le risposte validate dal response_model
+(FAST_READ_SERIALIZATION=False) con quelle codificate direttamente da
+app.api.serialization: GET /digital-twins/ (riepiloghi), GET /devices/ e, senza
+database, la serializzazione di twin completi con List[DigitalTwin] come faceva la
+lista prima dei riepiloghi. Twin e dispositivi hanno un device_type dell'ontologia,
+quindi la validazione esegue i validator che rileggono l'ontologia dal disco.
+
+Uso: python -m benchmarks.bench_list_serialization  (richiede MongoDB su MONGODB_URL)
+"""
+import datetime
+import uuid
+from typing import List
+
+import httpx
+import orjson
+from pydantic import TypeAdapter
+
+from app.config import settings
+from app.api.auth_service import get_current_active_user
+from app.api.serialization import trusted_dump
+from app.db.database import get_database
+from app.models.digital_twin import DigitalTwin
+from benchmarks.common import create_bench_digital_twin, measure, run
+from main import app
+
+SENSOR = "temperature"
+DEVICE_TYPE = "altimeter"
+SIZES = [100, 1000]
+HISTORY_SAMPLES = 10
+REPEAT = 10
+
+def build_history(samples: int) -> dict:
+    start = datetime.datetime(2024, 1, 1)
+    return {SENSOR: [
+        {"timestamp": start + datetime.timedelta(seconds=i * 10), "value": 20.0 + i / 10, "unit_measure": "°C"}
+        for i in range(samples)
+    ]}
+
+async def create_bench_devices(count: int) -> None:
+    await get_database()["devices"].insert_many([
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"device_bench_{i}",
+            "device_type": DEVICE_TYPE,
+            "template_id": None,
+            "attributes": {SENSOR: {"value": 20.0, "unit_measure": "°C"}},
+            "metadata": {},
+            "digital_twin_id": None,
+            "owner_id": "bench",
+            "api_key": uuid.uuid4().hex
+        }
+        for i in range(count)
+    ])
+
+def report(label: str, validated: dict, trusted: dict) -> None:
+    print(
+        f"  {label:<40} response_model {validated['mean_ms']:>8.1f}ms (p95 {validated['p95_ms']:>8.1f})"
+        f"  diretta {trusted['mean_ms']:>8.1f}ms (p95 {trusted['p95_ms']:>8.1f})"
+        f"  x{validated['mean_ms'] / trusted['mean_ms']:.1f}"
+    )
+
+async def measure_both(operation) -> tuple:
+    original = settings.FAST_READ_SERIALIZATION
+    try:
+        settings.FAST_READ_SERIALIZATION = False
+        validated = await measure(operation, REPEAT)
+        settings.FAST_READ_SERIALIZATION = True
+        trusted = await measure(operation, REPEAT)
+    finally:
+        settings.FAST_READ_SERIALIZATION = original
+    return validated, trusted
+
+async def main():
+    app.dependency_overrides[get_current_active_user] = lambda: {"id": "bench"}
+    try:
+        history = build_history(HISTORY_SAMPLES)
+        for _ in range(max(SIZES)):
+            await create_bench_digital_twin([SENSOR], DEVICE_TYPE, history)
+        await create_bench_devices(max(SIZES))
+        documents = await get_database()["digital_twins"].find({"owner_id": "bench"}).to_list(None)
+        twins_adapter = TypeAdapter(List[DigitalTwin])
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            async def fetch(url: str) -> bytes:
+                response = await client.get(url)
+                response.raise_for_status()
+                return response.content
+
+            for size in SIZES:
+                print(f"{size} documenti, {HISTORY_SAMPLES} campioni per twin")
+                report("GET /digital-twins/ (riepiloghi)", *await measure_both(
+                    lambda: fetch(f"/api/v1/digital-twins/?limit={size}&fields=compatible_sensors")
+                ))
+                report("GET /devices/", *await measure_both(lambda: fetch(f"/api/v1/devices/?limit={size}")))
+
+                page = documents[:size]
+
+                async def validated_twins():
+                    return twins_adapter.dump_json(twins_adapter.validate_python(page))
+
+                async def trusted_twins():
+                    return orjson.dumps([trusted_dump(DigitalTwin, document) for document in page])
+
+                report("List[DigitalTwin] completi, in memoria", await measure(validated_twins, REPEAT), await measure(trusted_twins, REPEAT))
+    finally:
+        app.dependency_overrides.pop(get_current_active_user, None)
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,56 @@
+# benchmarks/bench_ndjson_upload.py
+"""
+Throughput del caricamento NDJSON in streaming, in campioni al secondo.
+
+Il corpo viene generato e passato a ingest_ndjson_stream a blocchi da 64 KB, come
+farebbe request.stream(), sia in chiaro che compresso con gzip.
+
+Uso: python -m benchmarks.bench_ndjson_upload  (richiede MongoDB su MONGODB_URL)
+"""
+import datetime
+import gzip
+import json
+import time
+
+from app.db.crud import get_document
+from app.services.bulk_upload import ingest_ndjson_stream
+from benchmarks.common import create_bench_digital_twin, run
+
+SENSORS = ["temperature", "humidity"]
+SAMPLES = 86_400  # un giorno di dati a 1 Hz
+READ_SIZE = 64 * 1024
+
+def make_body() -> bytes:
+    start = datetime.datetime(2024, 1, 1)
+    lines = [
+        json.dumps({
+            "timestamp": (start + datetime.timedelta(seconds=i)).isoformat(),
+            "attribute_name": SENSORS[i % len(SENSORS)],
+            "value": float(i % 100)
+        })
+        for i in range(SAMPLES)
+    ]
+    return ("\n".join(lines) + "\n").encode()
+
+async def chunks(body: bytes):
+    for start in range(0, len(body), READ_SIZE):
+        yield body[start:start + READ_SIZE]
+
+async def main():
+    body = make_body()
+    compressed = gzip.compress(body)
+    
+    for label, payload, gzip_encoded in [("json", body, False), ("gzip", compressed, True)]:
+        digital_twin_id = await create_bench_digital_twin(SENSORS)
+        dt = await get_document("digital_twins", digital_twin_id)
+        
+        start = time.perf_counter()
+        summary = await ingest_ndjson_stream(dt, chunks(payload), gzip_encoded)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{label}: {len(payload) / 1024 / 1024:.1f} MB, {summary['accepted']} campioni in "
+            f"{elapsed:.2f}s -> {summary['accepted'] / elapsed:,.0f} campioni/s"
+        )
+
+if __name__ == "__main__":
+    run(main)
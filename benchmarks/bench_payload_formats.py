@@ -0,0 +1,83 @@
+# benchmarks/bench_payload_formats.py
+"""
+Dimensione sulla rete e CPU di decodifica dei formati accettati da /data/batch.
+
+Per un batch di 1000 misurazioni confronta JSON, MessagePack e CBOR, sia nella forma
+per riga ({"measurements": [...]}) che in quella colonnare ({sensore: {ts, values}}).
+La CPU comprende decodifica, validazione e costruzione dei campioni da salvare.
+
+Uso: python -m benchmarks.bench_payload_formats  (non richiede MongoDB)
+"""
+import datetime
+import gzip
+import json
+import time
+
+import cbor2
+import msgpack
+
+from app.api.payloads import decode_payload, validate_payload
+from app.models.sensor import BatchSensorMeasurements, ColumnarSensorMeasurements
+
+SENSORS = ["temperature", "humidity", "pressure"]
+BATCH_SIZE = 1000
+REPEAT = 200
+
+ENCODERS = {
+    "application/json": lambda payload: json.dumps(payload).encode(),
+    "application/msgpack": msgpack.packb,
+    "application/cbor": cbor2.dumps
+}
+
+def make_payloads():
+    start = datetime.datetime(2024, 1, 1)
+    rows = [
+        {
+            "timestamp": (start + datetime.timedelta(milliseconds=100 * i)).isoformat(),
+            "attribute_name": SENSORS[i % len(SENSORS)],
+            "value": 20.0 + (i % 100) / 10
+        }
+        for i in range(BATCH_SIZE)
+    ]
+    columns = {}
+    for row in rows:
+        column = columns.setdefault(row["attribute_name"], {"ts": [], "values": []})
+        column["ts"].append(row["timestamp"])
+        column["values"].append(row["value"])
+    return {"rows": {"measurements": rows}, "columnar": columns}
+
+def parse_rows(body: bytes, content_type: str):
+    batch = validate_payload(BatchSensorMeasurements, decode_payload(body, content_type))
+    return [
+        {"timestamp": m.timestamp, "value": m.value, "unit_measure": m.unit_measure}
+        for m in batch.measurements
+    ]
+
+def parse_columnar(body: bytes, content_type: str):
+    columns = validate_payload(ColumnarSensorMeasurements, decode_payload(body, content_type)).root
+    return [
+        {"timestamp": timestamp, "value": value, "unit_measure": column.unit_measure}
+        for column in columns.values()
+        for timestamp, value in zip(column.ts, column.values)
+    ]
+
+def main():
+    payloads = make_payloads()
+    parsers = {"rows": parse_rows, "columnar": parse_columnar}
+
+    print(f"{BATCH_SIZE} misurazioni, {REPEAT} ripetizioni")
+    print(f"{'forma':<9} {'formato':<20} {'byte':>8} {'gzip':>8} {'CPU/batch':>10}")
+    for shape, payload in payloads.items():
+        for content_type, encode in ENCODERS.items():
+            body = encode(payload)
+            start = time.process_time()
+            for _ in range(REPEAT):
+                parsers[shape](body, content_type)
+            cpu_ms = (time.process_time() - start) / REPEAT * 1000
+            print(
+                f"{shape:<9} {content_type:<20} {len(body):>8} {len(gzip.compress(body)):>8} "
+                f"{cpu_ms:>8.2f}ms"
+            )
+
+if __name__ == "__main__":
+    main()
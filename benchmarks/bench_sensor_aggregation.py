@@ -0,0 +1,85 @@
+# benchmarks/bench_sensor_aggregation.py
+"""
+Latenza di GET /digital-twins/{id}/data/aggregate su storici di grandi dimensioni.
+
+Confronta la lettura dei campioni grezzi con aggregazione lato client (quello che fa
+oggi il browser) con aggregate_sensor_data: sui bucket con gli aggregati precalcolati
+(interval multiplo della finestra dei bucket), sui bucket scomponendo i campioni
+(interval più piccolo) e sullo storico nel documento del twin. Lo storico embedded è
+più piccolo perché un documento Mongo non può superare 16MB.
+
+Uso: python -m benchmarks.bench_sensor_aggregation  (richiede MongoDB su MONGODB_URL)
+"""
+import datetime
+
+from app.config import settings
+from app.services.digital_twin_service import get_sensor_history
+from app.services.sensor_aggregation import aggregate_sensor_data
+from benchmarks.common import create_bench_digital_twin, fill_sensor_history, measure, run
+
+SENSOR = "temperature"
+BUCKETED_SAMPLES = 1_000_000
+EMBEDDED_SAMPLES = 100_000
+SAMPLE_SECONDS = 10
+REPEAT = 5
+
+async def client_side_average(digital_twin: dict, interval: datetime.timedelta) -> dict:
+    """Legge tutti i campioni e calcola la media per intervallo in Python"""
+    history = await get_sensor_history(digital_twin, [SENSOR])
+    sums, counts = {}, {}
+    for sample in history.get(SENSOR, []):
+        slot = sample["timestamp"] - (sample["timestamp"] - datetime.datetime(1970, 1, 1)) % interval
+        sums[slot] = sums.get(slot, 0) + sample["value"]
+        counts[slot] = counts.get(slot, 0) + 1
+    return {slot: sums[slot] / counts[slot] for slot in sums}
+
+def report(label: str, stats: dict) -> None:
+    print(f"  {label:<42} mean {stats['mean_ms']:>9.1f}ms  p95 {stats['p95_ms']:>9.1f}ms")
+
+async def main():
+    original_mode = settings.SENSOR_STORAGE_MODE
+    try:
+        settings.SENSOR_STORAGE_MODE = "bucketed"
+        digital_twin = {"id": await create_bench_digital_twin([SENSOR]), "compatible_sensors": [SENSOR]}
+        end = await fill_sensor_history(digital_twin["id"], SENSOR, BUCKETED_SAMPLES, SAMPLE_SECONDS)
+        start = datetime.datetime(2024, 1, 1)
+        print(f"bucketed, {BUCKETED_SAMPLES} campioni, bucket di {settings.SENSOR_BUCKET_SECONDS}s")
+        report("campioni grezzi + media lato client (1h)", await measure(
+            lambda: client_side_average(digital_twin, datetime.timedelta(hours=1)), REPEAT
+        ))
+        report("aggregate avg 1h (aggregati dei bucket)", await measure(
+            lambda: aggregate_sensor_data(digital_twin, [SENSOR], "1h", "avg", start, end), REPEAT
+        ))
+        report("aggregate avg 1d (aggregati dei bucket)", await measure(
+            lambda: aggregate_sensor_data(digital_twin, [SENSOR], "1d", "avg", start, end), REPEAT
+        ))
+        report("aggregate max 1h, range parziale", await measure(
+            lambda: aggregate_sensor_data(
+                digital_twin, [SENSOR], "1h", "max",
+                start + datetime.timedelta(minutes=30), end - datetime.timedelta(minutes=30)
+            ),
+            REPEAT
+        ))
+        report("aggregate avg 1d, ultimi 7 giorni", await measure(
+            lambda: aggregate_sensor_data(digital_twin, [SENSOR], "1d", "avg", end - datetime.timedelta(days=7), end),
+            REPEAT
+        ))
+        report("aggregate avg 15m (campioni scomposti)", await measure(
+            lambda: aggregate_sensor_data(digital_twin, [SENSOR], "15m", "avg", start, end), REPEAT
+        ))
+
+        settings.SENSOR_STORAGE_MODE = "embedded"
+        digital_twin = {"id": await create_bench_digital_twin([SENSOR]), "compatible_sensors": [SENSOR]}
+        end = await fill_sensor_history(digital_twin["id"], SENSOR, EMBEDDED_SAMPLES, SAMPLE_SECONDS)
+        print(f"embedded, {EMBEDDED_SAMPLES} campioni")
+        report("campioni grezzi + media lato client (1h)", await measure(
+            lambda: client_side_average(digital_twin, datetime.timedelta(hours=1)), REPEAT
+        ))
+        report("aggregate avg 1h", await measure(
+            lambda: aggregate_sensor_data(digital_twin, [SENSOR], "1h", "avg", start, end), REPEAT
+        ))
+    finally:
+        settings.SENSOR_STORAGE_MODE = original_mode
+
+if __name__ == "__main__":
+    run(main)
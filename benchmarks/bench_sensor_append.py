@@ -0,0 +1,66 @@
+# benchmarks/bench_sensor_append.py
+"""
+Latenza per campione di add_sensor_data_to_digital_twin al crescere dello storico.
+
+Confronta il vecchio percorso (due letture + riscrittura dell'intera lista + update di
+last_updated) con l'append atomico ($push + $set in un solo update).
+
+Uso: python -m benchmarks.bench_sensor_append  (richiede MongoDB su MONGODB_URL)
+"""
+import datetime
+
+from app.db.crud import get_document, update_document
+from app.services.digital_twin_service import add_sensor_data_to_digital_twin
+from benchmarks.common import create_bench_digital_twin, measure, run
+
+SENSOR = "temperature"
+HISTORY_SIZES = [0, 1_000, 10_000, 50_000]
+REPEAT = 50
+
+def make_history(size: int):
+    start = datetime.datetime(2024, 1, 1)
+    return [
+        {
+            "timestamp": (start + datetime.timedelta(seconds=i)).isoformat(),
+            "value": 20.0 + (i % 10),
+            "unit_measure": "°C"
+        }
+        for i in range(size)
+    ]
+
+async def legacy_append(digital_twin_id: str, value: float, timestamp: str) -> None:
+    """Il percorso precedente: 2 get_document, riscrittura della lista e update di last_updated"""
+    dt = await get_document("digital_twins", digital_twin_id)
+    if SENSOR not in dt.get("compatible_sensors", []):
+        return
+    existing_dt = await get_document("digital_twins", digital_twin_id)
+    sensor_data = existing_dt["digital_replica"]["sensor_data"].get(SENSOR, [])
+    await update_document(
+        "digital_twins",
+        digital_twin_id,
+        {f"digital_replica.sensor_data.{SENSOR}": sensor_data + [
+            {"timestamp": timestamp, "value": value, "unit_measure": "°C"}
+        ]}
+    )
+    await update_document("digital_twins", digital_twin_id, {"digital_replica.last_updated": timestamp})
+
+async def main():
+    print(f"{'history':>8} | {'legacy mean':>12} | {'legacy p95':>11} | {'atomic mean':>12} | {'atomic p95':>11}")
+    for size in HISTORY_SIZES:
+        history = make_history(size)
+        legacy_id = await create_bench_digital_twin([SENSOR], history={SENSOR: history})
+        atomic_id = await create_bench_digital_twin([SENSOR], history={SENSOR: history})
+        timestamp = datetime.datetime.now().isoformat()
+        
+        legacy = await measure(lambda: legacy_append(legacy_id, 21.5, timestamp), REPEAT)
+        atomic = await measure(
+            lambda: add_sensor_data_to_digital_twin(atomic_id, SENSOR, 21.5, timestamp, "°C"),
+            REPEAT
+        )
+        print(
+            f"{size:>8} | {legacy['mean_ms']:>10.2f}ms | {legacy['p95_ms']:>9.2f}ms | "
+            f"{atomic['mean_ms']:>10.2f}ms | {atomic['p95_ms']:>9.2f}ms"
+        )
+
+if __name__ == "__main__":
+    run(main)
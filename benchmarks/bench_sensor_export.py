@@ -0,0 +1,76 @@
+# benchmarks/bench_sensor_export.py
+"""
+Tempo per portare uno storico di grandi dimensioni in colonne lato client.
+
+Confronta GET /digital-twins/{id}/data (JSON, decodificato e trasformato in colonne),
+l'esportazione NDJSON (decodificata riga per riga) e l'esportazione Arrow IPC (letta
+direttamente come tabella colonnare). Le richieste passano dall'applicazione ASGI
+senza rete, quindi i tempi comprendono serializzazione lato server e decodifica lato
+client.
+
+Uso: python -m benchmarks.bench_sensor_export  (richiede MongoDB su MONGODB_URL)
+"""
+import json
+
+import httpx
+import pyarrow as pa
+
+from app.config import settings
+from app.api.auth_service import get_current_active_user
+from benchmarks.common import create_bench_digital_twin, fill_sensor_history, measure, run
+from main import app
+
+SENSOR = "temperature"
+SAMPLES = 1_000_000
+REPEAT = 3
+
+async def fetch(client: httpx.AsyncClient, url: str) -> bytes:
+    response = await client.get(url)
+    response.raise_for_status()
+    return response.content
+
+async def main():
+    original_mode = settings.SENSOR_STORAGE_MODE
+    app.dependency_overrides[get_current_active_user] = lambda: {"id": "bench"}
+    try:
+        settings.SENSOR_STORAGE_MODE = "bucketed"
+        digital_twin_id = await create_bench_digital_twin([SENSOR])
+        await fill_sensor_history(digital_twin_id, SENSOR, SAMPLES)
+        base_url = f"/api/v1/digital-twins/{digital_twin_id}/data"
+        sizes = {}
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            async def json_columns():
+                body = await fetch(client, f"{base_url}?sensors={SENSOR}")
+                sizes["json"] = len(body)
+                samples = json.loads(body)[SENSOR]
+                return [sample["timestamp"] for sample in samples], [sample["value"] for sample in samples]
+
+            async def ndjson_columns():
+                body = await fetch(client, f"{base_url}/export?format=ndjson&sensors={SENSOR}")
+                sizes["ndjson"] = len(body)
+                rows = [json.loads(line) for line in body.splitlines()]
+                return [row["timestamp"] for row in rows], [row["value"] for row in rows]
+
+            async def arrow_table():
+                body = await fetch(client, f"{base_url}/export?format=arrow&sensors={SENSOR}")
+                sizes["arrow"] = len(body)
+                return pa.ipc.open_stream(body).read_all()
+
+            print(f"bucketed, {SAMPLES} campioni di un sensore")
+            for label, operation in [
+                ("json", json_columns),
+                ("ndjson", ndjson_columns),
+                ("arrow", arrow_table)
+            ]:
+                stats = await measure(operation, REPEAT)
+                print(
+                    f"  {label:<8} mean {stats['mean_ms']:>9.1f}ms  p95 {stats['p95_ms']:>9.1f}ms"
+                    f"  {sizes[label] / 1024 / 1024:>7.1f}MB"
+                )
+    finally:
+        app.dependency_overrides.pop(get_current_active_user, None)
+        settings.SENSOR_STORAGE_MODE = original_mode
+
+if __name__ == "__main__":
+    run(main)
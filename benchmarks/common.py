@@ -0,0 +1,99 @@
+# benchmarks/common.py
+"""Utility condivise dai benchmark: connessione a un database dedicato e misura dei tempi"""
+import asyncio
+import datetime
+import statistics
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.config import settings
+from app.db.database import Database, get_database
+from app.services.digital_twin_service import write_sensor_samples_bulk
+
+BENCH_DATABASE_SUFFIX = "_bench"
+
+def connect_bench_database() -> None:
+    """Collega l'applicazione ad un database separato, per non toccare i dati reali"""
+    settings.DATABASE_NAME = f"{settings.DATABASE_NAME}{BENCH_DATABASE_SUFFIX}"
+    Database.client = AsyncIOMotorClient(settings.MONGODB_URL)
+
+async def drop_bench_database() -> None:
+    """Elimina il database dei benchmark"""
+    await Database.client.drop_database(settings.DATABASE_NAME)
+
+async def create_bench_digital_twin(
+    compatible_sensors: List[str],
+    device_type: Optional[str] = None,
+    history: Optional[Dict[str, List[Dict[str, Any]]]] = None
+) -> str:
+    """Inserisce direttamente un digital twin minimale e restituisce il suo ID"""
+    digital_twin_id = str(uuid.uuid4())
+    await get_database()["digital_twins"].insert_one({
+        "id": digital_twin_id,
+        "name": f"DT_bench_{digital_twin_id[:8]}",
+        "device_id": str(uuid.uuid4()),
+        "device_type": device_type,
+        "template_id": None,
+        "owner_id": "bench",
+        "compatible_sensors": compatible_sensors,
+        "digital_replica": {"sensor_data": history or {}, "last_updated": None, "metadata": {}}
+    })
+    return digital_twin_id
+
+async def fill_sensor_history(
+    digital_twin_id: str,
+    sensor_type: str,
+    samples: int,
+    sample_seconds: int = 10,
+    chunk_size: int = 10_000
+) -> datetime.datetime:
+    """Scrive un campione ogni sample_seconds secondi dal 2024-01-01 e restituisce l'istante dell'ultimo"""
+    start = datetime.datetime(2024, 1, 1)
+    for offset in range(0, samples, chunk_size):
+        await write_sensor_samples_bulk(
+            [
+                (
+                    digital_twin_id,
+                    sensor_type,
+                    {
+                        "timestamp": start + datetime.timedelta(seconds=i * sample_seconds),
+                        "value": 20.0 + (i % 100) / 10,
+                        "unit_measure": "°C"
+                    },
+                    None
+                )
+                for i in range(offset, min(offset + chunk_size, samples))
+            ],
+            deduplicate=False
+        )
+    return start + datetime.timedelta(seconds=(samples - 1) * sample_seconds)
+
+async def measure(operation: Callable[[], Awaitable[Any]], repeat: int) -> Dict[str, float]:
+    """Esegue un'operazione asincrona più volte e restituisce le statistiche in millisecondi"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await operation()
+        samples.append((time.perf_counter() - start) * 1000)
+    
+    samples.sort()
+    return {
+        "mean_ms": statistics.mean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    }
+
+def run(main: Callable[[], Awaitable[None]]) -> None:
+    """Esegue un benchmark su un database dedicato, eliminandolo alla fine"""
+    async def runner():
+        connect_bench_database()
+        try:
+            await main()
+        finally:
+            await drop_bench_database()
+            Database.client.close()
+    
+    asyncio.run(runner())
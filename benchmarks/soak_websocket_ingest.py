@@ -0,0 +1,146 @@
+# benchmarks/soak_websocket_ingest.py
+"""
+Soak test dell'ingestione su WebSocket rispetto a POST /devices/data.
+
+Avvia l'applicazione in-process con uvicorn sul database dei benchmark, apre più
+connessioni WebSocket che inviano frame alla frequenza indicata per la durata indicata
+e riporta la frequenza sostenuta per connessione, la latenza delle conferme e il tempo
+di CPU per messaggio. Poi invia lo stesso numero di messaggi con richieste HTTP.
+Il tempo di CPU è quello dell'intero processo, quindi include anche i client.
+
+Uso: python -m benchmarks.soak_websocket_ingest --connections 20 --rate 50 --duration 30
+(richiede MongoDB su MONGODB_URL)
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import secrets
+import statistics
+import time
+import uuid
+
+import httpx
+import uvicorn
+import websockets
+
+from app.db.database import get_database
+from main import app
+from benchmarks.common import create_bench_digital_twin, run
+
+DEVICE_TYPE = "heartRateMonitor"
+SENSOR = "averageHeartRate"
+PORT = 8765
+HTTP_CONCURRENCY = 20
+
+async def create_bench_device() -> str:
+    """Crea un dispositivo con il suo digital twin e restituisce l'API key"""
+    api_key = secrets.token_urlsafe(32)
+    digital_twin_id = await create_bench_digital_twin([SENSOR], device_type=DEVICE_TYPE)
+    await get_database()["devices"].insert_one({
+        "id": str(uuid.uuid4()),
+        "name": "bench_device",
+        "device_type": DEVICE_TYPE,
+        "api_key": api_key,
+        "digital_twin_id": digital_twin_id,
+        "attributes": {}
+    })
+    return api_key
+
+async def stream_device(api_key: str, rate: float, duration: float) -> dict:
+    """Invia frame a frequenza costante e misura la latenza tra invio e conferma"""
+    sent_at = {}
+    ack_latencies = []
+    acked = 0
+
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}/api/v1/devices/stream?api_key={api_key}") as ws:
+        async def receive_acks():
+            nonlocal acked
+            async for message in ws:
+                ack = json.loads(message)
+                if ack.get("ack") is None:
+                    continue
+                now = time.perf_counter()
+                for seq in [seq for seq in sent_at if seq <= ack["ack"]]:
+                    ack_latencies.append((now - sent_at.pop(seq)) * 1000)
+                    acked += 1
+
+        receiver = asyncio.create_task(receive_acks())
+        start = time.perf_counter()
+        seq = 0
+        while time.perf_counter() - start < duration:
+            seq += 1
+            sent_at[seq] = time.perf_counter()
+            await ws.send(json.dumps({
+                "s": seq,
+                "t": datetime.datetime.utcnow().isoformat(),
+                "d": {SENSOR: 60 + seq % 40}
+            }))
+            # Frequenza costante rispetto all'inizio, senza accumulare ritardi
+            await asyncio.sleep(max(0, start + seq / rate - time.perf_counter()))
+
+        # Attende le ultime conferme prima di chiudere
+        while sent_at and time.perf_counter() - start < duration + 5:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        receiver.cancel()
+
+    ack_latencies.sort()
+    return {
+        "rate": acked / elapsed,
+        "acked": acked,
+        "ack_p50_ms": ack_latencies[len(ack_latencies) // 2] if ack_latencies else 0,
+        "ack_p95_ms": ack_latencies[int(len(ack_latencies) * 0.95)] if ack_latencies else 0
+    }
+
+async def post_device_data(api_key: str, messages: int) -> None:
+    """Invia messaggi con POST /devices/data usando HTTP_CONCURRENCY richieste in parallelo"""
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", headers={"X-API-Key": api_key}) as client:
+        async def worker(count: int):
+            for i in range(count):
+                response = await client.post("/api/v1/devices/data", json={SENSOR: 60 + i % 40})
+                response.raise_for_status()
+
+        per_worker = messages // HTTP_CONCURRENCY
+        await asyncio.gather(*[worker(per_worker) for _ in range(HTTP_CONCURRENCY)])
+
+async def main(connections: int, rate: float, duration: float):
+    server = uvicorn.Server(uvicorn.Config(app, port=PORT, lifespan="off", log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        api_keys = [await create_bench_device() for _ in range(connections)]
+
+        cpu_start = time.process_time()
+        results = await asyncio.gather(*[stream_device(api_key, rate, duration) for api_key in api_keys])
+        ws_cpu = time.process_time() - cpu_start
+        ws_messages = sum(result["acked"] for result in results)
+
+        print(f"WebSocket: {connections} connessioni a {rate:g} Hz per {duration:g}s")
+        print(f"  frequenza per connessione: min {min(r['rate'] for r in results):.1f} Hz  "
+              f"media {statistics.mean(r['rate'] for r in results):.1f} Hz")
+        print(f"  conferme: p50 {statistics.median(r['ack_p50_ms'] for r in results):.1f}ms  "
+              f"p95 {max(r['ack_p95_ms'] for r in results):.1f}ms")
+        print(f"  CPU per messaggio: {ws_cpu / ws_messages * 1e6:.0f}us ({ws_messages} messaggi)")
+
+        http_messages = min(ws_messages, 5000)
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        await post_device_data(api_keys[0], http_messages)
+        http_cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        print(f"HTTP POST /devices/data: {http_messages} messaggi in {wall:.1f}s ({http_messages / wall:.0f}/s)")
+        print(f"  CPU per messaggio: {http_cpu / http_messages * 1e6:.0f}us")
+    finally:
+        server.should_exit = True
+        await server_task
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=50, help="Frame al secondo per connessione")
+    parser.add_argument("--duration", type=float, default=30, help="Durata in secondi")
+    args = parser.parse_args()
+    run(lambda: main(args.connections, args.rate, args.duration))
@@ -4,11 +4,20 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from app.api.router import router
 from app.db.database import connect_to_mongo, close_mongo_connection
+from app.db.crud import ensure_list_indexes
+from app.db.timeseries import ensure_timeseries_indexes
+from app.db.rollups import ensure_rollup_indexes
+from app.services.ingestion_queue import ingestion_pipeline
+from app.services.fleet_query import ensure_fleet_query_indexes
+from app.api.pagination import NEXT_CURSOR_HEADER
 from app.config import settings, ROOT_DIR, DATA_DIR
 import uvicorn
 import os
+import logging
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 # Make sure the data directory exists
 data_dir = Path(DATA_DIR)
 data_dir.mkdir(exist_ok=True)
@@ -34,6 +43,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browser clients on other origins need the pagination cursor of list responses
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Configure StaticFiles to serve static files
@@ -49,9 +60,40 @@ app.include_router(router, prefix="/api/v1")
 @app.on_event("startup")
 async def startup_db_client():
     await connect_to_mongo()
+    
+    # Keyset pagination of the list endpoints needs (filter, sort key, _id) indexes
+    try:
+        await ensure_list_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create list indexes: {e}")
+    
+    # Fleet queries filter twins by type, last update and latest sensor values
+    try:
+        await ensure_fleet_query_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create fleet query indexes: {e}")
+    
+    # Bucket indexes are only needed by the bucketed storage and must not block startup
+    if settings.SENSOR_STORAGE_MODE != "embedded":
+        try:
+            await ensure_timeseries_indexes()
+        except Exception as e:
+            logger.warning(f"Could not create sensor bucket indexes: {e}")
+    
+    if settings.SENSOR_ROLLUPS_ENABLED:
+        try:
+            await ensure_rollup_indexes()
+        except Exception as e:
+            logger.warning(f"Could not create sensor rollup indexes: {e}")
+    
+    # The write-ahead log is served by the ingestion pipeline
+    if settings.INGESTION_QUEUE_ENABLED or settings.WAL_ENABLED:
+        await ingestion_pipeline.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Drain queued samples before the connection is closed
+    await ingestion_pipeline.stop()
     await close_mongo_connection()
 
 @app.get("/")
@@ -0,0 +1,111 @@
+# manage.py
+"""
+Maintenance commands for the platform
+
+Usage: python manage.py <command> [options]
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+from app.db.database import connect_to_mongo, close_mongo_connection
+from app.db.timeseries import ensure_timeseries_indexes
+from app.db.rollups import ensure_rollup_indexes
+from app.services.migrations import (
+    migrate_sensor_data_to_buckets,
+    migrate_sensor_timestamps,
+    rebuild_latest_sensor_values,
+    rebuild_sensor_rollups
+)
+from app.services.write_ahead_log import create_write_ahead_log, replay_write_ahead_log
+from app.config import settings
+
+async def migrate_sensor_buckets(args):
+    await ensure_timeseries_indexes()
+    return await migrate_sensor_data_to_buckets(purge=args.purge)
+
+async def migrate_timestamps(args):
+    await ensure_timeseries_indexes()
+    return await migrate_sensor_timestamps()
+
+async def rebuild_latest(args):
+    return await rebuild_latest_sensor_values()
+
+async def rebuild_rollups(args):
+    await ensure_rollup_indexes()
+    return await rebuild_sensor_rollups(args.digital_twin)
+
+async def replay_wal(args):
+    # The server must be stopped: the running ingestion pipeline replays the log by itself
+    wal = create_write_ahead_log()
+    wal.open()
+    try:
+        return await replay_write_ahead_log(wal, args.batch_size)
+    finally:
+        wal.close()
+
+async def run_command(args):
+    await connect_to_mongo()
+    try:
+        result = await args.handler(args)
+    finally:
+        await close_mongo_connection()
+    print(json.dumps(result, indent=2, default=str))
+
+def main():
+    parser = argparse.ArgumentParser(description="MetaTwin maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    migrate_parser = subparsers.add_parser(
+        "migrate-sensor-buckets",
+        help="Copy the sensor history embedded in digital twins into the bucket collection"
+    )
+    migrate_parser.add_argument(
+        "--purge",
+        action="store_true",
+        help="Remove the embedded history from the twin document after copying"
+    )
+    migrate_parser.set_defaults(handler=migrate_sensor_buckets)
+    
+    timestamps_parser = subparsers.add_parser(
+        "migrate-sensor-timestamps",
+        help="Convert sensor timestamps stored as ISO-8601 strings into UTC dates"
+    )
+    timestamps_parser.set_defaults(handler=migrate_timestamps)
+    
+    latest_parser = subparsers.add_parser(
+        "rebuild-latest-state",
+        help="Rebuild the latest value of each sensor stored in digital twins from the history"
+    )
+    latest_parser.set_defaults(handler=rebuild_latest)
+    
+    rollups_parser = subparsers.add_parser(
+        "rebuild-rollups",
+        help="Recompute the minute, hour and day sensor rollups from the raw samples"
+    )
+    rollups_parser.add_argument(
+        "--digital-twin",
+        default=None,
+        help="Only rebuild the rollups of this digital twin"
+    )
+    rollups_parser.set_defaults(handler=rebuild_rollups)
+    
+    replay_parser = subparsers.add_parser(
+        "replay-wal",
+        help="Replay unapplied write-ahead log records into MongoDB (server must be stopped)"
+    )
+    replay_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=settings.WAL_REPLAY_BATCH_SIZE,
+        help="Number of records written per bulk operation"
+    )
+    replay_parser.set_defaults(handler=replay_wal)
+    
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_command(args))
+
+if __name__ == "__main__":
+    main()
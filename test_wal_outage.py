@@ -0,0 +1,137 @@
+import asyncio
+
+import datetime
+import json
+import os
+
+from pymongo.errors import DocumentTooLarge, ServerSelectionTimeoutError
+
+import app.api.endpoints.devices as devices_endpoint
+import app.services.device_cache as device_cache
+import app.services.ingestion_queue as ingestion_queue
+import app.services.write_ahead_log as write_ahead_log
+from app.api.auth import get_device_by_api_key
+from app.services.ingestion_queue import IngestionPipeline
+from app.services.write_ahead_log import WriteAheadLog
+
+DEVICE = {"id": "device-1", "template_id": "template-1", "digital_twin_id": "twin-1", "owner_id": "user-1"}
+TEMPLATE = {
+    "id": "template-1",
+    "name": "thermometer",
+    "attributes": {"temperature": {"name": "temperature", "type": "number", "unit_measure": "C"}}
+}
+
+class FakeDatabase:
+    """Database che può essere reso irraggiungibile, registrando i campioni scritti"""
+
+    def __init__(self):
+        self.up = True
+        self.samples = []
+        # Twin i cui update vengono sempre rifiutati da MongoDB
+        self.rejected_twins = set()
+
+    def check(self):
+        if not self.up:
+            raise ServerSelectionTimeoutError("database unreachable")
+
+    async def command(self, name):
+        self.check()
+
+    async def list_documents(self, collection_name, query=None, projection=None):
+        self.check()
+        return [dict(DEVICE)] if query == {"api_key": "device-key"} else []
+
+    async def get_document(self, collection_name, document_id, projection=None):
+        self.check()
+        return dict(TEMPLATE)
+
+    async def update_document(self, collection_name, document_id, data):
+        self.check()
+        return True
+
+    async def write_sensor_samples_bulk(self, entries, skip_applied=False, deduplicate=True):
+        self.check()
+        if any(entry[0] in self.rejected_twins for entry in entries):
+            raise DocumentTooLarge("digital twin document exceeds 16 MB")
+        self.samples.extend(entries)
+        return 0
+
+def test_device_data_sent_during_outage_is_replayed(tmp_path, monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(device_cache, "list_documents", database.list_documents)
+    monkeypatch.setattr(device_cache, "get_document", database.get_document)
+    monkeypatch.setattr(devices_endpoint, "update_document", database.update_document)
+    monkeypatch.setattr(ingestion_queue, "write_sensor_samples_bulk", database.write_sensor_samples_bulk)
+    monkeypatch.setattr(write_ahead_log, "write_sensor_samples_bulk", database.write_sensor_samples_bulk)
+    monkeypatch.setattr(ingestion_queue, "get_database", lambda: database)
+    # Le voci scadono subito: durante l'interruzione vengono riusate perché il database non risponde
+    monkeypatch.setattr(device_cache.devices_by_api_key, "ttl", 0)
+    monkeypatch.setattr(device_cache.device_templates, "ttl", 0)
+    device_cache.devices_by_api_key.clear()
+    device_cache.device_templates.clear()
+
+    wal = WriteAheadLog(directory=str(tmp_path), segment_bytes=1024 * 1024, fsync_interval=0.001)
+    pipeline = IngestionPipeline(flush_size=10, flush_interval=0.01, high_water_mark=100, retry_after=1, wal=wal)
+    monkeypatch.setattr(devices_endpoint, "ingestion_pipeline", pipeline)
+
+    async def send(value):
+        device = await get_device_by_api_key("device-key")
+        return await devices_endpoint.send_device_data(
+            data={"temperature": value}, device=device, idempotency_key=None
+        )
+
+    async def wait_for(condition):
+        for _ in range(500):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("condition not reached")
+
+    async def scenario():
+        await pipeline.start()
+        await send(20.0)
+        await wait_for(lambda: len(database.samples) == 1)
+
+        database.up = False
+        responses = [await send(21.0), await send(22.0)]
+        assert all(response["queued"] for response in responses)
+        await wait_for(lambda: pipeline.degraded)
+        assert len(database.samples) == 1
+
+        database.up = True
+        await wait_for(lambda: not pipeline.degraded)
+        await pipeline.stop()
+
+    asyncio.run(scenario())
+
+    values = [sample["value"] for _, _, sample, _ in database.samples]
+    assert values == [20.0, 21.0, 22.0]
+    assert wal.applied_lsn == wal.last_lsn == 3
+
+def test_rejected_records_are_quarantined(tmp_path, monkeypatch):
+    database = FakeDatabase()
+    database.rejected_twins.add("twin-too-large")
+    monkeypatch.setattr(ingestion_queue, "write_sensor_samples_bulk", database.write_sensor_samples_bulk)
+    monkeypatch.setattr(write_ahead_log, "write_sensor_samples_bulk", database.write_sensor_samples_bulk)
+    monkeypatch.setattr(ingestion_queue, "get_database", lambda: database)
+
+    wal = WriteAheadLog(directory=str(tmp_path), segment_bytes=1024 * 1024, fsync_interval=0.001)
+    pipeline = IngestionPipeline(flush_size=10, flush_interval=0.01, high_water_mark=100, retry_after=1, wal=wal)
+    now = datetime.datetime(2024, 1, 1)
+
+    async def scenario():
+        await pipeline.start()
+        await pipeline.enqueue([
+            (twin_id, "temperature", {"timestamp": now + datetime.timedelta(seconds=i), "value": i, "unit_measure": "C"})
+            for i, twin_id in enumerate(["twin-1", "twin-too-large", "twin-2"])
+        ])
+        await pipeline.stop()
+
+    asyncio.run(scenario())
+
+    assert not pipeline.degraded
+    assert [entry[0] for entry in database.samples] == ["twin-1", "twin-2"]
+    assert wal.applied_lsn == wal.last_lsn == 3
+    with open(os.path.join(str(tmp_path), write_ahead_log.QUARANTINE_FILE)) as f:
+        quarantined = [json.loads(line) for line in f]
+    assert [record["digital_twin_id"] for record in quarantined] == ["twin-too-large"]